@@ -1,6 +1,17 @@
 # app.py
+import os
+import time
 import streamlit as st
-from chatbot import load_models_and_kb, retrieve_relevant_chunks, generate_response
+
+_import_start = time.perf_counter()
+from chatbot import (start_background_load, current_kb, retrieve_relevant_chunks, rerank_chunks,
+                     generate_response_stream)
+from metrics import METRICS
+CHATBOT_IMPORT_SECONDS = time.perf_counter() - _import_start  # Cheap: heavy libraries load in the background
+
+# --- Configuration ---
+FIRST_QUERY_WAIT_SECONDS = 60  # How long a query sent during startup waits for the models before being declined
+SHOW_METRICS = os.getenv("SHOW_METRICS", "0") == "1"  # Default of the sidebar's pipeline metrics toggle
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -10,17 +21,22 @@ st.set_page_config(
 )
 
 # --- Load Models and KB ---
-# Use st.cache_resource to load models only once
+# Use st.cache_resource so the background load is started once per process, not on every rerun.
+# After a failed load the "Retry loading" button clears the cache, which starts a fresh load.
 @st.cache_resource
 def load_resources():
-    """Loads all necessary models and data. Cached by Streamlit."""
-    if not load_models_and_kb():
-        st.error("Failed to load necessary models or knowledge base. Please check logs.")
-        return False
-    return True
+    """Starts loading models and data in a background thread; returns the shared load state."""
+    return start_background_load()
 
 # --- Initialize ---
-models_loaded = load_resources()
+load_state = load_resources()  # Returns immediately; the page renders while models load
+if load_state.status == 'failed':
+    st.error("Failed to load necessary models or knowledge base. Please check logs.")
+    if st.button("Retry loading"):
+        load_resources.clear()  # Otherwise the cached, failed load state is returned forever
+        st.rerun()
+elif not load_state.ready:
+    st.info("Warming up the models and knowledge base... You can type your question meanwhile.")
 
 # --- UI Elements ---
 st.title("🍽️ Zomato Restaurant Chatbot")
@@ -37,7 +53,14 @@ for message in st.session_state.messages:
 
 # React to user input
 if prompt := st.chat_input("Ask something about restaurants... (e.g., 'Any vegetarian starters?')"):
-    if not models_loaded:
+    # Queue the first queries behind the startup load, up to FIRST_QUERY_WAIT_SECONDS
+    if load_state.status == 'loading':
+        with st.spinner("Still loading models and knowledge base..."):
+            load_state.wait(FIRST_QUERY_WAIT_SECONDS)
+
+    if load_state.status == 'loading':
+        st.warning("The chatbot is still starting up. Please try again in a few seconds.")
+    elif not load_state.ready:
         st.error("Chatbot is not available due to loading errors.")
     else:
         # Display user message in chat message container
@@ -46,22 +69,23 @@ if prompt := st.chat_input("Ask something about restaurants... (e.g., 'Any veget
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": prompt})
 
-        # Generate response
-        with st.spinner("Thinking..."):
-            try:
-                # 1. Retrieve relevant context
-                relevant_chunks = retrieve_relevant_chunks(prompt)
+        # One metrics record per question: retrieval, rerank, prompt assembly and generation stages
+        with METRICS.request('chat'):
+            # Retrieve relevant context
+            relevant_chunks = []
+            with st.spinner("Searching restaurants..."):
+                try:
+                    relevant_chunks = rerank_chunks(prompt, retrieve_relevant_chunks(prompt))
+                except Exception as e:
+                    st.error(f"An error occurred: {e}")  # Show error in UI as well
 
-                # 2. Generate response using RAG
-                response = generate_response(prompt, relevant_chunks)
-
-            except Exception as e:
-                response = f"An error occurred: {e}"
-                st.error(response) # Show error in UI as well
-
-        # Display assistant response in chat message container
-        with st.chat_message("assistant"):
-            st.markdown(response)
+            # Stream the assistant response into the chat message container as it is generated
+            with st.chat_message("assistant"):
+                try:
+                    response = st.write_stream(generate_response_stream(prompt, relevant_chunks))
+                except Exception as e:
+                    response = f"An error occurred: {e}"
+                    st.error(response)
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": response})
 
@@ -76,6 +100,25 @@ with st.sidebar:
     **Models:** Uses Hugging Face's Sentence Transformers for retrieval
     and Flan-T5 for generation.
     """)
-    if not models_loaded:
+    if load_state.status == 'failed':
         st.warning("Models failed to load. Chatbot may not function correctly.")
 
+    st.header("Startup")
+    st.markdown(f"**Status:** {load_state.status} ({load_state.elapsed():.1f} s)")
+    timings = [("import chatbot", CHATBOT_IMPORT_SECONDS)] + list(load_state.timings.items())
+    st.markdown("\n".join(f"- {step}: {seconds:.2f} s" for step, seconds in timings))
+    served_kb = current_kb()
+    if served_kb is not None:
+        # Updated in place when knowledge_base.py publishes a new version (shown on the next rerun)
+        st.markdown(f"**Knowledge base:** {served_kb.describe()}")
+
+    if st.checkbox("Show pipeline metrics", value=SHOW_METRICS):
+        st.header("Pipeline Metrics")
+        snapshot = METRICS.snapshot()
+        if snapshot['stages']:
+            st.table([{"stage": stage, "count": stats['count'], "mean ms": round(stats['mean_ms'], 2),
+                       "p50 ms": round(stats['p50_ms'], 2), "p95 ms": round(stats['p95_ms'], 2)}
+                      for stage, stats in sorted(snapshot['stages'].items())])
+            st.markdown("\n".join(f"- {name}: {value:,}" for name, value in sorted(snapshot['counters'].items())))
+        else:
+            st.caption("No questions answered yet.")
@@ -0,0 +1,86 @@
+# bench_jsonld.py
+# Compares the regex JSON-LD scan against the full BeautifulSoup parse on saved pages.
+import os
+import glob
+import gzip
+import json
+import time
+import argparse
+import statistics
+from scraper import PAGE_CACHE_DIR, extract_ld_json_fast, extract_ld_json_soup, find_restaurant_schema
+
+
+# --- Helper Functions ---
+def load_pages(page_dir):
+    """Loads saved pages: *.html.gz (the scraper's page cache) and plain *.html files."""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(page_dir, "*.html.gz"))):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            pages.append((os.path.basename(path), f.read()))
+    for path in sorted(glob.glob(os.path.join(page_dir, "*.html"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append((os.path.basename(path), f.read()))
+    return pages
+
+
+def synthetic_page(index, size_kb=400):
+    """Builds a Zomato-sized page with one restaurant JSON-LD block buried in markup."""
+    schema = {
+        "@context": "https://schema.org", "@type": "Restaurant", "name": f"Synthetic Restaurant {index}",
+        "openingHours": "11am – 11pm (Today)", "telephone": "+910000000000", "servesCuisine": "North Indian, Chinese",
+        "address": {"streetAddress": f"{index} Civil Lines", "addressLocality": "Roorkee Locality, Roorkee",
+                    "addressRegion": "Roorkee", "addressCountry": "India"}
+    }
+    filler_block = '<div class="sc-card"><span class="sc-title">Item</span><p>Lorem ipsum dolor sit amet.</p></div>\n'
+    filler = filler_block * (size_kb * 1024 // len(filler_block) // 2)
+    return (f'<!DOCTYPE html><html><head><title>Restaurant {index}</title>'
+            f'<script type="application/ld+json">{json.dumps({"@type": "BreadcrumbList"})}</script></head>'
+            f'<body>{filler}<script type="application/ld+json">{json.dumps(schema, ensure_ascii=False)}</script>'
+            f'{filler}</body></html>')
+
+
+def time_path(pages, extract, repeats):
+    """Returns per-page timings (ms, best of `repeats`) and the schemas found by one extraction path."""
+    timings, schemas = [], []
+    for _, html in pages:
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            schema = find_restaurant_schema(extract(html))
+            best = min(best, time.perf_counter() - start)
+        timings.append(best * 1000)
+        schemas.append(schema)
+    return timings, schemas
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark JSON-LD extraction: regex scan vs. BeautifulSoup.")
+    parser.add_argument("--pages", default=PAGE_CACHE_DIR,
+                        help="Directory of saved pages (*.html or the scraper's *.html.gz page cache).")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Benchmark N generated ~400 KB pages instead of saved pages.")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per page; the best time is kept.")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        pages = [(f"synthetic_{i}.html", synthetic_page(i)) for i in range(args.synthetic)]
+    else:
+        pages = load_pages(args.pages)
+    if not pages:
+        print(f"No saved pages found in {args.pages}. Run scraper.py first or pass --synthetic N.")
+        exit()
+
+    total_kb = sum(len(html.encode('utf-8')) for _, html in pages) / 1024
+    print(f"Benchmarking {len(pages)} pages ({total_kb:.0f} KB total, best of {args.repeats} runs each)...")
+
+    fast_ms, fast_schemas = time_path(pages, extract_ld_json_fast, args.repeats)
+    soup_ms, soup_schemas = time_path(pages, extract_ld_json_soup, args.repeats)
+
+    mismatches = [name for (name, _), a, b in zip(pages, fast_schemas, soup_schemas) if a != b]
+    for label, timings in (("regex scan", fast_ms), ("BeautifulSoup", soup_ms)):
+        print(f"{label:>14}: total {sum(timings):9.1f} ms | median {statistics.median(timings):7.2f} ms/page "
+              f"| max {max(timings):7.2f} ms/page")
+    print(f"Speedup: {sum(soup_ms) / max(sum(fast_ms), 1e-9):.1f}x")
+    print(f"Pages where the two paths disagree: {len(mismatches)}"
+          + (f" ({', '.join(mismatches[:5])}{', ...' if len(mismatches) > 5 else ''})" if mismatches else ""))
@@ -0,0 +1,79 @@
+# bench_kb_build.py
+# Times RestaurantKnowledgeBase.build_knowledge_base row-wise vs. vectorized on a synthetic CSV.
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import pandas as pd
+from scraper import RestaurantKnowledgeBase
+
+# --- Configuration ---
+SEED_CSV = "restaurants_scraped_data.csv" # Real scraped rows used as templates for synthetic ones
+OPENING_HOURS_VARIANTS = [
+    "11am – 11pm (Today)", "12noon – 12midnight (Today)", "Opens tomorrow at 11am",
+    "Opens tomorrow at 10:30 am", "Closed", None
+]
+
+
+# --- Helper Functions ---
+def make_synthetic_csv(path, num_rows, seed=0):
+    """Writes a num_rows CSV shaped like the scraper output, varying names, hours and missing fields."""
+    rng = random.Random(seed)
+    templates = pd.read_csv(SEED_CSV).to_dict('records')
+    rows = []
+    for i in range(num_rows):
+        row = dict(rng.choice(templates))
+        row['Name'] = f"{row['Name']} {i}"
+        row['Opening_Hours'] = rng.choice(OPENING_HOURS_VARIANTS)
+        if rng.random() < 0.05:
+            row['Street'] = None
+        if rng.random() < 0.05:
+            row['Phone'] = None
+        rows.append(row)
+    pd.DataFrame(rows).to_csv(path, index=False)
+
+
+def nan_to_none(value):
+    """Recursively replaces float NaN with None so results compare the way they serialize to JSON."""
+    if isinstance(value, dict):
+        return {k: nan_to_none(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [nan_to_none(v) for v in value]
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def time_build(csv_path, vectorized):
+    """Builds the KB once with a fixed random seed; returns (seconds, serialized result)."""
+    random.seed(0) # Same beverage samples for both paths
+    kb = RestaurantKnowledgeBase(csv_path)
+    start = time.perf_counter()
+    kb.build_knowledge_base(vectorized=vectorized)
+    elapsed = time.perf_counter() - start
+    result = nan_to_none({'restaurants': kb.knowledge_base, 'indexes': kb.indexes})
+    return elapsed, json.dumps(result, default=str)
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark row-wise vs. vectorized knowledge base builds.")
+    parser.add_argument("--rows", type=int, default=100_000, help="Number of synthetic CSV rows.")
+    parser.add_argument("--skip-rowwise", action="store_true", help="Only time the vectorized path.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "synthetic_restaurants.csv")
+        print(f"Generating synthetic CSV with {args.rows} rows...")
+        make_synthetic_csv(csv_path, args.rows)
+
+        vectorized_s, vectorized_out = time_build(csv_path, vectorized=True)
+        print(f"  vectorized: {vectorized_s:8.2f} s")
+
+        if not args.skip_rowwise:
+            rowwise_s, rowwise_out = time_build(csv_path, vectorized=False)
+            print(f"    row-wise: {rowwise_s:8.2f} s")
+            print(f"Speedup: {rowwise_s / vectorized_s:.1f}x")
+            print(f"Outputs identical: {rowwise_out == vectorized_out}")
@@ -0,0 +1,287 @@
+# bench_retrieval.py
+# Times the retrieval backends behind retrieve_relevant_chunks on synthetic KBs of increasing size.
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from search_engine import (DenseSearchEngine, FaissSearchEngine, BM25Index, ShardedSearch, FAISS_INDEX_TYPES,
+                           build_faiss_index, normalize_rows, reciprocal_rank_fusion)
+from kb_store import EMBEDDING_PRECISIONS, quantize_embeddings, shard_ranges, shard_offsets
+
+# --- Configuration ---
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+BACKENDS = ('numpy', 'sharded') + FAISS_INDEX_TYPES + ('bm25', 'hybrid')
+DENSE_BACKENDS = ('numpy', 'sharded') + FAISS_INDEX_TYPES  # Backends with a recall@k against exact search
+EMBEDDING_DIM = 384  # all-MiniLM-L6-v2
+MENU_ITEMS_PER_RESTAURANT = 40  # Chunks per restaurant: one general chunk plus its menu items
+QUERY_NOISE = 0.35  # Noise added to a chunk embedding to make a query near it
+NUM_QUERIES = 200
+WARMUP_QUERIES = 10
+TOP_K = 20  # chatbot.HYBRID_TOP_K
+HYBRID_CANDIDATES = 100  # chatbot.HYBRID_CANDIDATES
+RRF_K = 60
+BATCH_SIZE = 32  # Queries per search_batch call for the throughput run
+FAISS_NPROBE = 16  # chatbot.FAISS_NPROBE
+FAISS_EF_SEARCH = 128  # chatbot.FAISS_EF_SEARCH
+RESULTS_FILE = "bench_retrieval_results.json"
+
+DISHES = ["Paneer Tikka", "Chicken Biryani", "Masala Dosa", "Veg Hakka Noodles", "Butter Chicken", "Dal Makhani",
+          "Chole Bhature", "Gulab Jamun", "Cold Coffee", "Margherita Pizza", "Chicken Momos", "Veg Burger",
+          "Mutton Rogan Josh", "Aloo Paratha", "Rasmalai", "Fish Curry", "Gluten Free Brownie", "Falafel Wrap"]
+CATEGORIES = ["Starters", "Main Course", "Desserts", "Beverages", "Breads", "Rice", "Chinese", "Combos"]
+CUISINES = ["North Indian", "South Indian", "Chinese", "Biryani", "Desserts", "Fast Food", "Cafe", "Mughlai"]
+LOCALITIES = ["Civil Lines", "Roorkee", "Haridwar", "Dehradun", "Rajpur Road", "Clock Tower"]
+
+
+# --- Synthetic Knowledge Base ---
+def make_synthetic_chunks(num_rows, seed=0):
+    """Chunk texts shaped like knowledge_base.py's general and menu_item chunks, grouped by restaurant."""
+    rng = random.Random(seed)
+    texts, restaurant_of = [], []
+    restaurant = 0
+    while len(texts) < num_rows:
+        name = f"{rng.choice(['Spice', 'Tandoor', 'Curry', 'Dosa', 'Wok', 'Cafe'])} House {restaurant}"
+        texts.append(f"Restaurant Name: {name}. Cuisine types: {', '.join(rng.sample(CUISINES, 2))}. "
+                     f"Price Range: ₹{rng.choice([200, 400, 600])} for two. Address: {rng.choice(LOCALITIES)}. "
+                     f"Hours: 11am – 11pm. Current Status: {rng.choice(['open', 'closed'])}.")
+        restaurant_of.append(restaurant)
+        for _ in range(min(MENU_ITEMS_PER_RESTAURANT, num_rows - len(texts))):
+            texts.append(f"Restaurant: {name}. Menu Item: {rng.choice(DISHES)}. "
+                         f"Category: {rng.choice(CATEGORIES)}. Price: ₹{rng.randrange(60, 600)}.00.")
+            restaurant_of.append(restaurant)
+        restaurant += 1
+    return texts, np.asarray(restaurant_of)
+
+
+def make_synthetic_embeddings(restaurant_of, dim=EMBEDDING_DIM, seed=0, block_size=65536):
+    """Unit-length float32 embeddings clustered by restaurant, like real chunks of one menu."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((int(restaurant_of.max()) + 1, dim), dtype=np.float32)
+    embeddings = np.empty((len(restaurant_of), dim), dtype=np.float32)
+    for start in range(0, len(restaurant_of), block_size):
+        rows = restaurant_of[start:start + block_size]
+        embeddings[start:start + len(rows)] = normalize_rows(
+            centers[rows] + rng.standard_normal((len(rows), dim), dtype=np.float32))
+    return embeddings
+
+
+def make_queries(texts, embeddings, num_queries, seed=0):
+    """Query (text, embedding) pairs near random chunks: the chunk's dish/name words plus a noisy embedding."""
+    rng = np.random.default_rng(seed + 1)
+    rows = rng.choice(len(texts), size=num_queries, replace=len(texts) < num_queries)
+    noise = rng.standard_normal((num_queries, embeddings.shape[1]), dtype=np.float32)
+    query_embeddings = normalize_rows(embeddings[rows] + QUERY_NOISE * noise)
+    query_texts = [texts[i].split(". ")[1].split(": ")[-1] for i in rows]  # Menu item or cuisine list
+    return query_texts, query_embeddings
+
+
+def exact_top_k(embeddings, query_embeddings, top_k, batch_size=BATCH_SIZE):
+    """Ground-truth top_k row ids per query from exact float32 search."""
+    engine = DenseSearchEngine(embeddings, normalized=True)
+    truth = []
+    for start in range(0, len(query_embeddings), batch_size):
+        truth.extend(indices for indices, _ in engine.search_batch(query_embeddings[start:start + batch_size], top_k))
+    return truth
+
+
+# --- Backends ---
+def build_backend(backend, precision, embeddings, texts, shards, executor):
+    """Returns (engine, index bytes) for one backend; engines share chatbot.py's search(query, top_k) API."""
+    if backend == 'numpy':
+        stored, scales = quantize_embeddings(embeddings, precision)
+        return DenseSearchEngine(stored, scales=scales, normalized=True), stored.nbytes + (
+            scales.nbytes if scales is not None else 0)
+    if backend == 'sharded':
+        engines, nbytes = [], 0
+        for start, end in shard_ranges(len(embeddings), shards):
+            stored, scales = quantize_embeddings(embeddings[start:end], precision)
+            engines.append(DenseSearchEngine(stored, scales=scales, normalized=True))
+            nbytes += stored.nbytes + (scales.nbytes if scales is not None else 0)
+        return ShardedSearch(engines, shard_offsets([len(engine) for engine in engines]), executor), nbytes
+    if backend in FAISS_INDEX_TYPES:
+        import faiss
+        index = build_faiss_index(embeddings, backend)
+        return FaissSearchEngine(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH), \
+            faiss.serialize_index(index).nbytes
+    lexical = BM25Index.build(texts)
+    nbytes = lexical.term_offsets.nbytes + lexical.doc_ids.nbytes + lexical.weights.nbytes
+    if backend == 'bm25':
+        return lexical, nbytes
+    dense = DenseSearchEngine(embeddings, normalized=True)
+    return (dense, lexical), nbytes + embeddings.nbytes
+
+
+def search_one(backend, engine, query_text, query_embedding, top_k):
+    """One retrieval as chatbot.retrieve_relevant_chunks runs it (minus query encoding); returns row ids."""
+    if backend == 'bm25':
+        return engine.search(query_text, top_k)[0]
+    if backend == 'hybrid':
+        dense, lexical = engine
+        dense_indices, _ = dense.search(query_embedding, max(top_k, HYBRID_CANDIDATES))
+        lexical_indices, _ = lexical.search(query_text, HYBRID_CANDIDATES)
+        return reciprocal_rank_fusion([dense_indices, lexical_indices], k=RRF_K)[0][:top_k]
+    return engine.search(query_embedding, top_k)[0]
+
+
+def search_all(backend, engine, query_texts, query_embeddings, top_k, batch_size):
+    """Runs every query, batched through search_batch where the backend has one."""
+    if backend in DENSE_BACKENDS:
+        results = []
+        for start in range(0, len(query_embeddings), batch_size):
+            results.extend(indices for indices, _ in engine.search_batch(query_embeddings[start:start + batch_size], top_k))
+        return results
+    return [search_one(backend, engine, text, embedding, top_k) for text, embedding in zip(query_texts, query_embeddings)]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_case(backend, precision, embeddings, texts, queries, truth, args, executor):
+    """Builds one backend and measures build time, latency, throughput, memory and recall@k."""
+    query_texts, query_embeddings = queries
+
+    tracemalloc.start()  # Tracks NumPy and Python allocations (not FAISS's C++ heap; see index_mb)
+    start = time.perf_counter()
+    engine, index_bytes = build_backend(backend, precision, embeddings, texts, args.shards, executor)
+    build_s = time.perf_counter() - start
+    build_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    for text, embedding in list(zip(query_texts, query_embeddings))[:WARMUP_QUERIES]:
+        search_one(backend, engine, text, embedding, args.top_k)
+
+    latencies, found = [], []
+    for text, embedding in zip(query_texts, query_embeddings):
+        start = time.perf_counter()
+        found.append(search_one(backend, engine, text, embedding, args.top_k))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    search_all(backend, engine, query_texts, query_embeddings, args.top_k, args.batch_size)
+    throughput = len(query_texts) / (time.perf_counter() - start)
+
+    tracemalloc.start()
+    search_all(backend, engine, query_texts, query_embeddings, args.top_k, args.batch_size)
+    search_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    recall = None
+    if backend in DENSE_BACKENDS:
+        recall = float(np.mean([len(np.intersect1d(got, want)) / max(1, len(want)) for got, want in zip(found, truth)]))
+
+    return {
+        'rows': len(texts), 'backend': backend, 'precision': precision,
+        'build_s': round(build_s, 4),
+        'p50_ms': round(percentile(latencies, 50), 4), 'p99_ms': round(percentile(latencies, 99), 4),
+        'mean_ms': round(statistics.fmean(latencies), 4), 'throughput_qps': round(throughput, 1),
+        'index_mb': round(index_bytes / 2**20, 2), 'build_peak_mb': round(build_peak / 2**20, 2),
+        'search_peak_mb': round(search_peak / 2**20, 2),
+        f'recall@{args.top_k}': None if recall is None else round(recall, 4),
+    }
+
+
+def run_cases(args):
+    """All requested (size, backend, precision) cases; FAISS, BM25 and hybrid only run at float32."""
+    results = []
+    executor = ThreadPoolExecutor(max_workers=args.shards, thread_name_prefix="shard-search")
+    for rows in args.sizes:
+        print(f"\nGenerating synthetic KB with {rows:,} chunks...")
+        texts, restaurant_of = make_synthetic_chunks(rows)
+        embeddings = make_synthetic_embeddings(restaurant_of)
+        queries = make_queries(texts, embeddings, args.queries)
+        truth = exact_top_k(embeddings, queries[1], args.top_k)
+        for backend in args.backends:
+            precisions = args.precisions if backend in ('numpy', 'sharded') else ['float32']
+            for precision in precisions:
+                try:
+                    result = run_case(backend, precision, embeddings, texts, queries, truth, args, executor)
+                except ImportError as e:
+                    print(f"  Skipping {backend}: {e}")
+                    break
+                results.append(result)
+                print_result(result, args.top_k)
+    executor.shutdown()
+    return results
+
+
+# --- Reporting ---
+def print_result(result, top_k):
+    recall = result[f'recall@{top_k}']
+    print(f"  {result['backend']:>8} {result['precision']:>7} | p50 {result['p50_ms']:8.3f} ms | "
+          f"p99 {result['p99_ms']:8.3f} ms | {result['throughput_qps']:9.1f} q/s | "
+          f"index {result['index_mb']:8.1f} MB | peak {max(result['build_peak_mb'], result['search_peak_mb']):8.1f} MB | "
+          f"recall@{top_k} {'-' if recall is None else f'{recall:.3f}'} | build {result['build_s']:.2f} s")
+
+
+def git_commit():
+    """Short hash of HEAD (suffixed '-dirty' with uncommitted changes), or None outside a git checkout."""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir,
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old, new, top_k):
+    """Prints p50/p99/throughput ratios (new / old) for the cases present in both result files."""
+    key = lambda result: (result['rows'], result['backend'], result['precision'])
+    previous = {key(result): result for result in old['results']}
+    print(f"\nCompared with {old['meta'].get('commit')} (new / old; < 1.00 is faster for latency):")
+    for result in new['results']:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        ratio = lambda field: result[field] / before[field] if before[field] else float('nan')
+        recall_field = f'recall@{top_k}'
+        recall = ("" if result.get(recall_field) is None or before.get(recall_field) is None
+                  else f" | recall {before[recall_field]:.3f} -> {result[recall_field]:.3f}")
+        print(f"  {result['rows']:>9,} {result['backend']:>8} {result['precision']:>7} | p50 {ratio('p50_ms'):5.2f}x | "
+              f"p99 {ratio('p99_ms'):5.2f}x | throughput {ratio('throughput_qps'):5.2f}x{recall}")
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark retrieval latency, throughput, memory and recall "
+                                                 "on synthetic knowledge bases.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Numbers of chunks to benchmark.")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS),
+                        help="'sharded' is numpy search over --shards shards; 'hybrid' is numpy + BM25 with RRF.")
+    parser.add_argument("--precisions", nargs="+", choices=EMBEDDING_PRECISIONS, default=list(EMBEDDING_PRECISIONS),
+                        help="Embedding storage precisions for the numpy and sharded backends.")
+    parser.add_argument("--queries", type=int, default=NUM_QUERIES, help="Queries per case.")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Chunks retrieved per query (recall@k uses it too).")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Queries per batch in the throughput run.")
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1, help="Shards for the 'sharded' backend.")
+    parser.add_argument("--output", default=RESULTS_FILE, help="Where to write the JSON results.")
+    parser.add_argument("--compare", default=None, help="Earlier results file to compare against.")
+    args = parser.parse_args()
+
+    print(f"Benchmarking {', '.join(args.backends)} on {', '.join(f'{rows:,}' for rows in args.sizes)} chunks "
+          f"({args.queries} queries, top {args.top_k}, {EMBEDDING_DIM}-dim embeddings)...")
+    report = {
+        'meta': {
+            'commit': git_commit(), 'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        },
+        'results': run_cases(args),
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(report['results'])} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_results(json.load(f), report, args.top_k)
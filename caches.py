@@ -0,0 +1,208 @@
+# caches.py
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+# --- Helper Functions ---
+def normalize_query(query):
+    """Canonical form of a query used as a cache key: lowercased, single-spaced, no trailing punctuation."""
+    return re.sub(r'\s+', ' ', str(query)).strip().rstrip('?!.').strip().lower()
+
+
+def chunk_set_fingerprint(chunks):
+    """Order-independent fingerprint of a retrieved chunk set, based on chunk contents."""
+    digest = hashlib.sha1()
+    for content in sorted(chunk.get('content', '') for chunk in chunks):
+        digest.update(content.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+# --- Caches ---
+class LRUCache:
+    """Thread-safe, size-bounded least-recently-used cache."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)  # Evict the least recently used entry
+
+    def items(self):
+        """Returns a snapshot of (key, value) pairs, least recently used first."""
+        with self._lock:
+            return list(self._data.items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class QueryEmbeddingCache:
+    """LRU cache of normalized query text -> query embedding, optionally persisted to disk.
+
+    The model name is stored with the persisted file, so switching embedding
+    models never serves stale vectors.
+    """
+
+    def __init__(self, model_name, maxsize=1024, path=None):
+        self.model_name = model_name
+        self.path = path
+        self.cache = LRUCache(maxsize)
+
+    def encode(self, queries, encode_fn):
+        """Returns a (len(queries) x dim) array of embeddings, calling encode_fn only for uncached queries."""
+        keys = [normalize_query(q) for q in queries]
+        vectors = [self.cache.get(key) for key in keys]
+
+        # Encode each distinct missing query once, in a single batch
+        missing = OrderedDict()
+        for key, query, vec in zip(keys, queries, vectors):
+            if vec is None and key not in missing:
+                missing[key] = query
+        if missing:
+            encoded = dict(zip(missing, encode_fn(list(missing.values()))))
+            for key, vec in encoded.items():
+                self.cache.put(key, np.asarray(vec, dtype=np.float32))
+            vectors = [vec if vec is not None else encoded[key] for key, vec in zip(keys, vectors)]
+
+        return np.vstack(vectors)
+
+    def warm_up(self, queries, encode_fn):
+        """Pre-encodes known frequent queries so their first real request is a cache hit."""
+        if queries:
+            self.encode(queries, encode_fn)
+
+    def load(self):
+        """Loads persisted entries from `path`. Returns the number of entries loaded."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path) as saved:
+                if str(saved['model_name']) != self.model_name:
+                    print(f"Ignoring query cache {self.path}: built with a different embedding model.")
+                    return 0
+                for key, vec in zip(saved['keys'].tolist(), saved['vectors']):
+                    self.cache.put(key, vec)
+            return len(self.cache)
+        except Exception as e:
+            print(f"Warning: Could not load query cache from {self.path}: {e}")
+            return 0
+
+    def save(self):
+        """Writes the cached entries to `path`, if persistence is enabled."""
+        if not self.path or len(self.cache) == 0:
+            return
+        items = self.cache.items()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = self.path + ".tmp.npz"
+            np.savez(tmp_path, model_name=np.array(self.model_name),
+                     keys=np.array([key for key, _ in items]),
+                     vectors=np.vstack([vec for _, vec in items]))
+            os.replace(tmp_path, self.path)  # Never leave a half-written cache behind
+        except Exception as e:
+            print(f"Warning: Could not save query cache to {self.path}: {e}")
+
+
+class SemanticResponseCache:
+    """Cache of generated answers keyed by query meaning and retrieved context.
+
+    A cached answer is reused when a new query's embedding has cosine similarity
+    of at least `similarity_threshold` with a cached query, and the retrieved
+    chunk set has the same fingerprint. Entries expire after `ttl_seconds`, the
+    least recently used entry is evicted beyond `maxsize`, and everything is
+    dropped when `version_fn()` (e.g. a fingerprint of the kb_data files) changes.
+    """
+
+    def __init__(self, maxsize=512, ttl_seconds=3600, similarity_threshold=0.95, version_fn=None):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_fn = version_fn
+        self._version = version_fn() if version_fn else None
+        self._entries = OrderedDict()  # id -> (chunk fingerprint, unit query vector, response, expires_at)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _check_version(self):
+        if self.version_fn is None:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            if self._entries:
+                print("Knowledge base changed on disk; clearing response cache.")
+            self._entries.clear()
+            self._version = version
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if entry[3] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, query_embedding, chunk_fingerprint):
+        """Returns a cached response for a similar query over the same context, or None."""
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            self._check_version()
+            self._expire(time.monotonic())
+            candidates = [(key, entry[1]) for key, entry in self._entries.items() if entry[0] == chunk_fingerprint]
+            if candidates:
+                similarities = np.vstack([vec for _, vec in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    key = candidates[best][0]
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][2]
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding, chunk_fingerprint, response):
+        """Stores a generated response."""
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            self._check_version()
+            self._entries[self._next_id] = (chunk_fingerprint, query, response, time.monotonic() + self.ttl_seconds)
+            self._next_id += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)  # Evict the least recently used entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -2,47 +2,358 @@
 import os
 import numpy as np
 import pickle
-from sentence_transformers import SentenceTransformer
-from numpy.linalg import norm
-import google.generativeai as genai
 import warnings
+import atexit
+import time
+import threading
+from contextlib import contextmanager
+from caches import QueryEmbeddingCache, SemanticResponseCache, chunk_set_fingerprint
+from context_packer import TokenCounter, pack_context
+from reranker import CrossEncoderReranker
+from generation import GenerationBlocked, GenerationCancelled, create_generator
+from metrics import METRICS, span, incr, create_sinks
+from encoders import encoder_id, get_tokenize_fn, load_encoder
+from concurrent.futures import ThreadPoolExecutor
+from search_engine import (DenseSearchEngine, FaissSearchEngine, BM25Index, BM25_INDEX_FILE_NAME, ShardedSearch,
+                           faiss_index_path, load_faiss_index, build_faiss_index, save_faiss_index,
+                           reciprocal_rank_fusion)
+from kb_store import (ChunkStore, FilterIndex, FILTER_INDEX_FILE_NAME, chunk_store_exists, load_embeddings,
+                      dequantize_embeddings,
+                      kb_files_fingerprint, read_shard_manifest, shard_offsets, ShardedChunkStore,
+                      ShardedFilterIndex, current_kb_version, resolve_kb_dir)
 
 warnings.filterwarnings("ignore")  # Suppress minor warnings
 
 # --- Configuration ---
-KB_DIR = "kb_data"
-CHUNKS_FILE = os.path.join(KB_DIR, "text_chunks.pkl")
-EMBEDDINGS_FILE = os.path.join(KB_DIR, "embeddings.npy")
+KB_DIR = "kb_data"  # Serves the version named in kb_data/CURRENT, or kb_data itself for an unversioned KB
+CHUNKS_FILE = "text_chunks.pkl"  # Legacy pickled chunks, used if no chunk store exists
+EMBEDDINGS_FILE = "embeddings.npy"
+# Seconds between checks for a newly published KB version, which is then loaded and swapped in; 0 disables
+KB_RELOAD_INTERVAL = float(os.getenv("KB_RELOAD_INTERVAL", "30"))
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'  # For retrieval
+# Query encoder: 'torch' (sentence-transformers), 'onnx' or 'onnx-int8' (ONNX Runtime, no torch in the process).
+# Use the same backend knowledge_base.py built the embeddings with.
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "torch")
 GEMINI_MODEL_NAME = 'gemini-2.0-flash'  # Or 'gemini-pro' - Flash is faster and often sufficient
-MAX_CONTEXT_TOKENS = 500  # For context length estimation (approx)
-TOP_K = 200  # Number of relevant chunks to retrieve
+# 'gemini' or 'stub'; the stub answers offline and deterministically (no GOOGLE_API_KEY), for load tests and CI
+GENERATOR_BACKEND = os.getenv("GENERATOR_BACKEND", "gemini")
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "30"))  # Seconds per call (per streamed part)
+GENERATION_RETRIES = int(os.getenv("GENERATION_RETRIES", "2"))
+GENERATION_MAX_CONCURRENCY = int(os.getenv("GENERATION_MAX_CONCURRENCY", "8"))  # Generator calls in flight at once
+STUB_LATENCY = float(os.getenv("STUB_LATENCY", "0.5"))  # Seconds until the stub's reply is complete
+STUB_FIRST_TOKEN_LATENCY = float(os.getenv("STUB_FIRST_TOKEN_LATENCY", "0.1"))
+STUB_OUTPUT_CHARS = int(os.getenv("STUB_OUTPUT_CHARS", "600"))
+STUB_JITTER = float(os.getenv("STUB_JITTER", "0"))  # Fraction by which the stub's latencies vary per prompt
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))  # Share of stub calls that fail (exercises the retries)
+RERANK_ENABLED = os.getenv("RERANK", "0") == "1"  # Cross-encoder rerank between retrieval and generation
+RERANK_MODEL_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2'  # Small local cross-encoder
+RERANK_TOP_N = 8  # Chunks passed on to generation after reranking
+MAX_CONTEXT_TOKENS = 4000  # Token budget for the retrieved context in the generation prompt
+TOP_K = 200  # Number of relevant chunks to retrieve (dense-only mode)
+HYBRID_TOP_K = 20  # Chunks kept after rank fusion; lexical matches make a much smaller context enough
+HYBRID_CANDIDATES = 100  # Candidates each retriever (dense, BM25) contributes to the fusion
+RRF_K = 60  # Reciprocal Rank Fusion constant; larger values flatten the rank weighting
+SIMILARITY_THRESHOLD = 0.3  # Minimum cosine similarity for a chunk to count as relevant
+# Retrieval backend: 'numpy' (exact brute force) or a FAISS index built by knowledge_base.py: 'flat', 'ivf', 'hnsw'
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "numpy")
+# Retrieval mode: 'hybrid' (BM25 + dense, fused) or 'dense'. Falls back to 'dense' if kb_data has no BM25 index.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+FAISS_NPROBE = 16  # IVF lists scanned per query (higher = better recall, slower)
+FAISS_EF_SEARCH = 128  # HNSW search depth (higher = better recall, slower)
+SHARD_SEARCH_WORKERS = os.cpu_count() or 1  # Threads searching the shards of a sharded KB in parallel
+EMBEDDINGS_MMAP = True  # Memory-map embeddings so worker processes share one page-cache copy
+QUERY_CACHE_SIZE = 4096  # Max distinct query embeddings kept in the LRU cache
+QUERY_CACHE_FILE = os.path.join(KB_DIR, "query_cache.npz")  # Set to None to keep the cache in memory only
+RESPONSE_CACHE_SIZE = 512  # Max cached generated answers
+RESPONSE_CACHE_TTL = 3600  # Seconds before a cached answer expires
+RESPONSE_CACHE_SIMILARITY = 0.95  # Min query cosine similarity to reuse an answer for the same context
+# Metrics sinks: comma-separated 'json' (one JSON line per request) and/or 'prometheus' (text file); empty = none.
+# Stage timings and counters are always kept in memory (metrics.METRICS) for the app sidebar.
+METRICS_SINKS = os.getenv("METRICS_SINKS", "")
+METRICS_JSON_LOG = os.getenv("METRICS_JSON_LOG", "metrics.jsonl")  # '-' prints the records instead
+METRICS_PROMETHEUS_FILE = os.getenv("METRICS_PROMETHEUS_FILE", "metrics.prom")
+# Frequent questions pre-encoded at startup so their first request skips the encoder
+WARMUP_QUERIES = [
+    "Which restaurants serve biryani?",
+    "What vegetarian options are available?",
+    "Tell me about restaurants in Roorkee",
+    "What is the price range of desserts?",
+    "Are there any restaurants open today?",
+    "Which restaurant has Chicken Tikka?",
+    "Tell me about gluten free food",
+]
 
 # --- Global Variables (Load models once) ---
+# The encoder (torch or onnxruntime) and google.generativeai are imported inside load_models_and_kb,
+# so importing this module stays cheap and the UI can render before the models are loaded.
 embedding_model = None
-gemini_model = None
-text_chunks = None  # Holds the loaded text chunks
-embeddings = None
+generator = None  # generation.Generator answering the prompts (Gemini or the offline stub)
+kb = None  # KnowledgeBase being served; replaced as a whole when a new version is published
+_kb_lock = threading.Lock()  # Serializes KB reloads
+_kb_watcher = None  # Thread polling kb_data/CURRENT for new versions
+_failed_kb_version = None  # Last version that failed to load; not retried until a newer one is published
+_shard_pool = None  # Thread pool shared by the shard searches, created on first use
+_metrics_sinks_added = False  # Set once the METRICS_SINKS are attached, so a retried load doesn't add them again
+query_cache = None  # QueryEmbeddingCache in front of embedding_model.encode
+response_cache = None  # SemanticResponseCache in front of the generator call
+reranker = None  # CrossEncoderReranker when RERANK_ENABLED
+token_counter = TokenCounter()  # Counts context tokens; uses the embedding model's tokenizer once it is loaded
 models_loaded = False  # Flag to track loading status
 
+
+class LoadState:
+    """Readiness of the model/KB load: 'not_started', 'loading', 'ready' or 'failed', plus step timings."""
+
+    def __init__(self):
+        self.status = 'not_started'
+        self.timings = {}  # Step name -> seconds, in load order
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    @property
+    def ready(self):
+        return self.status == 'ready'
+
+    def elapsed(self):
+        if not self.started_at:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def wait(self, timeout=None):
+        """Blocks until loading finishes (or `timeout` seconds pass); returns True if ready."""
+        self._done.wait(timeout)
+        return self.ready
+
+
+load_state = LoadState()
+_load_lock = threading.Lock()
+
+
+class KnowledgeBase:
+    """One loaded KB version: its chunks and the indexes over them.
+
+    Retrieval reads the `kb` global once per call and uses only that object, so
+    swapping in a new version never mixes chunk ids of one version with the
+    indexes of another, and queries already running finish on the old one.
+    """
+
+    def __init__(self, version, kb_dir, chunks, search_engine, filter_index=None, bm25_index=None,
+                 embeddings=None, num_shards=0):
+        self.version = version  # None for an unversioned KB
+        self.kb_dir = kb_dir
+        self.chunks = chunks  # A ChunkStore (ShardedChunkStore for a sharded KB), or a list for legacy pickles
+        self.search_engine = search_engine  # Dense index over `embeddings` (ShardedSearch for a sharded KB)
+        self.filter_index = filter_index  # FilterIndex for metadata-filtered search (None if the KB has none)
+        self.bm25_index = bm25_index  # BM25Index for hybrid retrieval (None in dense mode or if the KB has none)
+        self.embeddings = embeddings  # None for a sharded KB; each shard engine holds its own
+        self.num_shards = num_shards
+        self.loaded_at = time.time()
+
+    def fingerprint(self):
+        """Changes whenever the served KB changes; used to invalidate cached answers."""
+        return self.version or kb_files_fingerprint(self.kb_dir)
+
+    def describe(self):
+        return (f"version {self.version or '(unversioned)'}, {len(self.chunks)} chunks"
+                f"{f' in {self.num_shards} shards' if self.num_shards else ''}")
+
 # --- Helper Functions ---
+def build_missing_faiss_index(embeddings, scales, backend, index_path):
+    """Builds the FAISS index a KB was published without and tries to save it for the next load."""
+    print(f"No FAISS '{backend}' index at {index_path}; building it now "
+          f"(prebuild it with: python knowledge_base.py --faiss-index {backend}).")
+    index = build_faiss_index(dequantize_embeddings(embeddings, scales), backend)
+    try:
+        save_faiss_index(index, index_path)
+    except Exception as e:
+        print(f"Warning: Could not save FAISS '{backend}' index to {index_path} ({e}); it is rebuilt on every load.")
+    return index
+
+def create_search_engine(embeddings, scales=None, normalized=False, backend=None, kb_dir=KB_DIR):
+    """Creates the retrieval engine selected by SEARCH_BACKEND, falling back to exact numpy search.
+
+    A FAISS index missing from the KB directory is built on first load and saved next to the embeddings.
+    """
+    backend = backend or SEARCH_BACKEND
+    if backend != 'numpy':
+        index_path = faiss_index_path(kb_dir, backend)
+        try:
+            if os.path.exists(index_path):
+                index = load_faiss_index(index_path)
+            else:
+                index = build_missing_faiss_index(embeddings, scales, backend, index_path)
+            if index.ntotal != len(embeddings):
+                raise ValueError(f"index holds {index.ntotal} vectors but the KB has {len(embeddings)} embeddings")
+            print(f"Using FAISS '{backend}' index from {index_path}")
+            return FaissSearchEngine(index, nprobe=FAISS_NPROBE, ef_search=FAISS_EF_SEARCH)
+        except Exception as e:
+            print(f"Warning: Could not load FAISS '{backend}' index ({e}). Falling back to exact numpy search.")
+    return DenseSearchEngine(embeddings, scales=scales, normalized=normalized)
+
+def load_text_chunks(kb_dir):
+    """Opens the columnar chunk store, falling back to a legacy text_chunks.pkl."""
+    if chunk_store_exists(kb_dir):
+        return ChunkStore(kb_dir)
+    with open(os.path.join(kb_dir, CHUNKS_FILE), 'rb') as f:
+        return pickle.load(f)
+
+@contextmanager
+def _timed(step):
+    """Records how long a load step took in load_state.timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        load_state.timings[step] = time.perf_counter() - start
+        print(f"[startup] {step}: {load_state.timings[step]:.2f} s")
+
+def start_background_load():
+    """Starts load_models_and_kb in a daemon thread (once per process) and returns load_state."""
+    with _load_lock:
+        if load_state.status in ('not_started', 'failed'):
+            load_state.status = 'loading'
+            load_state.started_at = time.perf_counter()
+            load_state.finished_at = None
+            load_state._done.clear()
+            threading.Thread(target=_background_load, name="kb-loader", daemon=True).start()
+    return load_state
+
+def _background_load():
+    try:
+        ok = load_models_and_kb()
+    except Exception as e:
+        print(f"Error during background load: {e}")
+        ok = False
+    load_state.finished_at = time.perf_counter()
+    load_state.status = 'ready' if ok else 'failed'
+    print(f"[startup] Background load {load_state.status} after {load_state.elapsed():.2f} s.")
+    load_state._done.set()
+
+def load_kb_dir(kb_dir):
+    """Loads one KB directory (a whole KB or one shard).
+
+    Returns (chunks, embeddings, search engine, filter index or None, BM25 index or None).
+    """
+    chunks = load_text_chunks(kb_dir)
+    matrix, scales, normalized = load_embeddings(kb_dir, mmap=EMBEDDINGS_MMAP)
+    if chunks is None or matrix is None:
+        raise ValueError(f"Loaded KB data in {kb_dir} is invalid.")
+    engine = create_search_engine(matrix, scales, normalized, kb_dir=kb_dir)
+    filters = FilterIndex(kb_dir) if os.path.exists(os.path.join(kb_dir, FILTER_INDEX_FILE_NAME)) else None
+    lexical = None
+    if RETRIEVAL_MODE == 'hybrid' and os.path.exists(os.path.join(kb_dir, BM25_INDEX_FILE_NAME)):
+        lexical = BM25Index.load(kb_dir)
+    return chunks, matrix, engine, filters, lexical
+
+def load_sharded_kb(shard_dirs):
+    """Loads every shard and wraps them so retrieval sees one KB addressed by global chunk ids.
+
+    Shard searches run in parallel on a thread pool and their top-k lists are merged.
+    Filter and BM25 indexes are used only if every shard has one.
+    """
+    shards = list(_shard_executor().map(load_kb_dir, shard_dirs))
+    chunk_stores, _, engines, filter_indexes, bm25_indexes = zip(*shards)
+    offsets = shard_offsets([len(chunks) for chunks in chunk_stores])
+    chunks = ShardedChunkStore(list(chunk_stores))
+    engine = ShardedSearch(list(engines), offsets, _shard_executor())
+    filters = ShardedFilterIndex(list(filter_indexes), offsets) if None not in filter_indexes else None
+    lexical = ShardedSearch(list(bm25_indexes), offsets, _shard_executor()) if None not in bm25_indexes else None
+    return chunks, engine, filters, lexical
+
+def _shard_executor():
+    global _shard_pool
+    if _shard_pool is None:
+        _shard_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_WORKERS, thread_name_prefix="shard-search")
+    return _shard_pool
+
+def load_knowledge_base(kb_root=KB_DIR, version=None):
+    """Loads the CURRENT (or given) version of the KB under kb_root into a KnowledgeBase."""
+    version = version or current_kb_version(kb_root)
+    kb_dir = resolve_kb_dir(kb_root, version)
+    shard_dirs = read_shard_manifest(kb_dir)
+    if shard_dirs:
+        chunks, engine, filters, lexical = load_sharded_kb(shard_dirs)
+        loaded = KnowledgeBase(version, kb_dir, chunks, engine, filters, lexical, num_shards=len(shard_dirs))
+        print(f"Loaded {len(chunks)} chunks from {len(shard_dirs)} shards "
+              f"(searched in parallel by {SHARD_SEARCH_WORKERS} threads).")
+    else:
+        chunks, matrix, engine, filters, lexical = load_kb_dir(kb_dir)
+        loaded = KnowledgeBase(version, kb_dir, chunks, engine, filters, lexical, embeddings=matrix)
+        print(f"Loaded {len(chunks)} chunks and {matrix.dtype} embeddings"
+              f"{' (memory-mapped)' if isinstance(matrix, np.memmap) else ''} from {kb_dir}.")
+    if filters is not None:
+        print(f"Loaded metadata filter index (fields: {', '.join(filters.fields())}).")
+    if lexical is not None:
+        print(f"Loaded BM25 index over {len(lexical)} chunks; using hybrid retrieval.")
+    elif RETRIEVAL_MODE == 'hybrid':
+        print("Warning: No BM25 index in the KB; using dense-only retrieval. Re-run knowledge_base.py.")
+    return loaded
+
+def reload_kb_if_changed():
+    """Loads and swaps in a newly published KB version; returns True if the served KB changed.
+
+    The embedding model, caches and generator are kept. The new version is
+    fully loaded before the `kb` global is replaced, so queries never wait on the
+    load and queries already running finish on the old version. If the new
+    version fails to load, the old one keeps serving.
+    """
+    global kb, _failed_kb_version
+    with _kb_lock:
+        version = current_kb_version(KB_DIR)
+        if kb is None or version is None or version == kb.version or version == _failed_kb_version:
+            return False
+        print(f"[reload] New knowledge base version {version} published; loading it in the background...")
+        start = time.perf_counter()
+        try:
+            new_kb = load_knowledge_base(KB_DIR, version)
+        except Exception as e:
+            _failed_kb_version = version
+            print(f"[reload] Error loading knowledge base version {version} ({e}). Still serving {kb.describe()}.")
+            return False
+        old_kb, kb = kb, new_kb
+        print(f"[reload] Now serving {kb.describe()} (loaded in {time.perf_counter() - start:.2f} s; "
+              f"was {old_kb.describe()}).")
+        return True
+
+def _watch_kb_versions():
+    while True:
+        time.sleep(KB_RELOAD_INTERVAL)
+        try:
+            reload_kb_if_changed()
+        except Exception as e:
+            print(f"[reload] Error checking for a new knowledge base version: {e}")
+
+def start_kb_watcher():
+    """Starts the thread that polls kb_data/CURRENT every KB_RELOAD_INTERVAL seconds (once per process)."""
+    global _kb_watcher
+    if KB_RELOAD_INTERVAL > 0 and _kb_watcher is None:
+        _kb_watcher = threading.Thread(target=_watch_kb_versions, name="kb-watcher", daemon=True)
+        _kb_watcher.start()
+
+def current_kb():
+    """The KnowledgeBase currently being served (None until loaded)."""
+    return kb
+
 def load_models_and_kb():
-    """Loads embedding model, configures Gemini model, and loads knowledge base data."""
-    global embedding_model, gemini_model, text_chunks, embeddings, models_loaded
+    """Loads embedding model, configures the answer generator, and loads knowledge base data."""
+    global embedding_model, generator, kb, query_cache, response_cache, reranker, token_counter, models_loaded
+    global _metrics_sinks_added
     if models_loaded:  # Avoid reloading if already done
         print("Models and KB already loaded.")
         return True
 
     print("Loading models and knowledge base...")
+    if not _metrics_sinks_added:
+        for sink in create_sinks(METRICS_SINKS, METRICS_JSON_LOG, METRICS_PROMETHEUS_FILE):
+            METRICS.add_sink(sink)
+            print(f"Reporting metrics to {type(sink).__name__}.")
+        _metrics_sinks_added = True
 
     # Load Knowledge Base
     try:
-        with open(CHUNKS_FILE, 'rb') as f:
-            text_chunks = pickle.load(f)
-        embeddings = np.load(EMBEDDINGS_FILE)
-        if text_chunks is None or embeddings is None:
-            raise ValueError("Loaded KB data is invalid.")
-        print(f"Loaded {len(text_chunks)} chunks and embeddings.")
+        with _timed("load knowledge base"):
+            kb = load_knowledge_base(KB_DIR)
     except FileNotFoundError:
         print(f"Error: Knowledge base files not found in {KB_DIR}. Run knowledge_base.py first.")
         return False
@@ -52,98 +363,248 @@ def load_models_and_kb():
 
     # Load Embedding Model (for retrieval)
     try:
-        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        print(f"Loaded embedding model: {EMBEDDING_MODEL_NAME}")
+        with _timed(f"load embedding model ({ENCODER_BACKEND})"):
+            embedding_model = load_encoder(EMBEDDING_MODEL_NAME, ENCODER_BACKEND)
+        print(f"Loaded embedding model: {EMBEDDING_MODEL_NAME} ({ENCODER_BACKEND} backend)")
+        token_counter = TokenCounter(get_tokenize_fn(embedding_model))
     except Exception as e:
-        print(f"Error loading SentenceTransformer model: {e}")
+        print(f"Error loading embedding model: {e}")
         return False
 
-    # Configure Gemini Model (for generation)
+    # Query embedding cache: restore persisted entries, then pre-encode the warm-up list
     try:
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("GOOGLE_API_KEY environment variable not set.")
-
-        genai.configure(api_key=api_key)
-        gemini_model = genai.GenerativeModel(GEMINI_MODEL_NAME)
-        print(f"Configured Gemini model: {GEMINI_MODEL_NAME}")
+        with _timed("query cache warm-up"):
+            query_cache = QueryEmbeddingCache(encoder_id(EMBEDDING_MODEL_NAME, ENCODER_BACKEND),
+                                              maxsize=QUERY_CACHE_SIZE, path=QUERY_CACHE_FILE)
+            restored = query_cache.load()
+            query_cache.warm_up(WARMUP_QUERIES, _encode_with_model)
+            atexit.register(query_cache.save)
+        print(f"Query cache ready ({restored} restored, {len(WARMUP_QUERIES)} warm-up queries).")
+    except Exception as e:
+        print(f"Warning: Query cache warm-up failed ({e}). Continuing without warm-up.")
+
+    # Optional cross-encoder reranker; retrieval still works without it
+    if RERANK_ENABLED:
+        try:
+            with _timed("load rerank model"):
+                reranker = CrossEncoderReranker(RERANK_MODEL_NAME)
+                reranker.load()
+            print(f"Loaded rerank model: {RERANK_MODEL_NAME} (keeps top {RERANK_TOP_N})")
+        except Exception as e:
+            reranker = None
+            print(f"Warning: Could not load rerank model ({e}). Continuing without reranking.")
+
+    # Answer cache, invalidated automatically whenever the served KB version changes
+    response_cache = SemanticResponseCache(
+        maxsize=RESPONSE_CACHE_SIZE,
+        ttl_seconds=RESPONSE_CACHE_TTL,
+        similarity_threshold=RESPONSE_CACHE_SIMILARITY,
+        version_fn=lambda: kb.fingerprint(),
+    )
+
+    # Configure the answer generator (Gemini, or the offline stub which needs no API key)
+    try:
+        with _timed(f"load generator ({GENERATOR_BACKEND})"):
+            if GENERATOR_BACKEND == 'stub':
+                backend_options = dict(latency=STUB_LATENCY, first_token_latency=STUB_FIRST_TOKEN_LATENCY,
+                                       output_chars=STUB_OUTPUT_CHARS, jitter=STUB_JITTER, error_rate=STUB_ERROR_RATE)
+            else:
+                backend_options = dict(model_name=GEMINI_MODEL_NAME, api_key=os.getenv("GOOGLE_API_KEY"))
+            generator = create_generator(GENERATOR_BACKEND, timeout=GENERATION_TIMEOUT, retries=GENERATION_RETRIES,
+                                         max_concurrency=GENERATION_MAX_CONCURRENCY, **backend_options)
+        if GENERATOR_BACKEND == 'stub':
+            print(f"Using the offline stub generator ({STUB_LATENCY:.2f} s, {STUB_OUTPUT_CHARS} chars per reply).")
+        else:
+            print(f"Configured Gemini model: {GEMINI_MODEL_NAME}")
     except ValueError as e:
         print(f"Configuration Error: {e}")
-        print("Please set the GOOGLE_API_KEY environment variable.")
+        print("Please set the GOOGLE_API_KEY environment variable (or GENERATOR_BACKEND=stub to run offline).")
         return False
     except Exception as e:
-        print(f"Error configuring Gemini model: {e}")
+        print(f"Error configuring the {GENERATOR_BACKEND} generator: {e}")
         return False
 
     models_loaded = True  # Set flag after successful loading
-    print("Models and knowledge base loaded successfully.")
+    start_kb_watcher()  # Newly published KB versions are swapped in without reloading the models
+    print(f"Models and knowledge base loaded successfully ({kb.describe()}).")
     return True
 
-def cosine_similarity(vec1, vec2):
-    """Computes cosine similarity between two vectors."""
-    vec1 = np.asarray(vec1)
-    vec2 = np.asarray(vec2)
-    norm1 = norm(vec1)
-    norm2 = norm(vec2)
-    if norm1 == 0 or norm2 == 0:
-        return 0.0  # Avoid division by zero
-    return np.dot(vec1, vec2) / (norm1 * norm2)
-
-def retrieve_relevant_chunks(query, top_k=TOP_K):
-    """Retrieves the most relevant text chunks for a given query."""
-    if not models_loaded or embedding_model is None or embeddings is None or text_chunks is None:
+def _encode_with_model(queries):
+    return embedding_model.encode(list(queries), show_progress_bar=False)
+
+def encode_queries(queries):
+    """Embeds queries, serving repeated questions from the query cache when it is enabled."""
+    with span('query_encoding'):
+        if query_cache is None:
+            return _encode_with_model(queries)
+        misses = query_cache.cache.misses
+        embeddings = query_cache.encode(list(queries), _encode_with_model)
+        missed = query_cache.cache.misses - misses
+        incr('query_cache_hits', len(queries) - missed)
+        incr('query_cache_misses', missed)
+        return embeddings
+
+def _collect_chunks(state, indices, scores, top_k):
+    """Turns search results into chunk dicts, keeping those above the similarity threshold."""
+    relevant_chunks = [
+        dict(state.chunks[i], chunk_id=int(i), score=float(score))
+        for i, score in zip(indices, scores)
+        if score >= SIMILARITY_THRESHOLD
+    ]
+    print(f"Retrieved {len(relevant_chunks)} relevant chunks (Top K={top_k}, Threshold={SIMILARITY_THRESHOLD}).")
+    return relevant_chunks
+
+def _collect_fused_chunks(state, query, dense_indices, dense_scores, candidate_ids, top_k):
+    """Fuses dense and BM25 rankings with RRF and turns the top_k results into chunk dicts.
+
+    A chunk is kept if it matched the query lexically or its dense similarity clears the
+    threshold. `score` is the fused RRF score; the per-retriever scores are kept alongside.
+    """
+    lexical_indices, lexical_scores = state.bm25_index.search(query, HYBRID_CANDIDATES, candidate_ids)
+    with span('rank_fusion'):
+        dense = dict(zip(dense_indices.tolist(), dense_scores.tolist()))
+        lexical = dict(zip(lexical_indices.tolist(), lexical_scores.tolist()))
+        fused_indices, fused_scores = reciprocal_rank_fusion([dense_indices, lexical_indices], k=RRF_K)
+
+    relevant_chunks = []
+    for i, score in zip(fused_indices.tolist(), fused_scores.tolist()):
+        if len(relevant_chunks) == top_k:
+            break
+        if i in lexical or dense.get(i, -1.0) >= SIMILARITY_THRESHOLD:
+            relevant_chunks.append(dict(state.chunks[i], chunk_id=i, score=float(score),
+                                        dense_score=dense.get(i), lexical_score=lexical.get(i)))
+    print(f"Retrieved {len(relevant_chunks)} relevant chunks (hybrid, Top K={top_k}, "
+          f"{len(lexical)} lexical / {len(dense)} dense candidates).")
+    return relevant_chunks
+
+def _default_top_k(state):
+    return HYBRID_TOP_K if state.bm25_index is not None else TOP_K
+
+def _filter_candidates(state, filters):
+    """Resolves metadata filters to chunk row ids; None means search every chunk."""
+    if not filters:
+        return None
+    if state.filter_index is None:
+        print("Warning: No metadata filter index in the KB; ignoring filters. Re-run knowledge_base.py.")
+        return None
+    return state.filter_index.candidate_ids(filters)
+
+def retrieve_relevant_chunks(query, top_k=None, filters=None):
+    """Retrieves the most relevant text chunks for a given query.
+
+    In hybrid mode dense and BM25 rankings are fused, so top_k defaults to
+    HYBRID_TOP_K; in dense-only mode it defaults to TOP_K.
+
+    `filters` optionally restricts the search to matching chunks, e.g.
+    {'cuisine': 'biryani', 'locality': 'roorkee', 'open_status': 'open_today', 'type': 'menu_item'};
+    a list of values for a field matches any of them.
+    """
+    state = kb  # One KB version for the whole call, even if a reload swaps `kb` meanwhile
+    if not models_loaded or embedding_model is None or state is None:
         print("Error: Models or KB not loaded properly.")
         return []
 
     try:
-        query_embedding = embedding_model.encode([query], show_progress_bar=False)[0]
-
-        # Calculate similarities
-        similarities = np.array([cosine_similarity(query_embedding, emb) for emb in embeddings])
-
-        # Get top_k indices
-        num_chunks = len(similarities)
-        actual_top_k = min(top_k, num_chunks)
-        if actual_top_k <= 0:
+        candidate_ids = _filter_candidates(state, filters)
+        if candidate_ids is not None and len(candidate_ids) == 0:
+            print(f"No chunks match filters {filters}.")
             return []
-
-        # Using partition is slightly more efficient than argsort for finding top k
-        partitioned_indices = np.argpartition(similarities, -actual_top_k)[-actual_top_k:]
-        # Sort only the top k indices by similarity score
-        top_indices = partitioned_indices[np.argsort(similarities[partitioned_indices])[::-1]]
-
-        # Add a similarity threshold
-        similarity_threshold = 0.3
-        relevant_chunks = [text_chunks[i] for i in top_indices if similarities[i] >= similarity_threshold]
-
-        print(f"Retrieved {len(relevant_chunks)} relevant chunks (Top K={top_k}, Threshold={similarity_threshold}).")
+        top_k = top_k or _default_top_k(state)
+        query_embedding = encode_queries([query])[0]
+        with span('retrieval'):
+            if state.bm25_index is not None:
+                indices, scores = state.search_engine.search(query_embedding, max(top_k, HYBRID_CANDIDATES), candidate_ids)
+                relevant_chunks = _collect_fused_chunks(state, query, indices, scores, candidate_ids, top_k)
+            else:
+                indices, scores = state.search_engine.search(query_embedding, top_k, candidate_ids)
+                relevant_chunks = _collect_chunks(state, indices, scores, top_k)
+        incr('retrievals')
+        incr('chunks_retrieved', len(relevant_chunks))
         return relevant_chunks
 
     except Exception as e:
         print(f"Error during retrieval: {e}")
         return []
 
-def generate_response(query, relevant_chunks):
-    """Generates a response using the Gemini model based on query and context."""
-    if not models_loaded or gemini_model is None:
-        print("Error: Gemini model not loaded.")
-        return "Sorry, I cannot generate a response right now (Model not ready)."
+def retrieve_relevant_chunks_batch(queries, top_k=None, filters=None):
+    """Retrieves the most relevant text chunks for many queries in one call.
 
-    if not relevant_chunks:
-        return "Sorry, I couldn't find specific information related to your query in my current data."
+    Queries are encoded together and scored with a single matrix product.
+    `filters` applies to every query. Returns one list of chunks per query,
+    in the same order as `queries`.
+    """
+    state = kb  # One KB version for the whole call, even if a reload swaps `kb` meanwhile
+    if not models_loaded or embedding_model is None or state is None:
+        print("Error: Models or KB not loaded properly.")
+        return [[] for _ in queries]
+    if not queries:
+        return []
 
-    # Prepare context
-    context = "\n".join([chunk['content'] for chunk in relevant_chunks])
+    try:
+        candidate_ids = _filter_candidates(state, filters)
+        if candidate_ids is not None and len(candidate_ids) == 0:
+            print(f"No chunks match filters {filters}.")
+            return [[] for _ in queries]
+        top_k = top_k or _default_top_k(state)
+        query_embeddings = encode_queries(queries)
+        with span('retrieval'):
+            if state.bm25_index is not None:
+                results = state.search_engine.search_batch(query_embeddings, max(top_k, HYBRID_CANDIDATES), candidate_ids)
+                batch_chunks = [_collect_fused_chunks(state, query, indices, scores, candidate_ids, top_k)
+                                for query, (indices, scores) in zip(queries, results)]
+            else:
+                results = state.search_engine.search_batch(query_embeddings, top_k, candidate_ids)
+                batch_chunks = [_collect_chunks(state, indices, scores, top_k) for indices, scores in results]
+        incr('retrievals', len(queries))
+        incr('chunks_retrieved', sum(len(chunks) for chunks in batch_chunks))
+        return batch_chunks
 
-    # Limit context size (Simple character limit)
-    max_context_chars = 15000  # Increase limit for Gemini (adjust as needed)
-    if len(context) > max_context_chars:
-        original_len = len(context)
-        context = context[:max_context_chars] + "..."
-        print(f"Warning: Context truncated from {original_len} to {len(context)} chars for Gemini prompt.")
+    except Exception as e:
+        print(f"Error during batch retrieval: {e}")
+        return [[] for _ in queries]
 
-    # Create prompt for the Gemini model
-    prompt = f"""You are a helpful assistant answering questions about restaurants based **ONLY** on the provided context information.
+def rerank_chunks(query, relevant_chunks, top_n=RERANK_TOP_N):
+    """Keeps the top_n chunks by cross-encoder score; returns the chunks unchanged if reranking is off.
+
+    Logs the rerank latency next to the context size before and after, so the
+    rerank cost can be weighed against the smaller Gemini prompt.
+    """
+    if reranker is None or not relevant_chunks:
+        return relevant_chunks
+    try:
+        with span('rerank'):
+            reranked = reranker.rerank(query, relevant_chunks, top_n)
+        stats = reranker.stats()
+        incr('rerank_pairs_scored', stats['scored'])
+        tokens_before = sum(token_counter.count(chunk['content']) for chunk in relevant_chunks)
+        tokens_after = sum(token_counter.count(chunk['content']) for chunk in reranked)
+        print(f"Reranked {stats['candidates']} -> {stats['kept']} chunks in {stats['ms']:.1f} ms "
+              f"({stats['scored']} scored, {stats['cached']} cached; mean {stats['mean_ms']:.1f} ms over "
+              f"{stats['total_calls']} calls). Context tokens {tokens_before} -> {tokens_after}.")
+        return reranked
+    except Exception as e:
+        print(f"Warning: Reranking failed ({e}); using retrieval order.")
+        return relevant_chunks
+
+def build_prompt(query, relevant_chunks, max_context_tokens=MAX_CONTEXT_TOKENS):
+    """Builds the generation prompt from the query and the retrieved chunks.
+
+    Chunks are packed whole into `max_context_tokens`, most relevant first, with
+    duplicates removed; what was dropped is reported.
+    """
+    with span('prompt_assembly'):
+        packed = pack_context(relevant_chunks, max_context_tokens, token_counter)
+        prompt = _format_prompt(query, packed.text)
+    print(packed.summary())
+    incr('prompts')
+    incr('prompt_chars', len(prompt))
+    incr('prompt_context_tokens', packed.tokens)
+    incr('context_chunks_dropped', len(packed.dropped))
+    return prompt
+
+def _format_prompt(query, context):
+    # Create prompt for the answer generator
+    return f"""You are a helpful assistant answering questions about restaurants based **ONLY** on the provided context information.
 
 Context Information:
 ---
@@ -157,43 +618,139 @@ Question: {query}
 
 Answer:"""
 
+def _lookup_cached_response(query, relevant_chunks):
+    """Returns (cache_key, cached_response). cache_key is None when the cache is disabled or failed."""
+    if response_cache is None:
+        return None, None
     try:
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        response = gemini_model.generate_content(
-            prompt,
-            safety_settings=safety_settings,
-            generation_config=genai.types.GenerationConfig(
-                # Optional: Adjust temperature, top_p, top_k etc.
-                # temperature=0.7
-            )
-        )
-
-        # Handle potential safety blocks or empty responses
-        if not response.parts:
-            if response.prompt_feedback.block_reason:
-                print(f"Warning: Gemini response blocked due to: {response.prompt_feedback.block_reason}")
-                return f"Sorry, my response was blocked due to safety reasons ({response.prompt_feedback.block_reason}). Please rephrase your query."
-            else:
-                print("Warning: Gemini returned an empty response.")
-                return "Sorry, I received an empty response. Please try again."
+        cache_key = (encode_queries([query])[0], chunk_set_fingerprint(relevant_chunks))
+        cached_response = response_cache.get(*cache_key)
+        incr('response_cache_hits' if cached_response is not None else 'response_cache_misses')
+        if cached_response is not None:
+            print("Serving response from the semantic response cache.")
+        return cache_key, cached_response
+    except Exception as e:
+        print(f"Warning: Response cache lookup failed ({e}).")
+        return None, None
+
+def _blocked_message(error):
+    incr('blocked_responses')
+    print(f"Warning: {generator.name} response blocked due to: {error.reason}")
+    return f"Sorry, my response was blocked due to safety reasons ({error.reason}). Please rephrase your query."
+
+def _empty_message():
+    incr('empty_responses')
+    print(f"Warning: {generator.name} returned an empty response.")
+    return "Sorry, I received an empty response. Please try again."
+
+def generate_response(query, relevant_chunks, cancel=None):
+    """Generates a response using the configured generator based on query and context.
+
+    `cancel` is an optional generation.CancelToken; cancelling it abandons the call.
+    """
+    if not models_loaded or generator is None:
+        print("Error: Generator not loaded.")
+        return "Sorry, I cannot generate a response right now (Model not ready)."
+
+    if not relevant_chunks:
+        return "Sorry, I couldn't find specific information related to your query in my current data."
 
-        generated_text = response.text.strip()
-        print(f"Generated Response (Gemini): {generated_text}")
+    # Reuse a recent answer to a near-identical question over the same retrieved context
+    cache_key, cached_response = _lookup_cached_response(query, relevant_chunks)
+    if cached_response is not None:
+        return cached_response
+
+    prompt = build_prompt(query, relevant_chunks)
+
+    try:
+        start = time.perf_counter()
+        with span('generation'):
+            generated_text = generator.generate(prompt, cancel=cancel).strip()
+        incr('generations')
+        print(f"{generator.name} call took {(time.perf_counter() - start) * 1000:.0f} ms.")
+
+        if not generated_text:
+            return _empty_message()
+
+        incr('response_chars', len(generated_text))
+        print(f"Generated Response ({generator.name}): {generated_text}")
+        if cache_key is not None:
+            response_cache.put(*cache_key, generated_text)
         return generated_text
 
+    except GenerationBlocked as e:
+        return _blocked_message(e)
+    except GenerationCancelled:
+        print("Response generation cancelled.")
+        return "The response was cancelled."
     except Exception as e:
-        print(f"Error during Gemini response generation: {e}")
+        incr('generation_errors')
+        print(f"Error during {generator.name} response generation: {e}")
         return "Sorry, I encountered an error while generating the response with the AI model."
 
+def generate_response_stream(query, relevant_chunks, cancel=None):
+    """Streaming variant of generate_response: yields text parts as the generator produces them.
+
+    Cache hits, safety blocks, empty responses and errors are yielded as a single
+    message, so callers can always render whatever this generator produces.
+    """
+    if not models_loaded or generator is None:
+        print("Error: Generator not loaded.")
+        yield "Sorry, I cannot generate a response right now (Model not ready)."
+        return
+
+    if not relevant_chunks:
+        yield "Sorry, I couldn't find specific information related to your query in my current data."
+        return
+
+    cache_key, cached_response = _lookup_cached_response(query, relevant_chunks)
+    if cached_response is not None:
+        yield cached_response
+        return
+
+    prompt = build_prompt(query, relevant_chunks)
+    generated_parts = []
+
+    try:
+        start = time.perf_counter()
+        incr('generations')
+        for text in generator.stream(prompt, cancel=cancel):
+            if not generated_parts:
+                METRICS.observe('generation_first_token', time.perf_counter() - start)
+                print(f"{generator.name} first token after {(time.perf_counter() - start) * 1000:.0f} ms.")
+            generated_parts.append(text)
+            yield text
+        METRICS.observe('generation', time.perf_counter() - start)  # Includes time the caller spent rendering
+
+        if not generated_parts:
+            yield _empty_message()
+            return
+
+        generated_text = "".join(generated_parts).strip()
+        incr('response_chars', len(generated_text))
+        print(f"Generated Response ({generator.name}, streamed in {(time.perf_counter() - start) * 1000:.0f} ms): {generated_text}")
+        if cache_key is not None:
+            response_cache.put(*cache_key, generated_text)
+
+    except GenerationBlocked as e:
+        yield _blocked_message(e)
+    except GenerationCancelled:
+        print("Response streaming cancelled.")  # The caller stopped listening; nothing more to show
+    except Exception as e:
+        incr('generation_errors')
+        print(f"Error during {generator.name} response streaming: {e}")
+        if generated_parts:
+            yield "\n\nSorry, the response was interrupted by an error in the AI model."
+        else:
+            yield "Sorry, I encountered an error while generating the response with the AI model."
+
 # --- Main Function (for testing directly) ---
 if __name__ == "__main__":
     # Ensure KB is created before running this directly
-    kb_exists = os.path.exists(CHUNKS_FILE) and os.path.exists(EMBEDDINGS_FILE)
+    kb_dir = resolve_kb_dir(KB_DIR)
+    kb_exists = read_shard_manifest(kb_dir) is not None or (
+        (chunk_store_exists(kb_dir) or os.path.exists(os.path.join(kb_dir, CHUNKS_FILE)))
+        and os.path.exists(os.path.join(kb_dir, EMBEDDINGS_FILE)))
     if not kb_exists:
         print("Knowledge base files not found. Please run knowledge_base.py first.")
     elif load_models_and_kb():  # Load models if KB exists
@@ -210,8 +767,9 @@ if __name__ == "__main__":
 
         for q in test_queries:
             print(f"\n--- Query: {q} ---")
-            chunks = retrieve_relevant_chunks(q)
-            answer = generate_response(q, chunks)
+            with METRICS.request('chat'):
+                chunks = rerank_chunks(q, retrieve_relevant_chunks(q))
+                answer = generate_response(q, chunks)
             print(f"Answer: {answer}")
             print("-" * 20)
     else:
@@ -0,0 +1,104 @@
+# context_packer.py
+# Fits retrieved chunks into the prompt's token budget: dedup, then greedy fill by relevance score.
+import re
+from caches import LRUCache
+
+# --- Configuration ---
+CHARS_PER_TOKEN = 4  # Fallback estimate when no tokenizer is available
+DEDUP_JACCARD_THRESHOLD = 0.9  # Token-set overlap above which two chunks count as duplicates
+CHUNK_SEPARATOR_TOKENS = 1  # Newline between chunks in the context
+
+
+# --- Helper Functions ---
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token)."""
+    return max(1, -(-len(text) // CHARS_PER_TOKEN))
+
+
+def _dedup_key(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+# --- Token Counting ---
+class TokenCounter:
+    """Counts tokens with `tokenize_fn` (text -> token list), caching counts per text.
+
+    Falls back to the character estimate when no tokenizer is given or it fails.
+    """
+
+    def __init__(self, tokenize_fn=None, cache_size=8192):
+        self.tokenize_fn = tokenize_fn
+        self.cache = LRUCache(cache_size)
+
+    def count(self, text):
+        tokens = self.cache.get(text)
+        if tokens is None:
+            tokens = estimate_tokens(text)
+            if self.tokenize_fn is not None:
+                try:
+                    tokens = len(self.tokenize_fn(text))
+                except Exception as e:
+                    print(f"Warning: Tokenizer failed ({e}); estimating tokens from characters.")
+                    self.tokenize_fn = None
+            self.cache.put(text, tokens)
+        return tokens
+
+
+# --- Packing ---
+class PackedContext:
+    """Result of pack_context: the context text, the chunks used and what was dropped (chunk, reason)."""
+
+    def __init__(self, chunks, dropped, tokens, max_tokens):
+        self.chunks = chunks
+        self.dropped = dropped
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.text = "\n".join(chunk['content'] for chunk in chunks)
+
+    def summary(self):
+        reasons = {}
+        for _, reason in self.dropped:
+            reasons[reason] = reasons.get(reason, 0) + 1
+        dropped = ", ".join(f"{count} {reason}" for reason, count in sorted(reasons.items()))
+        return (f"Packed {len(self.chunks)}/{len(self.chunks) + len(self.dropped)} chunks "
+                f"({self.tokens}/{self.max_tokens} tokens)" + (f"; dropped {dropped}" if dropped else ""))
+
+
+def pack_context(chunks, max_tokens, counter=None):
+    """Selects chunks for the prompt context within `max_tokens`.
+
+    Chunks are visited best `score` first (retrieval order breaks ties). A chunk is
+    dropped as a 'duplicate' if its text is identical to, contained in, or nearly the
+    same token set as an already selected chunk, and as 'over budget' if it no longer
+    fits; smaller chunks further down can still fill the remaining budget.
+    """
+    counter = counter or TokenCounter()
+    ranked = sorted(chunks, key=lambda chunk: -chunk.get('score', 0.0))
+
+    selected, selected_keys, selected_token_sets, dropped = [], [], [], []
+    used = 0
+    for chunk in ranked:
+        key = _dedup_key(chunk['content'])
+        token_set = set(key.split())
+        if any(key in other for other in selected_keys) or any(
+                _jaccard(token_set, other) >= DEDUP_JACCARD_THRESHOLD for other in selected_token_sets):
+            dropped.append((chunk, 'duplicate'))
+            continue
+
+        cost = counter.count(chunk['content']) + (CHUNK_SEPARATOR_TOKENS if selected else 0)
+        if used + cost > max_tokens:
+            dropped.append((chunk, 'over budget'))
+            continue
+
+        selected.append(chunk)
+        selected_keys.append(key)
+        selected_token_sets.append(token_set)
+        used += cost
+
+    return PackedContext(selected, dropped, used, max_tokens)
@@ -0,0 +1,274 @@
+# encoders.py
+# Sentence encoders for queries and chunks: PyTorch (sentence-transformers) or ONNX Runtime (optionally int8).
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+# --- Configuration ---
+ENCODER_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+ONNX_MODEL_DIR = "onnx_models"  # Exported models go to onnx_models/<model name>/
+ONNX_MODEL_FILE_NAME = "model.onnx"
+ONNX_INT8_MODEL_FILE_NAME = "model_int8.onnx"
+ONNX_TOKENIZER_FILE_NAME = "tokenizer.json"
+ONNX_CONFIG_FILE_NAME = "encoder_config.json"
+ONNX_OPSET = 17
+PARITY_MIN_COSINE = 0.98  # Minimum per-sentence cosine vs. the torch embedding for the parity check to pass
+PARITY_SENTENCES = [
+    "Which restaurant has Chicken Tikka?",
+    "Tell me about vegetarian options",
+    "What is the price range of desserts?",
+    "Restaurant Name: Hangries. Cuisine types: chinese, burger, pizza, italian.",
+    "Restaurant: Rustic House. Menu Item: Paneer Tikka. Category: Starters. Price: ₹220.",
+    "Are there any restaurants open today in Roorkee?",
+]
+
+
+# --- Helper Functions ---
+def encoder_id(model_name, backend):
+    """Identifies the vectors an encoder produces; backends differ slightly, so caches keep them apart."""
+    return model_name if backend == 'torch' else f"{model_name}@{backend}"
+
+
+def onnx_model_dir(model_name):
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace('/', '__'))
+
+
+def get_tokenize_fn(model):
+    """Returns text -> token list for an encoder, or None if it has no tokenizer."""
+    if isinstance(model, OnnxEncoder):
+        return model.tokenize
+    tokenizer = getattr(model, 'tokenizer', None)
+    return tokenizer.tokenize if tokenizer is not None else None
+
+
+# --- ONNX Export ---
+def export_onnx(model_name, output_dir=None, quantize=True):
+    """Exports a sentence-transformers model's transformer to ONNX, plus its tokenizer and pooling config.
+
+    With `quantize`, also writes a dynamically int8-quantized copy. Needs torch and
+    sentence-transformers (and onnx for quantization); serving the export does not.
+    Returns the output directory.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir = output_dir or onnx_model_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+    module_types = {type(module).__name__: module for module in st_model}
+    pooling_config = module_types['Pooling'].get_config_dict() if 'Pooling' in module_types else {}
+    # Older sentence-transformers releases use one boolean per mode instead of 'pooling_mode'
+    use_cls = pooling_config.get('pooling_mode') == 'cls' or pooling_config.get('pooling_mode_cls_token')
+    pooling_mode = 'cls' if use_cls else 'mean'
+    normalize = 'Normalize' in module_types
+
+    sample = tokenizer(["An example sentence"], return_tensors='pt')
+    input_names = list(sample.keys())
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE_NAME)
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    with torch.no_grad():
+        torch.onnx.export(_LastHiddenState(transformer), tuple(sample[name] for name in input_names), model_path,
+                          input_names=input_names, output_names=['last_hidden_state'],
+                          dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET, dynamo=False)
+    print(f"Exported {model_name} to {model_path}")
+
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, ONNX_TOKENIZER_FILE_NAME))
+    config = {
+        'model_name': model_name, 'input_names': input_names, 'max_seq_length': st_model.max_seq_length,
+        'pooling': pooling_mode, 'normalize': normalize,
+        'pad_token': tokenizer.pad_token, 'pad_token_id': tokenizer.pad_token_id,
+    }
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        int8_path = os.path.join(output_dir, ONNX_INT8_MODEL_FILE_NAME)
+        quantize_dynamic(model_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"Wrote int8-quantized model to {int8_path}")
+    return output_dir
+
+
+# --- ONNX Runtime Encoder ---
+class OnnxEncoder:
+    """Encodes sentences with an exported model on ONNX Runtime; needs neither torch nor transformers.
+
+    `encode` mirrors SentenceTransformer.encode (same pooling and normalization),
+    so it can stand in for the torch model in chatbot.py and knowledge_base.py.
+    """
+
+    def __init__(self, model_dir, quantized=False, num_threads=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE_NAME), 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        model_file = ONNX_INT8_MODEL_FILE_NAME if quantized else ONNX_MODEL_FILE_NAME
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(os.path.join(model_dir, model_file), options,
+                                                    providers=['CPUExecutionProvider'])
+
+        tokenizer_path = os.path.join(model_dir, ONNX_TOKENIZER_FILE_NAME)
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(self.config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.config['pad_token_id'], pad_token=self.config['pad_token'])
+        self._count_tokenizer = Tokenizer.from_file(tokenizer_path)  # Untruncated, for token counting
+        self._count_tokenizer.no_truncation()
+        self._count_tokenizer.no_padding()
+
+    def tokenize(self, text):
+        return self._count_tokenizer.encode(text, add_special_tokens=False).tokens
+
+    def _encode_batch(self, sentences):
+        encodings = self.tokenizer.encode_batch(sentences)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        features = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': attention_mask,
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden = self.session.run(None, {name: features[name] for name in self.config['input_names']})[0]
+        if self.config['pooling'] == 'cls':
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config['normalize']:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, **kwargs):
+        """Returns a (len(sentences) x dim) float32 array (a single vector for a single string)."""
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        if not sentences:
+            return np.empty((0, 0), dtype=np.float32)
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            batches.append(self._encode_batch(sentences[start:start + batch_size]))
+            if show_progress_bar:
+                print(f"  Encoded {min(start + batch_size, len(sentences))}/{len(sentences)}", end='\r')
+        if show_progress_bar:
+            print()
+        embeddings = np.vstack(batches)
+        return embeddings[0] if single else embeddings
+
+
+def load_encoder(model_name, backend='torch', num_threads=None):
+    """Loads the encoder for `backend`, exporting the ONNX model on first use if needed.
+
+    `num_threads` caps intra-op threads, e.g. when several encoder processes share the CPU.
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}'. Choose from {ENCODER_BACKENDS}.")
+    if backend == 'torch':
+        from sentence_transformers import SentenceTransformer
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        return SentenceTransformer(model_name)
+
+    model_dir = onnx_model_dir(model_name)
+    model_file = ONNX_INT8_MODEL_FILE_NAME if backend == 'onnx-int8' else ONNX_MODEL_FILE_NAME
+    if not os.path.exists(os.path.join(model_dir, model_file)):
+        print(f"No ONNX export found in {model_dir}; exporting {model_name} (needs torch once)...")
+        export_onnx(model_name, model_dir, quantize=backend == 'onnx-int8')
+    return OnnxEncoder(model_dir, quantized=backend == 'onnx-int8', num_threads=num_threads)
+
+
+# --- Parity Check ---
+def check_parity(model_name, backend, sentences=None, repeats=3):
+    """Compares an ONNX backend against the torch embeddings: per-sentence cosine and encode latency."""
+    sentences = sentences or PARITY_SENTENCES
+    results = {}
+    for name in ('torch', backend):
+        model = load_encoder(model_name, name)
+        model.encode(sentences[:2])  # Warm-up
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            vectors = np.asarray(model.encode(sentences, batch_size=32), dtype=np.float32)
+            best = min(best, time.perf_counter() - start)
+        results[name] = (vectors, best)
+
+    reference, torch_s = results['torch']
+    candidate, backend_s = results[backend]
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    return {
+        'backend': backend, 'sentences': len(sentences),
+        'mean_cosine': float(cosines.mean()), 'min_cosine': float(cosines.min()),
+        'passed': bool(cosines.min() >= PARITY_MIN_COSINE),
+        'torch_ms': torch_s * 1000, 'backend_ms': backend_s * 1000,
+    }
+
+
+def sample_kb_sentences(kb_dir, limit):
+    """Up to `limit` chunk texts spread evenly over a KB, or None if no chunks are found.
+
+    kb_dir may be a versioned KB root (the CURRENT version is read), a flat KB or a sharded one.
+    """
+    from kb_store import ChunkStore, ShardedChunkStore, chunk_store_exists, read_shard_manifest, resolve_kb_dir
+    kb_dir = resolve_kb_dir(kb_dir)
+    shard_dirs = read_shard_manifest(kb_dir)
+    if shard_dirs:
+        store = ShardedChunkStore([ChunkStore(shard_dir) for shard_dir in shard_dirs])
+    elif chunk_store_exists(kb_dir):
+        store = ChunkStore(kb_dir)
+    else:
+        return None
+    if len(store) == 0:
+        return None
+    rows = np.unique(np.linspace(0, len(store) - 1, min(limit, len(store))).round().astype(int))
+    return [store.content(int(i)) for i in rows]
+
+
+# --- Main Execution ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX and check parity with torch.")
+    parser.add_argument("command", choices=["export", "parity"])
+    parser.add_argument("--model", default='all-MiniLM-L6-v2', help="sentence-transformers model name or path.")
+    parser.add_argument("--backend", choices=ENCODER_BACKENDS[1:], default='onnx-int8',
+                        help="ONNX backend to compare against torch (parity).")
+    parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 model (export).")
+    parser.add_argument("--kb-dir", default="kb_data",
+                        help="Use up to --samples chunk texts from this KB for the parity check, if it exists.")
+    parser.add_argument("--samples", type=int, default=512)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model, quantize=not args.no_quantize)
+    else:
+        sentences = None
+        try:
+            sentences = sample_kb_sentences(args.kb_dir, args.samples)
+        except Exception as e:
+            print(f"Error: Could not read chunks from {args.kb_dir} ({e}).")
+        if sentences is None:
+            print(f"WARNING: No knowledge base chunks found in {args.kb_dir}; the parity check only covers "
+                  f"{len(PARITY_SENTENCES)} built-in sentences. Build the KB first or pass --kb-dir.")
+        else:
+            print(f"Checking parity on {len(sentences)} chunks from {args.kb_dir}.")
+        report = check_parity(args.model, args.backend, sentences)
+        print(f"{report['backend']} vs torch on {report['sentences']} sentences: "
+              f"mean cosine {report['mean_cosine']:.5f}, min {report['min_cosine']:.5f} "
+              f"({'PASS' if report['passed'] else 'FAIL'}, threshold {PARITY_MIN_COSINE})")
+        print(f"Encode time: torch {report['torch_ms']:.1f} ms, {report['backend']} {report['backend_ms']:.1f} ms "
+              f"({report['torch_ms'] / max(report['backend_ms'], 1e-9):.2f}x)")
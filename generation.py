@@ -0,0 +1,321 @@
+# generation.py
+# Answer generation backends behind one interface: Gemini, and a deterministic offline stub for tests and load runs.
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from metrics import incr
+
+# --- Configuration ---
+GENERATOR_BACKENDS = ('gemini', 'stub')
+GENERATION_TIMEOUT = 30.0  # Seconds to wait for a reply (or, when streaming, for each next part)
+GENERATION_RETRIES = 2  # Extra attempts after a failed or timed-out call
+RETRY_BACKOFF = 0.5  # Seconds before the first retry; doubles on each further retry
+GENERATION_MAX_CONCURRENCY = 8  # Backend calls a generator runs at once; further callers wait for a free slot
+CANCEL_POLL_INTERVAL = 0.05  # How often a waiting call checks its cancel token
+STUB_OUTPUT_CHARS = 600
+STUB_CHUNK_CHARS = 40  # Characters per streamed part
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+
+# --- Errors ---
+class GenerationError(Exception):
+    """A generation failed after all retries."""
+
+
+class GenerationTimeout(GenerationError):
+    """No reply (or no next streamed part) within the timeout."""
+
+
+class GenerationCancelled(GenerationError):
+    """The caller cancelled the generation."""
+
+
+class GenerationBlocked(GenerationError):
+    """The model refused to answer (e.g. a safety block); never retried."""
+
+    def __init__(self, reason):
+        super().__init__(f"response blocked: {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    """Shared with a running generation; cancel() makes it stop at the next check."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, seconds):
+        """Sleeps up to `seconds`; returns True early if cancelled."""
+        return self._event.wait(seconds)
+
+
+# --- Generator Interface ---
+def _run_in_thread(future, fn, args):
+    if not future.set_running_or_notify_cancel():
+        return
+    try:
+        future.set_result(fn(*args))
+    except BaseException as e:
+        future.set_exception(e)
+
+
+class Generator:
+    """Base class: timeouts, retries and cancellation around a backend's blocking calls.
+
+    Backends implement _generate_once(prompt, timeout) -> text and
+    _stream_once(prompt, timeout) -> iterator of text parts, raising
+    GenerationBlocked when the model refuses. Each call runs on its own daemon
+    thread, so a hung backend call cannot hold the caller past the timeout or a
+    cancellation. At most `max_concurrency` calls run at once. A call the caller
+    gave up on frees its slot right away and finishes on its own thread, so hung
+    calls never block later requests (they are counted as
+    'generation_abandoned_calls'; waits for a slot as 'generation_saturated').
+    A stream is only retried if it failed before producing its first part.
+    """
+
+    name = 'base'
+
+    def __init__(self, timeout=GENERATION_TIMEOUT, retries=GENERATION_RETRIES, retry_backoff=RETRY_BACKOFF,
+                 max_concurrency=GENERATION_MAX_CONCURRENCY):
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _generate_once(self, prompt, timeout):
+        raise NotImplementedError
+
+    def _stream_once(self, prompt, timeout):
+        raise NotImplementedError
+
+    def _check(self, deadline, cancel, timeout_message):
+        """Raises GenerationCancelled or GenerationTimeout; otherwise returns the seconds left before `deadline`."""
+        if cancel is not None and cancel.cancelled:
+            incr('generation_cancelled')
+            raise GenerationCancelled("generation cancelled")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            incr('generation_timeouts')
+            raise GenerationTimeout(timeout_message)
+        return min(remaining, CANCEL_POLL_INTERVAL) if cancel is not None else remaining
+
+    def _call(self, cancel, fn, *args):
+        """Runs fn(*args) on a new thread and returns its result, or raises GenerationTimeout/GenerationCancelled."""
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(blocking=False):
+            incr('generation_saturated')
+            busy = f"all {self.max_concurrency} {self.name} call slots busy for {self.timeout:.1f} s"
+            while not self._slots.acquire(timeout=self._check(deadline, cancel, busy)):
+                pass
+        future = Future()
+        no_reply = f"no reply from {self.name} within {self.timeout:.1f} s"
+        try:
+            threading.Thread(target=_run_in_thread, args=(future, fn, args), daemon=True,
+                             name=f"generation-{self.name}").start()
+            while True:
+                try:
+                    return future.result(timeout=self._check(deadline, cancel, no_reply))
+                except FutureTimeoutError:
+                    continue
+        except (GenerationTimeout, GenerationCancelled):
+            if not future.done():
+                incr('generation_abandoned_calls')  # Still running; its thread ends when the backend returns
+            raise
+        finally:
+            self._slots.release()
+
+    def _retry(self, attempt, error, cancel):
+        """Backs off before the next attempt; re-raises `error` once the retries are used up."""
+        if isinstance(error, (GenerationBlocked, GenerationCancelled)) or attempt >= self.retries:
+            if isinstance(error, GenerationError):
+                raise error
+            raise GenerationError(f"{self.name} generation failed: {error}") from error
+        incr('generation_retries')
+        delay = self.retry_backoff * 2 ** attempt
+        print(f"Warning: {self.name} generation attempt {attempt + 1} failed ({error}); retrying in {delay:.1f} s.")
+        if cancel is None:
+            time.sleep(delay)
+        elif cancel.wait(delay):
+            incr('generation_cancelled')
+            raise GenerationCancelled("generation cancelled")
+
+    def generate(self, prompt, cancel=None):
+        """Returns the full reply text ('' for an empty reply)."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self._call(cancel, self._generate_once, prompt, self.timeout)
+            except Exception as e:
+                self._retry(attempt, e, cancel)
+
+    def stream(self, prompt, cancel=None):
+        """Yields reply text parts as they arrive; each part must arrive within the timeout."""
+        for attempt in range(self.retries + 1):
+            parts = self._stream_once(prompt, self.timeout)
+            produced = False
+            try:
+                while True:
+                    part = self._call(cancel, next, parts, None)
+                    if part is None:
+                        return
+                    produced = True
+                    yield part
+            except (GenerationBlocked, GenerationCancelled):
+                raise
+            except Exception as e:
+                if produced:  # Part of the reply was already handed out; a retry would repeat it
+                    raise GenerationError(f"{self.name} stream interrupted: {e}") from e
+                self._retry(attempt, e, cancel)
+            finally:
+                close = getattr(parts, 'close', None)
+                if close is not None:
+                    try:
+                        close()
+                    except ValueError:
+                        pass  # Still running on a worker thread after a timeout; it ends on its own
+
+
+# --- Gemini ---
+class GeminiGenerator(Generator):
+    """Google Gemini via google.generativeai (imported here, so other backends never load it)."""
+
+    name = 'gemini'
+
+    def __init__(self, model_name, api_key, **kwargs):
+        super().__init__(**kwargs)
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        self.genai = genai
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def _request(self, prompt, timeout, stream):
+        return self.model.generate_content(
+            prompt,
+            safety_settings=SAFETY_SETTINGS,
+            generation_config=self.genai.types.GenerationConfig(
+                # Optional: Adjust temperature, top_p, top_k etc.
+                # temperature=0.7
+            ),
+            stream=stream,
+            request_options={'timeout': timeout},
+        )
+
+    @staticmethod
+    def _raise_if_blocked(response):
+        block_reason = response.prompt_feedback.block_reason
+        if block_reason:
+            raise GenerationBlocked(block_reason)
+
+    def _generate_once(self, prompt, timeout):
+        response = self._request(prompt, timeout, stream=False)
+        if not response.parts:
+            self._raise_if_blocked(response)
+            return ""
+        return response.text
+
+    def _stream_once(self, prompt, timeout):
+        response = self._request(prompt, timeout, stream=True)
+        produced = False
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # Parts without text (e.g. a candidate stopped for safety) raise on .text
+            if text:
+                produced = True
+                yield text
+        if not produced:
+            self._raise_if_blocked(response)
+
+
+# --- Offline Stub ---
+class StubGenerator(Generator):
+    """Deterministic local stand-in for an LLM: no network, controllable latency and output size.
+
+    The reply echoes the prompt's context lines up to `output_chars`, so it is the
+    same for the same prompt. The first part arrives after `first_token_latency`
+    seconds and the whole reply after `latency` seconds. `jitter` varies both by
+    up to that fraction, seeded by the prompt. `error_rate` makes that share of
+    attempts fail, to exercise the retries.
+    """
+
+    name = 'stub'
+
+    def __init__(self, latency=0.0, first_token_latency=0.0, output_chars=STUB_OUTPUT_CHARS,
+                 chunk_chars=STUB_CHUNK_CHARS, jitter=0.0, error_rate=0.0, seed=0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.first_token_latency = min(first_token_latency, latency) if latency else first_token_latency
+        self.output_chars = output_chars
+        self.chunk_chars = chunk_chars
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self._attempts = 0
+        self._lock = threading.Lock()
+
+    def _rng(self, prompt):
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode('utf-8')).digest()
+        return random.Random(int.from_bytes(digest[:8], 'big'))
+
+    def _reply(self, prompt):
+        sections = prompt.split("---")  # The chatbot prompt puts its context between two '---' lines
+        context = " ".join(sections[1].split()) if len(sections) > 2 else ""
+        text = "Based on the provided context: " + (context or "no context was provided.")
+        while len(text) < self.output_chars:
+            text += " " + text
+        return text[:self.output_chars].rstrip()
+
+    def _attempt(self, prompt):
+        """Latencies (first part, remainder) for this attempt; raises for the simulated failures."""
+        with self._lock:
+            self._attempts += 1
+            attempt = self._attempts
+        rng = self._rng(prompt)
+        scale = 1 + self.jitter * (2 * rng.random() - 1)
+        if self.error_rate and random.Random(f"{self.seed}:{attempt}").random() < self.error_rate:
+            raise GenerationError(f"simulated {self.name} failure (attempt {attempt})")
+        first = self.first_token_latency * scale
+        return first, max(0.0, self.latency * scale - first)
+
+    def _generate_once(self, prompt, timeout):
+        first, rest = self._attempt(prompt)
+        time.sleep(first + rest)
+        return self._reply(prompt)
+
+    def _stream_once(self, prompt, timeout):
+        first, rest = self._attempt(prompt)
+        reply = self._reply(prompt)
+        parts = [reply[i:i + self.chunk_chars] for i in range(0, len(reply), self.chunk_chars)]
+        time.sleep(first)
+        for i, part in enumerate(parts):
+            if i:
+                time.sleep(rest / max(1, len(parts) - 1))
+            yield part
+
+
+def create_generator(backend, model_name=None, api_key=None, **kwargs):
+    """Builds the generator for `backend` ('gemini' or 'stub'); Gemini needs an API key."""
+    if backend == 'gemini':
+        if not api_key:
+            raise ValueError("GOOGLE_API_KEY environment variable not set.")
+        return GeminiGenerator(model_name, api_key, **kwargs)
+    if backend == 'stub':
+        return StubGenerator(**kwargs)
+    raise ValueError(f"Unknown generator backend '{backend}'. Expected one of {GENERATOR_BACKENDS}.")
@@ -0,0 +1,615 @@
+# kb_store.py
+import os
+import json
+import gzip
+import shutil
+import time
+import numpy as np
+from search_engine import normalize_rows
+from caches import LRUCache
+
+# --- Configuration ---
+EMBEDDINGS_FILE_NAME = "embeddings.npy"
+EMBEDDING_SCALES_FILE_NAME = "embedding_scales.npy"  # Per-row scale factors for int8 embeddings
+EMBEDDINGS_META_FILE_NAME = "embeddings_meta.json"
+EMBEDDING_PRECISIONS = ('float32', 'float16', 'int8')
+
+
+# --- Embedding Storage ---
+def quantize_embeddings(embeddings, precision='float32'):
+    """Normalizes embeddings and converts them to the requested storage precision.
+
+    Returns (matrix, scales). `scales` is None except for int8, where row i is
+    recovered as matrix[i] * scales[i] (symmetric per-row quantization).
+    """
+    if precision not in EMBEDDING_PRECISIONS:
+        raise ValueError(f"Unknown embedding precision '{precision}'. Expected one of {EMBEDDING_PRECISIONS}.")
+
+    # Cosine search only needs direction, so vectors are stored unit-length
+    vectors = normalize_rows(embeddings)
+
+    if precision == 'float32':
+        return vectors, None
+    if precision == 'float16':
+        return vectors.astype(np.float16), None
+
+    max_abs = np.abs(vectors).max(axis=1)
+    scales = (max_abs / 127.0).astype(np.float32)
+    scales[scales == 0] = 1.0  # All-zero rows quantize to zeros
+    quantized = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+
+def dequantize_embeddings(matrix, scales=None):
+    """Returns a float32 copy of stored embeddings (undoing int8 quantization when scales are given)."""
+    vectors = np.asarray(matrix, dtype=np.float32)
+    return vectors if scales is None else vectors * scales[:, None]
+
+
+def _save_embedding_extras(output_dir, precision, scales, count, dim):
+    """Writes the int8 scale factors (or removes stale ones) and the embeddings metadata file."""
+    scales_path = os.path.join(output_dir, EMBEDDING_SCALES_FILE_NAME)
+    if scales is not None:
+        np.save(scales_path, scales)
+    elif os.path.exists(scales_path):
+        os.remove(scales_path)  # Don't leave stale int8 scales next to float embeddings
+
+    meta = {'precision': precision, 'normalized': True, 'count': int(count), 'dim': int(dim)}
+    with open(os.path.join(output_dir, EMBEDDINGS_META_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+
+def save_embeddings(embeddings, output_dir, precision='float32'):
+    """Saves embeddings in the given precision, plus scale factors and a small metadata file."""
+    matrix, scales = quantize_embeddings(embeddings, precision)
+    np.save(os.path.join(output_dir, EMBEDDINGS_FILE_NAME), matrix)
+    _save_embedding_extras(output_dir, precision, scales, matrix.shape[0], matrix.shape[1])
+    return matrix
+
+
+class EmbeddingWriter:
+    """Writes embeddings block by block in the same format as save_embeddings.
+
+    Rows are quantized and appended to a temporary file as they arrive; close()
+    prepends the .npy header once the row count is known, so the full matrix is
+    never held in memory.
+    """
+
+    def __init__(self, output_dir, precision='float32'):
+        self.output_dir = output_dir
+        self.precision = precision
+        self.part_path = os.path.join(output_dir, EMBEDDINGS_FILE_NAME + ".part")
+        self.part_file = open(self.part_path, 'wb')
+        self.scales = []
+        self.count = 0
+        self.dim = None
+        self.dtype = None
+
+    def add(self, embeddings):
+        """Appends a block of rows (in chunk order)."""
+        matrix, scales = quantize_embeddings(np.asarray(embeddings, dtype=np.float32), self.precision)
+        if self.dim is None:
+            self.dim, self.dtype = matrix.shape[1], matrix.dtype
+        elif matrix.shape[1] != self.dim:
+            raise ValueError(f"Embedding dimension changed from {self.dim} to {matrix.shape[1]}.")
+        self.part_file.write(np.ascontiguousarray(matrix).tobytes())
+        if scales is not None:
+            self.scales.append(scales)
+        self.count += len(matrix)
+
+    def close(self):
+        """Writes embeddings.npy (plus scales and metadata) and returns the number of rows."""
+        self.part_file.close()
+        if self.dim is None:
+            os.remove(self.part_path)
+            raise ValueError("No embeddings were written.")
+        header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False,
+                  'shape': (self.count, self.dim)}
+        with open(os.path.join(self.output_dir, EMBEDDINGS_FILE_NAME), 'wb') as out, open(self.part_path, 'rb') as part:
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(part, out, 1 << 24)
+        os.remove(self.part_path)
+        scales = np.concatenate(self.scales) if self.scales else None
+        _save_embedding_extras(self.output_dir, self.precision, scales, self.count, self.dim)
+        return self.count
+
+    def abort(self):
+        """Closes and removes the partial file after a failed build."""
+        self.part_file.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+
+def load_embeddings(kb_dir, mmap=True):
+    """Loads the embedding matrix saved by save_embeddings.
+
+    With mmap=True the matrix is opened read-only memory-mapped, so several
+    worker processes share a single page-cache copy instead of each holding
+    a private one. Returns (matrix, scales, normalized). Files written before
+    the metadata file existed are treated as raw, un-normalized float32.
+    """
+    matrix = np.load(os.path.join(kb_dir, EMBEDDINGS_FILE_NAME), mmap_mode='r' if mmap else None)
+
+    meta = {}
+    meta_path = os.path.join(kb_dir, EMBEDDINGS_META_FILE_NAME)
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+    scales = None
+    if meta.get('precision') == 'int8':
+        scales = np.load(os.path.join(kb_dir, EMBEDDING_SCALES_FILE_NAME))
+
+    return matrix, scales, bool(meta.get('normalized', False))
+
+
+# --- Chunk Storage ---
+CHUNK_TEXT_FILE_NAME = "chunks_text.bin"  # Concatenated UTF-8 chunk contents
+CHUNK_OFFSETS_FILE_NAME = "chunks_offsets.npy"  # Byte offsets into the text blob (num_chunks + 1)
+CHUNK_COLUMNS_FILE_NAME = "chunks_columns.npz"  # Per-chunk category codes for each metadata field
+CHUNK_CATEGORIES_FILE_NAME = "chunks_categories.json"  # Distinct values behind each code column
+
+
+def chunk_store_exists(kb_dir):
+    """Returns True if a columnar chunk store has been written to kb_dir."""
+    return all(os.path.exists(os.path.join(kb_dir, name)) for name in
+               (CHUNK_TEXT_FILE_NAME, CHUNK_OFFSETS_FILE_NAME, CHUNK_COLUMNS_FILE_NAME, CHUNK_CATEGORIES_FILE_NAME))
+
+
+class ChunkStoreWriter:
+    """Writes chunks to the columnar chunk store one at a time.
+
+    Chunk contents are appended to a single UTF-8 blob; every other field
+    (restaurant_id, restaurant_name, type, item_name, ...) is interned into a
+    per-column category list and stored as an int32 code, with -1 for missing.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.text_file = open(os.path.join(output_dir, CHUNK_TEXT_FILE_NAME), 'wb')
+        self.offsets = [0]
+        self.codes = {}  # column -> list of codes, one per chunk
+        self.categories = {}  # column -> {value: code}
+
+    def add(self, chunk):
+        """Appends one chunk dict to the store."""
+        position = len(self.offsets) - 1
+        encoded = chunk.get('content', '').encode('utf-8')
+        self.text_file.write(encoded)
+        self.offsets.append(self.offsets[-1] + len(encoded))
+
+        for column, value in chunk.items():
+            if column == 'content':
+                continue
+            if column not in self.codes:
+                self.codes[column] = [-1] * position  # Earlier chunks didn't have this field
+                self.categories[column] = {}
+            if value is None:
+                continue
+            self.codes[column].append(self.categories[column].setdefault(value, len(self.categories[column])))
+        for column, codes in self.codes.items():
+            if len(codes) == position:
+                codes.append(-1)
+
+    def close(self):
+        """Flushes the text blob and writes the offset, code and category files."""
+        self.text_file.close()
+        np.save(os.path.join(self.output_dir, CHUNK_OFFSETS_FILE_NAME), np.asarray(self.offsets, dtype=np.int64))
+        np.savez(os.path.join(self.output_dir, CHUNK_COLUMNS_FILE_NAME),
+                 **{column: np.asarray(codes, dtype=np.int32) for column, codes in self.codes.items()})
+        with open(os.path.join(self.output_dir, CHUNK_CATEGORIES_FILE_NAME), 'w', encoding='utf-8') as f:
+            json.dump({column: list(values) for column, values in self.categories.items()}, f, ensure_ascii=False)
+        return len(self.offsets) - 1
+
+    def abort(self):
+        """Closes the text blob after a failed build; the caller discards the directory."""
+        self.text_file.close()
+
+
+def save_chunk_store(chunks, output_dir):
+    """Writes a list (or iterable) of chunk dicts as a columnar chunk store. Returns the chunk count."""
+    writer = ChunkStoreWriter(output_dir)
+    try:
+        for chunk in chunks:
+            writer.add(chunk)
+    finally:
+        count = writer.close()
+    return count
+
+
+class ChunkStore:
+    """Read-only, lazily-decoded view over a columnar chunk store.
+
+    Only offsets and small int32 code columns are held in memory; the text
+    blob is memory-mapped and each chunk's content is decoded on access.
+    Indexing returns the same dict shape knowledge_base.py originally pickled.
+    """
+
+    def __init__(self, kb_dir):
+        self.offsets = np.load(os.path.join(kb_dir, CHUNK_OFFSETS_FILE_NAME))
+        with np.load(os.path.join(kb_dir, CHUNK_COLUMNS_FILE_NAME)) as columns:
+            self.codes = {column: columns[column] for column in columns.files}
+        with open(os.path.join(kb_dir, CHUNK_CATEGORIES_FILE_NAME), 'r', encoding='utf-8') as f:
+            self.categories = json.load(f)
+
+        text_path = os.path.join(kb_dir, CHUNK_TEXT_FILE_NAME)
+        if os.path.getsize(text_path) > 0:
+            self.text = np.memmap(text_path, dtype=np.uint8, mode='r')
+        else:
+            self.text = np.empty(0, dtype=np.uint8)  # np.memmap can't map an empty file
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def content(self, i):
+        """Returns the text content of chunk i."""
+        return self.text[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def value(self, column, i):
+        """Returns the metadata value of `column` for chunk i, or None if it is missing."""
+        code = self.codes[column][i]
+        return self.categories[column][code] if code >= 0 else None
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"chunk index {i} out of range")
+        i = int(i) % len(self)
+        chunk = {}
+        for column in self.codes:
+            value = self.value(column, i)
+            if value is not None:
+                chunk[column] = value
+        chunk['content'] = self.content(i)
+        return chunk
+
+
+# --- Change Detection ---
+def kb_files_fingerprint(kb_dir, ignore_prefixes=("query_cache",)):
+    """Returns a cheap fingerprint (names, sizes, mtimes) of the files in kb_dir.
+
+    It changes whenever knowledge_base.py rewrites the KB. Runtime caches stored
+    next to the KB (matched by `ignore_prefixes`) are left out.
+    """
+    try:
+        entries = []
+        for entry in os.scandir(kb_dir):
+            if entry.is_file() and not entry.name.startswith(ignore_prefixes):
+                stat = entry.stat()
+                entries.append((entry.name, stat.st_size, stat.st_mtime_ns))
+        return tuple(sorted(entries))
+    except FileNotFoundError:
+        return ()
+
+
+# --- Metadata Filter Index ---
+FILTER_INDEX_FILE_NAME = "filter_index.npz"  # Sorted chunk row ids per (field, value)
+# Filter fields backed by the restaurants.json indexes; 'type' comes from the chunks themselves
+FILTER_FIELDS = {
+    'cuisine': 'by_cuisine',
+    'locality': 'by_location',
+    'open_status': 'by_opening_status',
+    'price_range': 'by_price_range',
+}
+SUBSTRING_FILTER_FIELDS = ('locality',)  # 'roorkee' matches 'roorkee locality, roorkee'
+
+
+def normalize_filter_value(value):
+    return str(value).strip().lower()
+
+
+def build_filter_postings(chunks, indexes):
+    """Maps "field=value" to the sorted row ids of chunks matching that filter.
+
+    Restaurant-level indexes (cuisine, locality, ...) are expanded to every chunk
+    of the listed restaurants; the chunk 'type' is indexed directly.
+    """
+    rows_by_restaurant = {}
+    rows_by_type = {}
+    for row, chunk in enumerate(chunks):
+        rows_by_restaurant.setdefault(chunk.get('restaurant_id'), []).append(row)
+        rows_by_type.setdefault(normalize_filter_value(chunk.get('type')), []).append(row)
+
+    postings = {f"type={chunk_type}": rows for chunk_type, rows in rows_by_type.items()}
+    for field, index_name in FILTER_FIELDS.items():
+        index = indexes.get(index_name, {}) if isinstance(indexes, dict) else {}
+        if not isinstance(index, dict):
+            continue
+        for value, restaurant_ids in index.items():
+            rows = postings.setdefault(f"{field}={normalize_filter_value(value)}", [])
+            for restaurant_id in restaurant_ids or []:
+                rows.extend(rows_by_restaurant.get(restaurant_id, []))
+
+    return {key: np.unique(np.asarray(rows, dtype=np.int64)) for key, rows in postings.items()}
+
+
+def save_filter_index(postings, output_dir):
+    """Writes the filter postings built by build_filter_postings."""
+    # Keys are stored in a separate array because npz member names can't hold arbitrary text
+    keys = list(postings)
+    np.savez(os.path.join(output_dir, FILTER_INDEX_FILE_NAME), keys=np.array(keys, dtype=str),
+             **{f"p{i}": postings[key] for i, key in enumerate(keys)})
+
+
+class FilterIndex:
+    """Turns metadata filters into the chunk row ids they allow.
+
+    Filters are a dict such as {'cuisine': 'biryani', 'type': ['menu_item', 'general']}:
+    values within a field are OR-ed, fields are AND-ed. Combined id lists are
+    cached, since most traffic repeats a small set of filters.
+    """
+
+    def __init__(self, kb_dir, cache_size=256):
+        with np.load(os.path.join(kb_dir, FILTER_INDEX_FILE_NAME)) as saved:
+            keys = saved['keys'].tolist()
+            self.postings = {key: saved[f"p{i}"] for i, key in enumerate(keys)}
+        self.values_by_field = {}
+        for key in self.postings:
+            field, value = key.split('=', 1)
+            self.values_by_field.setdefault(field, []).append(value)
+        self._cache = LRUCache(cache_size)
+
+    def fields(self):
+        return sorted(self.values_by_field)
+
+    def _field_ids(self, field, values):
+        if field not in self.values_by_field:
+            raise ValueError(f"Unknown filter field '{field}'. Available: {self.fields()}")
+        wanted = [normalize_filter_value(v) for v in (values if isinstance(values, (list, tuple, set)) else [values])]
+        if field in SUBSTRING_FILTER_FIELDS:
+            matched = [v for v in self.values_by_field[field] if any(w in v for w in wanted)]
+        else:
+            matched = [v for v in wanted if f"{field}={v}" in self.postings]
+        if not matched:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate([self.postings[f"{field}={v}"] for v in matched]))
+
+    def candidate_ids(self, filters):
+        """Returns the sorted chunk row ids that satisfy every filter (None if there are no filters)."""
+        filters = {field: values for field, values in (filters or {}).items() if values not in (None, '', [])}
+        if not filters:
+            return None
+
+        cache_key = tuple(sorted((field, repr(values)) for field, values in filters.items()))
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        ids = None
+        for field, values in filters.items():
+            field_ids = self._field_ids(field, values)
+            ids = field_ids if ids is None else np.intersect1d(ids, field_ids, assume_unique=True)
+            if ids.size == 0:
+                break
+
+        self._cache.put(cache_key, ids)
+        return ids
+
+
+# --- Compact Restaurant Data ---
+RESTAURANT_RECORDS_FILE_NAME = "restaurants.ndjson.gz"  # One gzip-compressed JSON line per restaurant
+RESTAURANT_INDEXES_SUFFIX = ".indexes.json.gz"  # Index section, stored next to the records file
+
+
+def restaurant_indexes_path(records_path):
+    """Path of the index section that belongs to a compact records file."""
+    base = records_path[:-len(".ndjson.gz")] if records_path.endswith(".ndjson.gz") else records_path
+    return base + RESTAURANT_INDEXES_SUFFIX
+
+
+def is_compact_restaurant_data(path):
+    return path.endswith(".ndjson.gz")
+
+
+def save_restaurants_compact(restaurants, indexes, records_path=RESTAURANT_RECORDS_FILE_NAME):
+    """Writes restaurants as gzip NDJSON ({"id": ..., "restaurant": {...}} per line) plus the index section.
+
+    Files are written to a temporary name and renamed, so readers never see a partial file.
+    """
+    indexes_path = restaurant_indexes_path(records_path)
+    for path, write in ((records_path, lambda f: _write_restaurant_records(f, restaurants)),
+                        (indexes_path, lambda f: json.dump(indexes, f, ensure_ascii=False, separators=(',', ':')))):
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    return records_path, indexes_path
+
+
+def _write_restaurant_records(f, restaurants):
+    for rest_id, restaurant in restaurants.items():
+        f.write(json.dumps({'id': rest_id, 'restaurant': restaurant}, ensure_ascii=False, separators=(',', ':')))
+        f.write("\n")
+
+
+def iter_restaurant_records(records_path):
+    """Yields (restaurant_id, restaurant dict) one line at a time; only the current record is in memory."""
+    with gzip.open(records_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record.get('id'), record.get('restaurant')
+
+
+def load_restaurant_indexes(records_path):
+    """Loads the index section of a compact records file ({} if it is missing)."""
+    indexes_path = restaurant_indexes_path(records_path)
+    if not os.path.exists(indexes_path):
+        print(f"[WARNING] Index section {indexes_path} not found; continuing without indexes.")
+        return {}
+    with gzip.open(indexes_path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# --- Sharded Layout ---
+SHARDS_FILE_NAME = "shards.json"  # Lists the shard directories of a sharded KB and their chunk counts
+SHARD_DIR_FORMAT = "shard_{:03d}"
+
+
+def shard_ranges(num_rows, num_shards):
+    """Splits rows 0..num_rows into num_shards contiguous (start, end) ranges of near-equal size."""
+    bounds = np.linspace(0, num_rows, num_shards + 1).round().astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def write_shard_manifest(kb_dir, shard_names, counts):
+    """Records the shard directories; written last, so a KB only counts as sharded once every shard exists."""
+    manifest = {'shards': [{'dir': name, 'count': int(count)} for name, count in zip(shard_names, counts)]}
+    with open(os.path.join(kb_dir, SHARDS_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_shard_manifest(kb_dir):
+    """Returns the shard directory paths of a sharded KB, or None if kb_dir is not sharded."""
+    try:
+        with open(os.path.join(kb_dir, SHARDS_FILE_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    return [os.path.join(kb_dir, shard['dir']) for shard in manifest['shards']]
+
+
+def shard_offsets(counts):
+    """Global row id of each shard's first row, plus the total as the last entry."""
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+class ShardedChunkStore:
+    """Presents the chunk stores of all shards as one store indexed by global row id."""
+
+    def __init__(self, stores):
+        self.stores = stores
+        self.offsets = shard_offsets([len(store) for store in stores])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __iter__(self):
+        for store in self.stores:
+            yield from store
+
+    def _locate(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"chunk index {i} out of range")
+        i = int(i) % len(self)
+        shard = int(np.searchsorted(self.offsets, i, side='right')) - 1
+        return self.stores[shard], i - int(self.offsets[shard])
+
+    def content(self, i):
+        store, row = self._locate(i)
+        return store.content(row) if hasattr(store, 'content') else store[row]['content']
+
+    def __getitem__(self, i):
+        store, row = self._locate(i)
+        return store[row]
+
+
+class ShardedFilterIndex:
+    """Runs metadata filters on every shard's FilterIndex and returns global row ids."""
+
+    def __init__(self, filter_indexes, offsets):
+        self.filter_indexes = filter_indexes
+        self.offsets = offsets
+
+    def fields(self):
+        return sorted({field for index in self.filter_indexes for field in index.fields()})
+
+    def candidate_ids(self, filters):
+        """Sorted global row ids satisfying every filter (None if there are no filters)."""
+        filters = {field: values for field, values in (filters or {}).items() if values not in (None, '', [])}
+        if not filters:
+            return None
+        unknown = set(filters) - set(self.fields())
+        if unknown:
+            raise ValueError(f"Unknown filter field '{sorted(unknown)[0]}'. Available: {self.fields()}")
+
+        parts = []
+        for index, offset in zip(self.filter_indexes, self.offsets):
+            if not set(filters) <= set(index.fields()):
+                continue  # A field with no values in this shard can't match any of its chunks
+            parts.append(index.candidate_ids(filters) + offset)
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+
+# --- Versioned Layout ---
+KB_VERSIONS_DIR_NAME = "versions"  # kb_data/versions/<version>/ holds one complete KB build
+KB_CURRENT_FILE_NAME = "CURRENT"  # Name of the version being served; replaced atomically on publish
+KB_STAGING_SUFFIX = ".partial"  # A version directory is only renamed into place once its build succeeded
+
+
+def new_kb_version(kb_root):
+    """Creates an empty staging directory for a new KB build; returns (version, staging_dir)."""
+    versions_dir = os.path.join(kb_root, KB_VERSIONS_DIR_NAME)
+    os.makedirs(versions_dir, exist_ok=True)
+    base = time.strftime("%Y%m%d-%H%M%S")
+    version, n = base, 1
+    while os.path.exists(os.path.join(versions_dir, version)) or \
+            os.path.exists(os.path.join(versions_dir, version + KB_STAGING_SUFFIX)):
+        n += 1
+        version = f"{base}-{n}"
+    staging_dir = os.path.join(versions_dir, version + KB_STAGING_SUFFIX)
+    os.makedirs(staging_dir)
+    return version, staging_dir
+
+
+def publish_kb_version(kb_root, version, staging_dir):
+    """Moves a finished build into place and points CURRENT at it.
+
+    Both steps are atomic renames, so a reader sees either the old version or
+    the complete new one, never a half-written KB.
+    """
+    version_dir = os.path.join(kb_root, KB_VERSIONS_DIR_NAME, version)
+    os.rename(staging_dir, version_dir)
+    tmp_path = os.path.join(kb_root, KB_CURRENT_FILE_NAME + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(kb_root, KB_CURRENT_FILE_NAME))
+    return version_dir
+
+
+def discard_kb_version(staging_dir):
+    """Removes the staging directory of a failed build."""
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def current_kb_version(kb_root):
+    """Returns the version named in CURRENT, or None for an unversioned (flat) KB."""
+    try:
+        with open(os.path.join(kb_root, KB_CURRENT_FILE_NAME), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_kb_dir(kb_root, version=None):
+    """Directory holding the served KB files: the CURRENT version, or kb_root itself for a flat KB."""
+    version = version or current_kb_version(kb_root)
+    return os.path.join(kb_root, KB_VERSIONS_DIR_NAME, version) if version else kb_root
+
+
+def kb_version_sort_key(version):
+    """Orders version names by build time: '20250101-120000-10' is newer than '20250101-120000-2'."""
+    base, n = version[:15], version[16:]  # new_kb_version names: YYYYmmdd-HHMMSS, then -N for same-second builds
+    return base, int(n) if n.isdigit() else 1
+
+
+def prune_kb_versions(kb_root, keep):
+    """Deletes all but the `keep` newest published versions (never CURRENT).
+
+    Older versions stay on disk for a while so a serving process can finish
+    in-flight queries against them after switching to the new one.
+    """
+    versions_dir = os.path.join(kb_root, KB_VERSIONS_DIR_NAME)
+    if not os.path.isdir(versions_dir):
+        return []
+    current = current_kb_version(kb_root)
+    versions = sorted((name for name in os.listdir(versions_dir) if not name.endswith(KB_STAGING_SUFFIX)),
+                      key=kb_version_sort_key, reverse=True)
+    removed = [name for name in versions[keep:] if name != current]
+    for name in removed:
+        # Files still mapped by a running chatbot may refuse deletion on Windows; the next prune retries
+        shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    return removed
@@ -368,15 +368,37 @@
 import json
 import os
 import numpy as np
-from sentence_transformers import SentenceTransformer
-import pickle # To save processed data and embeddings
 import re # Import regex for basic text cleaning
+import argparse
+import hashlib
+import multiprocessing
+from encoders import ENCODER_BACKENDS, encoder_id, load_encoder
+from search_engine import FAISS_INDEX_TYPES, BM25Index, build_faiss_index, save_faiss_index, faiss_index_path
+from kb_store import (EMBEDDING_PRECISIONS, EMBEDDINGS_FILE_NAME, CHUNK_TEXT_FILE_NAME, save_embeddings,
+                      save_chunk_store, chunk_store_exists, build_filter_postings, save_filter_index,
+                      ChunkStore, ChunkStoreWriter, EmbeddingWriter, load_embeddings, dequantize_embeddings,
+                      RESTAURANT_RECORDS_FILE_NAME,
+                      is_compact_restaurant_data, restaurant_indexes_path, iter_restaurant_records,
+                      load_restaurant_indexes, SHARDS_FILE_NAME, SHARD_DIR_FORMAT, shard_ranges,
+                      write_shard_manifest, new_kb_version, publish_kb_version, discard_kb_version,
+                      prune_kb_versions, current_kb_version, resolve_kb_dir, read_shard_manifest)
 
 # --- Configuration ---
 # Path: Look for the file in the current directory
 DATA_FILE = "restaurants.json"
-OUTPUT_DIR = "kb_data" # Directory to save knowledge base components
+COMPACT_DATA_FILE = RESTAURANT_RECORDS_FILE_NAME # Streamed alternative to DATA_FILE; the newer of the two is used (see scraper.py --format)
+OUTPUT_DIR = "kb_data" # Directory to save knowledge base components (each build is a new version under versions/)
 EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2' # Efficient and effective model
+ENCODER_BACKEND = 'torch' # 'torch', 'onnx' or 'onnx-int8'; chatbot.py must query with the same backend
+FAISS_INDEXES = [] # FAISS index types to prebuild ('flat', 'ivf', 'hnsw'); otherwise chatbot.py builds one on first use
+EMBEDDING_PRECISION = 'float32' # Storage precision for embeddings.npy: 'float32', 'float16' or 'int8'
+EMBEDDING_CACHE_FILE_NAME = "embedding_cache.npz" # Content hashes of the published embeddings' rows, for incremental builds
+MANIFEST_FILE_NAME = "manifest.json" # Records the inputs and settings of the last successful build
+ENCODE_WORKERS = os.cpu_count() or 1 # Encoder processes for --streaming builds
+ENCODE_BATCH_SIZE = 64 # Chunks per encode call; batches hold chunks of similar length to minimize padding
+STREAM_WINDOW_SIZE = 16384 # Chunks buffered, length-sorted and encoded together before being written out
+NUM_SHARDS = 1 # >1 splits the KB into shard directories that chatbot.py searches in parallel
+KB_VERSIONS_KEEP = 3 # Published versions kept on disk; older ones are deleted after each build
 
 # --- Helper Functions ---
 def load_data(filepath):
@@ -409,13 +431,11 @@ def safe_join(items, separator=", "):
     return separator.join([safe_str(item) for item in items if safe_str(item).strip() != '' and safe_str(item).strip() != 'N/A']).strip() or 'N/A'
 
 
-def create_knowledge_base_chunks(full_data_dict):
+def iter_knowledge_base_chunks(full_data_dict):
     """
     Transforms the full data dictionary (including restaurants and indexes)
-    into text chunks suitable for embedding.
+    into text chunks suitable for embedding, yielding them one at a time.
     """
-    chunks = []
-
     # Extract relevant parts from the full data dictionary
     restaurants_data_dict = full_data_dict.get('restaurants', {})
     indexes_data_dict = full_data_dict.get('indexes', {}) # Get the indexes data
@@ -429,13 +449,23 @@ def create_knowledge_base_chunks(full_data_dict):
         indexes_data_dict = {}
 
     print(f"Processing {len(restaurants_data_dict)} restaurant entries and {len(indexes_data_dict)} index entries.")
+    yield from iter_record_chunks(restaurants_data_dict.items(), indexes_data_dict)
+
 
+def iter_record_chunks(records, indexes_data_dict):
+    """
+    Yields the chunks for (restaurant_id, restaurant) pairs one restaurant at a time,
+    then the index chunks. Only restaurant names are kept between records, so
+    records can be streamed from disk (see kb_store.iter_restaurant_records).
+    """
+    restaurant_names = {} # rest_id -> name, for the index chunks
 
     # --- Process Restaurant Data ---
-    for rest_id, restaurant in restaurants_data_dict.items():
+    for rest_id, restaurant in records:
         if not isinstance(restaurant, dict):
             print(f"[WARNING] Skipping invalid restaurant entry for ID {rest_id}.")
             continue
+        restaurant_names[rest_id] = restaurant.get("name", f"Unknown Restaurant ({rest_id})")
 
         rest_name = restaurant.get("name", "N/A")
         if rest_name == "N/A":
@@ -470,7 +500,7 @@ def create_knowledge_base_chunks(full_data_dict):
             f"Current Status: {current_status}. "
             # Add other key features if available in your JSON
         )
-        chunks.append({"restaurant_id": rest_id, "restaurant_name": rest_name, "content": general_info.strip(), "type": "general"})
+        yield {"restaurant_id": rest_id, "restaurant_name": rest_name, "content": general_info.strip(), "type": "general"}
 
 
         # --- Chunk 2+: Menu Items (Chunk per item) ---
@@ -499,7 +529,7 @@ def create_knowledge_base_chunks(full_data_dict):
                     f"Price: {formatted_price}."
                     # Add other menu item details if available (e.g., description, tags)
                 )
-                chunks.append({"restaurant_id": rest_id, "restaurant_name": rest_name, "content": menu_chunk.strip(), "type": "menu_item", "item_name": item_name})
+                yield {"restaurant_id": rest_id, "restaurant_name": rest_name, "content": menu_chunk.strip(), "type": "menu_item", "item_name": item_name}
 
         # If menu_info is not a list or is empty, no menu chunks are added, which is fine.
 
@@ -507,16 +537,17 @@ def create_knowledge_base_chunks(full_data_dict):
     # --- Process Index Data ---
     # Assuming the index data is a dictionary like {'rest_id': 'keywords/description text', ...}
     for rest_id, index_content in indexes_data_dict.items():
-        # Find the restaurant name for this ID (lookup in the restaurants dict)
-        restaurant = restaurants_data_dict.get(rest_id, {})
-        rest_name = restaurant.get("name", f"Unknown Restaurant ({rest_id})") # Default name if not found
+        # Find the restaurant name for this ID (lookup in the names seen above)
+        rest_name = restaurant_names.get(rest_id, f"Unknown Restaurant ({rest_id})") # Default name if not found
 
         if index_content and isinstance(index_content, str) and index_content.strip():
             index_chunk = f"Information for {rest_name} ({rest_id}): {index_content.strip()}"
-            chunks.append({"restaurant_id": rest_id, "restaurant_name": rest_name, "content": index_chunk, "type": "index"})
+            yield {"restaurant_id": rest_id, "restaurant_name": rest_name, "content": index_chunk, "type": "index"}
         # If index_content is empty or not a string, it's skipped, which is fine.
 
-
+def create_knowledge_base_chunks(full_data_dict):
+    """Returns every chunk from iter_knowledge_base_chunks as a list."""
+    chunks = list(iter_knowledge_base_chunks(full_data_dict))
     print(f"Created a total of {len(chunks)} text chunks.")
     return chunks
 
@@ -546,74 +577,462 @@ def generate_embeddings(text_chunks, model):
         return np.array([])
 
 # save_knowledge_base function remains the same
-def save_knowledge_base(chunks, embeddings, output_dir):
-    """Saves the processed chunks and their embeddings."""
+def save_knowledge_base(chunks, embeddings, output_dir, precision=EMBEDDING_PRECISION):
+    """Saves the processed chunks and their embeddings.
+
+    Chunks go to the columnar chunk store (chunks_text.bin plus offset, code and
+    category files) that chatbot.py reads lazily. Embeddings are stored
+    unit-normalized in `precision` ('float32', 'float16', or 'int8' with per-row
+    scale factors in embedding_scales.npy). Returns False if nothing was saved.
+    """
+    if not chunks or embeddings.size == 0:
+        print(f"No chunks or embeddings to save in {output_dir}.")
+        return False
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         print(f"Created directory: {output_dir}")
 
-    chunks_path = os.path.join(output_dir, "text_chunks.pkl")
+    chunks_path = os.path.join(output_dir, CHUNK_TEXT_FILE_NAME)
     embeddings_path = os.path.join(output_dir, "embeddings.npy")
 
     try:
-        if chunks:
-            with open(chunks_path, 'wb') as f:
-                pickle.dump(chunks, f)
-            print(f"Saved {len(chunks)} text chunks to {chunks_path}")
-        else:
-            print("No chunks to save.")
-
-        if embeddings.size > 0:
-            np.save(embeddings_path, embeddings)
-            print(f"Saved {embeddings.shape[0]} embeddings to {embeddings_path}")
-        else:
-            print("No embeddings to save.")
+        saved_count = save_chunk_store(chunks, output_dir)
+        print(f"Saved {saved_count} text chunks to {chunks_path}")
+        saved = save_embeddings(embeddings, output_dir, precision)
+        print(f"Saved {saved.shape[0]} {precision} embeddings to {embeddings_path}")
+        return True
 
     except IOError as e:
         print(f"Error saving knowledge base files: {e}")
-    except pickle.PicklingError as e:
-        print(f"Error pickling text chunks: {e}")
     except Exception as e:
         print(f"An unexpected error occurred during saving: {e}")
+    return False
+
+def load_embedding_model(model_name=EMBEDDING_MODEL_NAME, backend=ENCODER_BACKEND):
+    """Loads the encoder for `backend`, importing it only when an encode is actually needed."""
+    try:
+        model = load_encoder(model_name, backend)
+        print(f"Loaded embedding model: {model_name} ({backend} backend)")
+        return model
+    except Exception as e:
+        print(f"Error loading embedding model ('{model_name}', {backend} backend): {e}")
+        print("Please ensure the model name is correct and you have an internet connection.")
+        print("You might need to install required libraries: pip install sentence-transformers numpy")
+        return None
+
+# --- Incremental Build Helpers ---
+def file_sha256(filepath):
+    """Returns the hex SHA-256 of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_cache_key(content, model_name=EMBEDDING_MODEL_NAME):
+    """Cache key for one chunk's embedding: hex SHA-256 of the model name plus the chunk content.
+
+    Hex rather than raw digests: NumPy's bytes dtype drops trailing NUL bytes, so
+    raw digests ending in b'\\x00' would never match after a save/load round trip.
+    """
+    return hashlib.sha256(f"{model_name}\0{content}".encode('utf-8')).hexdigest()
+
+def load_embedding_cache(output_dir, precision=None):
+    """Loads the embedding cache as a {key: vector} dict (empty if missing or unreadable).
+
+    The cache file only holds keys; the vectors are read back from the KB version
+    it was saved for (row i of its embeddings belongs to key i). If that version
+    stored them at a lossy precision other than `precision`, the cache is
+    ignored, so e.g. an int8 KB never seeds a float32 rebuild.
+    """
+    cache_path = os.path.join(output_dir, EMBEDDING_CACHE_FILE_NAME)
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with np.load(cache_path) as cache:
+            keys = cache['keys'].tolist()
+            if 'vectors' in cache.files:  # Written before the cache pointed at the published embeddings
+                return dict(zip(keys, cache['vectors']))
+            version = str(cache['version']) or None
+        kb_dir = resolve_kb_dir(output_dir, version)
+        if not os.path.isdir(kb_dir):
+            print(f"[WARNING] Ignoring embedding cache: KB version {version} no longer exists.")
+            return {}
+        matrices = [load_embeddings(shard_dir) for shard_dir in read_shard_manifest(kb_dir) or [kb_dir]]
+        stored_dtype = matrices[0][0].dtype
+        if precision is not None and stored_dtype != np.float32 and stored_dtype != np.dtype(precision):
+            print(f"Embedding cache holds {stored_dtype} embeddings; re-encoding everything for {precision}.")
+            return {}
+        vectors = np.vstack([dequantize_embeddings(matrix, scales) for matrix, scales, _ in matrices])
+        if len(vectors) != len(keys):
+            raise ValueError(f"{len(keys)} keys but {len(vectors)} embeddings in {kb_dir}")
+        return dict(zip(keys, vectors))
+    except Exception as e:
+        print(f"[WARNING] Ignoring unreadable embedding cache {cache_path}: {e}")
+        return {}
+
+def save_embedding_cache(output_dir, text_chunks, model_name=EMBEDDING_MODEL_NAME, version=None):
+    """Records the content key of every chunk of the published KB `version`, in embedding row order.
+
+    Only keys are written, not vectors, so the cache costs 64 bytes per chunk
+    instead of a second copy of the embeddings, and never outgrows the KB.
+    """
+    keys = np.array([chunk_cache_key(chunk.get('content', ''), model_name) for chunk in text_chunks], dtype='U64')
+    np.savez(os.path.join(output_dir, EMBEDDING_CACHE_FILE_NAME), keys=keys, version=np.array(version or ''))
+
+def generate_embeddings_incremental(text_chunks, output_dir, model_name=EMBEDDING_MODEL_NAME, backend=ENCODER_BACKEND,
+                                    precision=EMBEDDING_PRECISION):
+    """Generates embeddings, re-encoding only chunks whose content is not in the cache.
+
+    The model is loaded only if at least one chunk is new or changed.
+    Returns an empty array on failure, like generate_embeddings.
+    """
+    cache = load_embedding_cache(output_dir, precision)
+    keys = [chunk_cache_key(chunk.get('content', ''), encoder_id(model_name, backend)) for chunk in text_chunks]
+    missing = [i for i, key in enumerate(keys) if key not in cache]
+    print(f"Embedding cache: {len(text_chunks) - len(missing)} hits, {len(missing)} chunks to encode.")
+
+    new_vectors = {}
+    if missing:
+        model = load_embedding_model(model_name, backend)
+        if model is None:
+            return np.array([])
+        try:
+            encoded = model.encode([text_chunks[i].get('content', '') for i in missing], show_progress_bar=True)
+        except Exception as e:
+            print(f"Error during embedding generation: {e}")
+            return np.array([])
+        new_vectors = dict(zip((keys[i] for i in missing), encoded))
+
+    return np.array([cache[key] if key in cache else new_vectors[key] for key in keys], dtype=np.float32)
+
+def read_manifest(output_dir):
+    """Returns the manifest of the last successful build, or None."""
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def write_manifest(output_dir, data_hash, settings, num_chunks, version=None):
+    """Records the input hash, build settings and published version once the KB files are written."""
+    manifest = {'data_sha256': data_hash, 'settings': settings, 'num_chunks': num_chunks, 'version': version}
+    with open(os.path.join(output_dir, MANIFEST_FILE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+def is_build_up_to_date(output_dir, data_hash, settings):
+    """True if the last build used the same input data and settings and is still the served version."""
+    manifest = read_manifest(output_dir)
+    if (manifest is None or manifest.get('data_sha256') != data_hash or manifest.get('settings') != settings
+            or manifest.get('version') != current_kb_version(output_dir)):
+        return False
+    kb_dir = resolve_kb_dir(output_dir)
+    return (os.path.exists(os.path.join(kb_dir, SHARDS_FILE_NAME))
+            or (os.path.exists(os.path.join(kb_dir, EMBEDDINGS_FILE_NAME)) and chunk_store_exists(kb_dir)))
+
+def choose_data_file(candidates=(COMPACT_DATA_FILE, DATA_FILE)):
+    """Picks the most recently modified existing input file, so a stale copy never overrides fresher data.
+
+    On equal modification times the first candidate (the compact file) wins.
+    Returns DATA_FILE if none exist, so the usual "not found" error is reported.
+    """
+    existing = [path for path in candidates if os.path.exists(path)]
+    if not existing:
+        return DATA_FILE
+    data_file = max(existing, key=os.path.getmtime)  # max keeps the first of equal mtimes
+    others = [path for path in existing if path != data_file]
+    print(f"Using input data {data_file}" + (f" (newer than {', '.join(others)})" if others else ""))
+    return data_file
+
+def open_chunk_source(data_file):
+    """Returns (make_chunk_iter, indexes) for a restaurants.json or compact restaurants.ndjson.gz file.
+
+    make_chunk_iter() starts a fresh pass over the chunks; for compact files the
+    restaurants are read from disk one record at a time. Returns (None, None) on failure.
+    """
+    if is_compact_restaurant_data(data_file):
+        if not os.path.exists(data_file):
+            print(f"Error: Data file not found at {data_file}")
+            return None, None
+        indexes = load_restaurant_indexes(data_file)
+        print(f"Streaming restaurant records from {data_file}")
+        return (lambda: iter_record_chunks(iter_restaurant_records(data_file), indexes)), indexes
+
+    full_kb_data = load_data(data_file)
+    if full_kb_data is None:
+        return None, None
+    return (lambda: iter_knowledge_base_chunks(full_kb_data)), full_kb_data.get('indexes', {})
+
+# --- Streaming Build ---
+_worker_encoder = None # Encoder loaded once per encode worker process
+
+def _init_encode_worker(model_name, backend, num_threads):
+    global _worker_encoder
+    _worker_encoder = load_encoder(model_name, backend, num_threads=num_threads)
+
+def _encode_batch(texts):
+    return np.asarray(_worker_encoder.encode(texts, batch_size=len(texts), show_progress_bar=False), dtype=np.float32)
+
+def _encode_window(contents, pool, batch_size):
+    """Encodes one window of chunk texts; returns their vectors in the original order.
+
+    Texts are sorted by length (characters, a close proxy for token count) so each
+    batch pads to a similar length, and batches are spread over the worker pool.
+    """
+    order = sorted(range(len(contents)), key=lambda i: len(contents[i]))
+    batches = [[contents[i] for i in order[start:start + batch_size]] for start in range(0, len(order), batch_size)]
+    encoded = np.vstack(list(pool.imap(_encode_batch, batches) if pool else map(_encode_batch, batches)))
+    vectors = np.empty_like(encoded)
+    vectors[order] = encoded
+    return vectors
+
+def build_streaming(chunk_iter, output_dir, precision=EMBEDDING_PRECISION, backend=ENCODER_BACKEND,
+                    workers=ENCODE_WORKERS, batch_size=ENCODE_BATCH_SIZE, window_size=STREAM_WINDOW_SIZE):
+    """Encodes chunks as they are produced and writes chunks and embeddings to disk window by window.
+
+    Only one window of chunk texts and vectors is in memory at a time; with workers > 1
+    batches are encoded by a pool of processes, each loading its own encoder.
+    Each window is batched by character length, an approximation of token length
+    that avoids tokenizing every chunk twice.
+    Returns the number of chunks written, or 0 on failure; the caller discards
+    output_dir then. The writers' files are closed even if the build fails.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    pool = chunk_writer = embedding_writer = None
+    try:
+        if workers > 1:
+            pool = multiprocessing.Pool(workers, initializer=_init_encode_worker,
+                                        initargs=(EMBEDDING_MODEL_NAME, backend, threads_per_worker))
+        else:
+            _init_encode_worker(EMBEDDING_MODEL_NAME, backend, None)
+        print(f"Streaming build: {workers} encode worker(s), batch size {batch_size}, window {window_size} chunks.")
+
+        chunk_writer = ChunkStoreWriter(output_dir)
+        embedding_writer = EmbeddingWriter(output_dir, precision)
+        window = []
+        for chunk in chunk_iter:
+            chunk_writer.add(chunk)
+            window.append(chunk.get('content', ''))
+            if len(window) == window_size:
+                embedding_writer.add(_encode_window(window, pool, batch_size))
+                print(f"  Encoded {embedding_writer.count} chunks...")
+                window = []
+        if window:
+            embedding_writer.add(_encode_window(window, pool, batch_size))
+        num_chunks = chunk_writer.close()
+        embedding_writer.close()
+        chunk_writer = embedding_writer = None  # Both closed; nothing left to abort
+        print(f"Wrote {num_chunks} chunks and embeddings to {output_dir}")
+        return num_chunks
+    except Exception as e:
+        print(f"Error during streaming build: {e}")
+        return 0
+    finally:
+        for writer in (chunk_writer, embedding_writer):
+            if writer is not None:
+                writer.abort()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def build_filter_index(chunks, indexes, output_dir):
+    """Saves per-field chunk id lists (cuisine, locality, open status, price range, type) for filtered search."""
+    try:
+        postings = build_filter_postings(chunks, indexes)
+        save_filter_index(postings, output_dir)
+        print(f"Saved metadata filter index with {len(postings)} field values")
+    except Exception as e:
+        print(f"Error building metadata filter index: {e}")
+
+def build_bm25_index(chunks, output_dir, index=None):
+    """Saves a BM25 inverted index over chunk contents for chatbot.py's hybrid retrieval mode.
+
+    Pass a prebuilt `index` (e.g. a shard slice of the full index) to save it instead of building one.
+    """
+    try:
+        if index is None:
+            index = BM25Index.build(chunk['content'] for chunk in chunks)
+        index.save(output_dir)
+        print(f"Saved BM25 index with {len(index.vocab)} terms over {len(index)} chunks")
+    except Exception as e:
+        print(f"Error building BM25 index: {e}")
+
+def build_faiss_indexes(embeddings, output_dir, index_types):
+    """Builds and saves one FAISS index per requested type for chatbot.py's FAISS backends."""
+    for index_type in index_types:
+        index_path = faiss_index_path(output_dir, index_type)
+        try:
+            index = build_faiss_index(embeddings, index_type)
+            save_faiss_index(index, index_path)
+            print(f"Saved FAISS '{index_type}' index with {index.ntotal} vectors to {index_path}")
+        except ImportError as e:
+            print(f"Skipping FAISS index build: {e}")
+            return
+        except Exception as e:
+            print(f"Error building FAISS '{index_type}' index: {e}")
+
+def save_sharded_knowledge_base(chunks, embeddings, output_dir, num_shards, indexes, precision=EMBEDDING_PRECISION,
+                                index_types=FAISS_INDEXES):
+    """Splits the KB into num_shards contiguous shard directories, each with its own indexes.
+
+    Every shard is a complete KB directory (chunks, embeddings, FAISS, filter and
+    BM25 indexes). Shard BM25 indexes are slices of one index over all chunks, so
+    their scores are comparable across shards. shards.json is written last, so
+    chatbot.py only switches to the sharded layout once every shard is complete.
+    There are never more shards than chunks, so no shard is empty.
+    """
+    if num_shards > len(chunks):
+        print(f"Only {len(chunks)} chunks; using {len(chunks)} shards instead of {num_shards}.")
+        num_shards = len(chunks)
+    bm25_index = BM25Index.build(chunk['content'] for chunk in chunks)
+    shard_names, counts = [], []
+    for shard, (start, end) in enumerate(shard_ranges(len(chunks), num_shards)):
+        shard_name = SHARD_DIR_FORMAT.format(shard)
+        shard_dir = os.path.join(output_dir, shard_name)
+        shard_chunks, shard_embeddings = chunks[start:end], embeddings[start:end]
+        print(f"Shard {shard_name}: chunks {start}-{end - 1}")
+        if not save_knowledge_base(shard_chunks, shard_embeddings, shard_dir, precision=precision):
+            return False
+        build_faiss_indexes(shard_embeddings, shard_dir, index_types)
+        build_filter_index(shard_chunks, indexes, shard_dir)
+        build_bm25_index(shard_chunks, shard_dir, index=bm25_index.slice(start, end))
+        shard_names.append(shard_name)
+        counts.append(end - start)
+    write_shard_manifest(output_dir, shard_names, counts)
+    print(f"Saved {len(chunks)} chunks in {len(shard_names)} shards ({SHARDS_FILE_NAME})")
+    return True
+
+def publish_version(version, kb_dir, keep=KB_VERSIONS_KEEP):
+    """Makes a finished build the CURRENT version (picked up by running chatbots) and prunes old versions."""
+    publish_kb_version(OUTPUT_DIR, version, kb_dir)
+    print(f"Published knowledge base version {version}")
+    removed = prune_kb_versions(OUTPUT_DIR, keep)
+    if removed:
+        print(f"Removed old knowledge base versions: {', '.join(removed)}")
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the chatbot knowledge base from restaurants.json.")
+    parser.add_argument("--faiss-index", nargs="*", choices=FAISS_INDEX_TYPES, default=FAISS_INDEXES,
+                        help="FAISS index types to prebuild (default: none; chatbot.py builds the one "
+                             "SEARCH_BACKEND needs on first load).")
+    parser.add_argument("--precision", choices=EMBEDDING_PRECISIONS, default=EMBEDDING_PRECISION,
+                        help="Storage precision for the saved embeddings.")
+    parser.add_argument("--encoder", choices=ENCODER_BACKENDS, default=ENCODER_BACKEND,
+                        help="Encoder backend; 'onnx'/'onnx-int8' export the model on first use (see encoders.py).")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Skip unchanged builds and only re-encode new or changed chunks.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Encode chunks as they are produced with a process pool, writing results to disk "
+                             "window by window (for large catalogs; does not use the embedding cache).")
+    parser.add_argument("--workers", type=int, default=ENCODE_WORKERS, help="Encoder processes for --streaming.")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE, help="Chunks per encode batch for --streaming.")
+    parser.add_argument("--shards", type=int, default=NUM_SHARDS,
+                        help="Split the KB into this many shard directories, searched in parallel by chatbot.py.")
+    parser.add_argument("--data", default=None,
+                        help=f"Input data: {DATA_FILE} or {COMPACT_DATA_FILE} "
+                             f"(default: whichever of the two was modified last).")
+    args = parser.parse_args()
+    data_file = args.data or choose_data_file()
+    if args.streaming and args.shards > 1:
+        print("--shards is not supported with --streaming yet; building an unsharded knowledge base.")
+        args.shards = 1
+
     print("Starting knowledge base creation process...")
 
-    # 1. Load Data (Loads the full dictionary including 'restaurants' and 'indexes')
-    full_kb_data = load_data(DATA_FILE)
-    if full_kb_data is None:
+    # 0. Incremental mode: nothing to do if the input data and build settings match the last build
+    build_settings = {'model': encoder_id(EMBEDDING_MODEL_NAME, args.encoder), 'precision': args.precision, 'faiss_indexes': sorted(args.faiss_index), 'shards': args.shards}
+    data_paths = [data_file] + ([restaurant_indexes_path(data_file)] if is_compact_restaurant_data(data_file) else [])
+    data_hash = ":".join(file_sha256(path) for path in data_paths) if all(map(os.path.exists, data_paths)) else None
+    if args.incremental and is_build_up_to_date(OUTPUT_DIR, data_hash, build_settings):
+        print(f"Knowledge base version {current_kb_version(OUTPUT_DIR)} in {OUTPUT_DIR} is up to date with {data_file}. "
+              "Nothing to rebuild.")
+        exit()
+
+    # 1. Open Data (restaurants.json is loaded whole; compact records are streamed one restaurant at a time)
+    make_chunk_iter, indexes = open_chunk_source(data_file)
+    if make_chunk_iter is None:
         print("Failed to load data. Exiting.")
         exit()
 
+    # Every build goes to a fresh version directory; chatbot.py keeps serving CURRENT until it is published
+    version, kb_dir = new_kb_version(OUTPUT_DIR)
+    print(f"Building knowledge base version {version} in {kb_dir}")
+
+    # 2-5 (streaming). Chunk, encode and save window by window instead of holding every chunk and vector in memory
+    if args.streaming:
+        try:
+            num_chunks = build_streaming(make_chunk_iter(), kb_dir, precision=args.precision,
+                                         backend=args.encoder, workers=max(1, args.workers), batch_size=args.batch_size)
+        except BaseException:  # e.g. Ctrl+C mid-build: don't leave a half-written version behind
+            discard_kb_version(kb_dir)
+            raise
+        if num_chunks == 0:
+            print("Streaming build failed, knowledge base files were not saved.")
+            discard_kb_version(kb_dir)
+            exit()
+        text_chunks = ChunkStore(kb_dir)
+        if args.faiss_index:
+            # FAISS needs the float matrix in memory anyway; dequantize the stored embeddings
+            stored, scales, _ = load_embeddings(kb_dir)
+            embeddings = dequantize_embeddings(stored, scales)
+            build_faiss_indexes(embeddings, kb_dir, args.faiss_index)
+        build_filter_index(text_chunks, indexes, kb_dir)
+        build_bm25_index(text_chunks, kb_dir)
+        publish_version(version, kb_dir)
+        write_manifest(OUTPUT_DIR, data_hash, build_settings, num_chunks, version)
+        print("Knowledge base creation process finished successfully.")
+        exit()
+
     # 2. Create Knowledge Base Chunks (Processes both 'restaurants' and 'indexes')
-    # Pass the full loaded dictionary to the chunking function
-    text_chunks = create_knowledge_base_chunks(full_kb_data)
+    text_chunks = list(make_chunk_iter())
+    print(f"Created a total of {len(text_chunks)} text chunks.")
     if not text_chunks:
         print("No text chunks were created. Exiting.")
+        discard_kb_version(kb_dir)
         exit()
 
-    # 3. Load Embedding Model
-    try:
-        embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-        print(f"Loaded embedding model: {EMBEDDING_MODEL_NAME}")
-    except Exception as e:
-        print(f"Error loading SentenceTransformer model ('{EMBEDDING_MODEL_NAME}'): {e}")
-        print("Please ensure the model name is correct and you have an internet connection.")
-        print("You might need to install required libraries: pip install sentence-transformers numpy")
-        exit()
-
-    # 4. Generate Embeddings for ALL created chunks
-    embeddings = generate_embeddings(text_chunks, embedding_model)
-    # The generate_embeddings function returns an empty array if there was an issue
+    # 3 + 4. Load Embedding Model and Generate Embeddings
+    if args.incremental:
+        # Only new or changed chunks are encoded; the model is loaded only if there are any
+        embeddings = generate_embeddings_incremental(text_chunks, OUTPUT_DIR, backend=args.encoder,
+                                                     precision=args.precision)
+    else:
+        embedding_model = load_embedding_model(backend=args.encoder)
+        if embedding_model is None:
+            discard_kb_version(kb_dir)
+            exit()
+        # Generate Embeddings for ALL created chunks
+        embeddings = generate_embeddings(text_chunks, embedding_model)
+    # Both functions return an empty array if there was an issue
 
     # 5. Save Knowledge Base (Only save if embeddings were successfully generated)
+    saved = False
     if embeddings.size > 0 and len(embeddings) == len(text_chunks):
          # Added check that number of embeddings matches number of chunks
-         save_knowledge_base(text_chunks, embeddings, OUTPUT_DIR)
-         print("Knowledge base creation process finished successfully.")
+         if args.shards > 1:
+             # 6 (sharded). Each shard directory gets its own chunks, embeddings and indexes
+             saved = save_sharded_knowledge_base(text_chunks, embeddings, kb_dir, args.shards, indexes,
+                                                 precision=args.precision, index_types=args.faiss_index)
+         elif save_knowledge_base(text_chunks, embeddings, kb_dir, precision=args.precision):
+             # 6. Build FAISS indexes for the ANN retrieval backends
+             build_faiss_indexes(embeddings, kb_dir, args.faiss_index)
+             build_filter_index(text_chunks, indexes, kb_dir)
+             build_bm25_index(text_chunks, kb_dir)
+             saved = True
+         if saved:
+             # 7. Publish the version, then record the embedding cache and manifest for the next incremental build
+             publish_version(version, kb_dir)
+             save_embedding_cache(OUTPUT_DIR, text_chunks, encoder_id(EMBEDDING_MODEL_NAME, args.encoder), version)
+             write_manifest(OUTPUT_DIR, data_hash, build_settings, len(text_chunks), version)
+             print("Knowledge base creation process finished successfully.")
     elif embeddings.size == 0 and text_chunks:
          print("Embedding generation failed, knowledge base files were not saved.")
     else: # This might happen if text_chunks was empty initially (handled earlier) or size mismatch
-         print("Knowledge base files were not saved due to errors in chunking or embedding generation.")
\ No newline at end of file
+         print("Knowledge base files were not saved due to errors in chunking or embedding generation.")
+    if not saved:
+        discard_kb_version(kb_dir)
@@ -0,0 +1,251 @@
+# metrics.py
+# Timing spans and counters for the RAG pipeline, reported through pluggable sinks (Prometheus text, JSON log).
+import os
+import json
+import atexit
+import time
+import bisect
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# --- Configuration ---
+METRIC_PREFIX = "rag"
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # Seconds
+RECENT_SAMPLES = 1024  # Latest durations kept per stage for the percentiles in snapshot()
+PROMETHEUS_WRITE_INTERVAL = 5.0  # Minimum seconds between rewrites of the Prometheus text file
+SINK_TYPES = ('json', 'prometheus')
+
+
+# --- Registry ---
+class StageStats:
+    """Duration histogram of one pipeline stage, plus its most recent samples."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)  # Non-cumulative; +Inf is `count`
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        position = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if position < len(LATENCY_BUCKETS):
+            self.bucket_counts[position] += 1
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+class Metrics:
+    """Process-wide stage timings and counters.
+
+    span() times a pipeline stage and incr() bumps a counter; both always update
+    the process totals. Inside request(), the spans and counters recorded in the
+    same context are also collected into one record per request, which is handed
+    to every sink when the request ends. Work handed to a thread pool joins the
+    record if it runs in a copy of the caller's context (see search_engine.ShardedSearch);
+    parallel spans of the same stage add up. Spans may nest (e.g. 'top_k_selection'
+    inside 'retrieval'), so stage times do not add up to the request total.
+    """
+
+    def __init__(self, sinks=None):
+        self.stages = {}  # Stage name -> StageStats
+        self.counters = {}  # Counter name -> running total
+        self.sinks = list(sinks or [])
+        self._lock = threading.Lock()
+        self._request = contextvars.ContextVar(f"metrics_request_{id(self)}", default=None)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def _current_request(self):
+        return self._request.get()
+
+    def observe(self, stage, seconds):
+        """Records one duration of `stage` (seconds)."""
+        with self._lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = StageStats()
+            stats.observe(seconds)
+            request = self._current_request()
+            if request is not None:
+                request['spans_ms'][stage] = request['spans_ms'].get(stage, 0.0) + seconds * 1000
+
+    @contextmanager
+    def span(self, stage):
+        """Times the enclosed block as one `stage` duration (recorded even if the block raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def incr(self, name, value=1):
+        """Adds `value` to counter `name`."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            request = self._current_request()
+            if request is not None:
+                request['counters'][name] = request['counters'].get(name, 0) + value
+
+    @contextmanager
+    def request(self, kind='query', **fields):
+        """Collects this context's spans and counters into one record, emitted to the sinks on exit."""
+        if self._current_request() is not None:
+            yield self._current_request()  # Nested request: part of the outer one
+            return
+        record = dict(kind=kind, ts=time.time(), **fields, spans_ms={}, counters={})
+        token = self._request.set(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self._request.reset(token)
+            record['total_ms'] = (time.perf_counter() - start) * 1000
+            self.observe(f"{kind}_total", record['total_ms'] / 1000)
+            for sink in self.sinks:
+                try:
+                    sink.emit(record, self)
+                except Exception as e:
+                    print(f"Warning: Metrics sink {type(sink).__name__} failed ({e}).")
+
+    def snapshot(self):
+        """Current totals: {'stages': {stage: {count, mean_ms, p50_ms, p95_ms}}, 'counters': {...}}."""
+        with self._lock:
+            stages = {
+                stage: {'count': stats.count,
+                        'mean_ms': stats.total / stats.count * 1000 if stats.count else 0.0,
+                        'p50_ms': stats.percentile(50) * 1000,
+                        'p95_ms': stats.percentile(95) * 1000}
+                for stage, stats in self.stages.items()
+            }
+            return {'stages': stages, 'counters': dict(self.counters)}
+
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+            self.counters.clear()
+
+
+# --- Exporters / Sinks ---
+def _metric_name(name):
+    return f"{METRIC_PREFIX}_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_text(metrics):
+    """Renders the totals in the Prometheus text exposition format."""
+    with metrics._lock:
+        stages = sorted(metrics.stages.items())
+        counters = sorted(metrics.counters.items())
+
+    histogram = _metric_name("stage_seconds")
+    lines = [f"# HELP {histogram} Duration of RAG pipeline stages.", f"# TYPE {histogram} histogram"]
+    for stage, stats in stages:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats.bucket_counts):
+            cumulative += count
+            lines.append(f'{histogram}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{histogram}_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+        lines.append(f'{histogram}_sum{{stage="{stage}"}} {stats.total:.6f}')
+        lines.append(f'{histogram}_count{{stage="{stage}"}} {stats.count}')
+    for name, value in counters:
+        counter = _metric_name(name) + "_total"
+        lines += [f"# TYPE {counter} counter", f"{counter} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusTextSink:
+    """Keeps a Prometheus text file up to date (e.g. for node_exporter's textfile collector).
+
+    The file is rewritten atomically after a request, at most every `min_interval`
+    seconds. A request that falls inside the interval schedules one deferred
+    write for the end of it, and pending totals are flushed at exit, so the file
+    never stays behind the last request of a burst.
+    """
+
+    def __init__(self, path, min_interval=PROMETHEUS_WRITE_INTERVAL):
+        self.path = path
+        self.min_interval = min_interval
+        self._last_write = 0.0
+        self._pending = None  # (metrics, timer) of a deferred write
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def emit(self, record, metrics):
+        with self._lock:
+            wait = self._last_write + self.min_interval - time.monotonic()
+            if wait > 0:
+                if self._pending is None:
+                    timer = threading.Timer(wait, self.flush)
+                    timer.daemon = True
+                    self._pending = (metrics, timer)
+                    timer.start()
+                return
+        self._write(metrics)
+
+    def flush(self):
+        """Writes a deferred update now (no-op if none is pending)."""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            pending[1].cancel()
+            self._write(pending[0])
+
+    def _write(self, metrics):
+        with self._lock:
+            self._last_write = time.monotonic()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(prometheus_text(metrics))
+            os.replace(tmp_path, self.path)
+
+
+class JsonLogSink:
+    """Appends one JSON line per finished request to `path` (printed to stdout if path is None or '-')."""
+
+    def __init__(self, path=None):
+        self.path = None if path in (None, '-') else path
+        self._lock = threading.Lock()
+
+    def emit(self, record, metrics):
+        line = json.dumps(record, default=str)
+        if self.path is None:
+            print(f"[metrics] {line}")
+            return
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+
+
+def create_sinks(spec, json_path=None, prometheus_path=None):
+    """Builds sinks from a comma-separated spec such as 'json,prometheus'; unknown names are reported and skipped."""
+    sinks = []
+    for name in filter(None, (part.strip().lower() for part in (spec or "").split(","))):
+        if name == 'json':
+            sinks.append(JsonLogSink(json_path))
+        elif name == 'prometheus' and prometheus_path:
+            sinks.append(PrometheusTextSink(prometheus_path))
+        else:
+            print(f"Warning: Unknown or unconfigured metrics sink '{name}'. Expected one of {SINK_TYPES}.")
+    return sinks
+
+
+# --- Default Registry ---
+METRICS = Metrics()  # Shared by chatbot.py, search_engine.py and app.py
+
+
+def span(stage):
+    """Times a stage on the default registry: `with span('query_encoding'): ...`."""
+    return METRICS.span(stage)
+
+
+def incr(name, value=1):
+    """Bumps a counter on the default registry."""
+    METRICS.incr(name, value)
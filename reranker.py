@@ -0,0 +1,75 @@
+# reranker.py
+# Optional cross-encoder rerank stage between retrieval and generation.
+import time
+import numpy as np
+from caches import LRUCache, normalize_query
+
+# --- Configuration ---
+RERANK_BATCH_SIZE = 32  # (query, chunk) pairs scored per forward pass
+RERANK_MAX_LENGTH = 256  # Token limit per pair; chunks are short, so this only trims outliers
+RERANK_CACHE_SIZE = 8192  # Max cached (query, chunk) scores
+
+
+class CrossEncoderReranker:
+    """Scores (query, chunk) pairs with a local cross-encoder and keeps the best N chunks.
+
+    Scores are cached per normalized query and chunk text, so repeated questions
+    only pay for chunks they have not seen. Timings of the last call and running
+    totals are kept for latency accounting.
+    """
+
+    def __init__(self, model_name, batch_size=RERANK_BATCH_SIZE, max_length=RERANK_MAX_LENGTH,
+                 cache_size=RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache = LRUCache(cache_size)
+        self.model = None
+        self.last_stats = {}
+        self.total_calls = 0
+        self.total_ms = 0.0
+
+    def load(self):
+        """Loads the cross-encoder (imported lazily; sentence-transformers is only needed when reranking)."""
+        if self.model is None:
+            from sentence_transformers import CrossEncoder
+            self.model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self.model
+
+    def score(self, query, chunks):
+        """Returns one relevance score per chunk, scoring uncached pairs in batches."""
+        key_query = normalize_query(query)
+        scores = [self.cache.get((key_query, chunk['content'])) for chunk in chunks]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            pairs = [(query, chunks[i]['content']) for i in missing]
+            predicted = self.load().predict(pairs, batch_size=self.batch_size, show_progress_bar=False)
+            for i, score in zip(missing, np.asarray(predicted, dtype=np.float32).ravel().tolist()):
+                scores[i] = score
+                self.cache.put((key_query, chunks[i]['content']), score)
+        self.last_stats = {'candidates': len(chunks), 'scored': len(missing), 'cached': len(chunks) - len(missing)}
+        return np.asarray(scores, dtype=np.float32)
+
+    def rerank(self, query, chunks, top_n):
+        """Returns the top_n chunks by cross-encoder score, best first.
+
+        Each returned chunk keeps its retrieval score as `retrieval_score`; `score`
+        becomes the rerank score so later stages order by it.
+        """
+        if not chunks:
+            return []
+        start = time.perf_counter()
+        scores = self.score(query, chunks)
+        order = np.argsort(-scores, kind='stable')[:top_n]
+        reranked = [dict(chunks[i], retrieval_score=chunks[i].get('score'), score=float(scores[i])) for i in order]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.last_stats.update(kept=len(reranked), ms=elapsed_ms)
+        self.total_calls += 1
+        self.total_ms += elapsed_ms
+        return reranked
+
+    def stats(self):
+        """Running latency totals plus the stats of the last call."""
+        return dict(self.last_stats, total_calls=self.total_calls,
+                    mean_ms=self.total_ms / self.total_calls if self.total_calls else 0.0,
+                    cache_hits=self.cache.hits, cache_misses=self.cache.misses)
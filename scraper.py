@@ -1,11 +1,21 @@
 import json
 import os
+import gzip
+import hashlib
 import requests
 import pandas as pd
+import numpy as np
 from bs4 import BeautifulSoup
 import re
 import random
+import time
+import argparse
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from kb_store import RESTAURANT_RECORDS_FILE_NAME, save_restaurants_compact
 
 # --- First Code Block (Scraping) ---
 headers = {'User-Agent': 'Mozilla/5.0 (Macintosh;'
@@ -13,31 +23,248 @@ headers = {'User-Agent': 'Mozilla/5.0 (Macintosh;'
                           ' AppleWebKit/537.36 (KHTML, like Gecko)'
                           ' Chrome/83.0.4103.97 Safari/537.36'}
 
-def get_info(url):
+# Concurrent scraping settings (used when get_restaurant_info runs with max_workers > 1)
+SCRAPE_MAX_WORKERS = 8 # Threads fetching pages in parallel
+SCRAPE_MAX_PER_HOST = 4 # Max in-flight requests to any single host
+SCRAPE_REQUESTS_PER_SECOND = 4.0 # Sustained request rate across all threads
+SCRAPE_BURST = 8 # Requests allowed back-to-back before the rate limit kicks in
+SCRAPE_MAX_RETRIES = 3 # Retries for connection errors, timeouts, 429 and 5xx responses
+SCRAPE_BACKOFF_SECONDS = 1.0 # Base delay for exponential backoff between retries
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """ Thread-safe token-bucket rate limiter """
+    def __init__(self, rate, capacity):
+        self.rate = rate # Tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available, then take it """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class PageFetcher:
+    """ Shared pooled HTTP session with per-host concurrency limits, rate limiting and retries """
+    def __init__(self, max_per_host=SCRAPE_MAX_PER_HOST, requests_per_second=SCRAPE_REQUESTS_PER_SECOND,
+                 burst=SCRAPE_BURST, max_retries=SCRAPE_MAX_RETRIES, backoff_seconds=SCRAPE_BACKOFF_SECONDS,
+                 pool_size=SCRAPE_MAX_WORKERS, timeout=10):
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        # Keep enough pooled keep-alive connections for every worker thread
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        self.max_per_host = max_per_host
+        self.host_slots = {}
+        self.host_slots_lock = threading.Lock()
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_slots[host]
+
+    def _backoff_delay(self, attempt, response=None):
+        # Honour a numeric Retry-After header, otherwise back off exponentially with jitter
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_seconds * (2 ** attempt) + random.uniform(0, self.backoff_seconds)
+
+    def get(self, url, extra_headers=None):
+        """ Fetch a URL, retrying transient failures. Raises requests exceptions like requests.get """
+        with self._host_slot(url):
+            for attempt in range(self.max_retries + 1):
+                self.rate_limiter.acquire()
+                response = None
+                try:
+                    response = self.session.get(url, headers=extra_headers, timeout=self.timeout)
+                    if response.status_code not in RETRYABLE_STATUS_CODES or attempt == self.max_retries:
+                        response.raise_for_status()
+                        return response
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    if attempt == self.max_retries:
+                        raise
+                delay = self._backoff_delay(attempt, response)
+                if response is not None:
+                    response.close() # Return the connection to the pool before waiting
+                print(f"[RETRY] {url} (attempt {attempt + 1}/{self.max_retries}) in {delay:.1f}s")
+                time.sleep(delay)
+
+    def close(self):
+        self.session.close()
+
+
+# --- Page Cache ---
+PAGE_CACHE_DIR = "page_cache" # Gzip-compressed HTML of every fetched page
+PAGE_CACHE_TTL_SECONDS = 24 * 60 * 60 # Cached pages newer than this are used without touching the network
+
+
+class PageNotCachedError(Exception):
+    """ Raised in offline replay mode when a URL has no cached page """
+
+
+class PageCache:
+    """ On-disk HTTP page cache with ETag / Last-Modified revalidation
+
+    Each URL is stored as <sha256>.html.gz plus a <sha256>.json metadata file
+    holding the URL, validators and fetch time. Entries younger than the TTL are
+    served directly; older ones are revalidated with a conditional GET, and a
+    304 Not Modified just refreshes their timestamp.
+    """
+    def __init__(self, cache_dir=PAGE_CACHE_DIR, ttl_seconds=PAGE_CACHE_TTL_SECONDS):
+        self.cache_dir = cache_dir
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.html.gz"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def _write_meta(self, meta_path, meta):
+        tmp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path) # Atomic, so concurrent readers never see a partial file
+
+    def lookup(self, url):
+        """ Return (html, meta) for a cached URL, or (None, None) """
+        html_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with gzip.open(html_path, 'rt', encoding='utf-8') as f:
+                return f.read(), meta
+        except (FileNotFoundError, json.JSONDecodeError, OSError, EOFError):
+            return None, None
+
+    def is_fresh(self, meta):
+        return meta is not None and time.time() - meta.get('fetched_at', 0) < self.ttl_seconds
+
+    def validators(self, meta):
+        """ Conditional request headers for revalidating a cached page """
+        conditional = {}
+        if meta and meta.get('etag'):
+            conditional['If-None-Match'] = meta['etag']
+        if meta and meta.get('last_modified'):
+            conditional['If-Modified-Since'] = meta['last_modified']
+        return conditional
+
+    def store(self, url, html, response_headers):
+        html_path, meta_path = self._paths(url)
+        tmp_path = f"{html_path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp_path, html_path)
+        self._write_meta(meta_path, {
+            'url': url,
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'fetched_at': time.time()
+        })
+
+    def touch(self, url, meta):
+        """ Mark a cached page as fresh again after a 304 Not Modified """
+        _, meta_path = self._paths(url)
+        self._write_meta(meta_path, dict(meta, fetched_at=time.time()))
+
+
+def fetch_page(url, fetcher=None, page_cache=None, offline=False):
+    """ Return the HTML of a page, going through the page cache when one is given """
+    cached_html, meta = page_cache.lookup(url) if page_cache is not None else (None, None)
+    if cached_html is not None and (offline or page_cache.is_fresh(meta)):
+        return cached_html
+    if offline:
+        raise PageNotCachedError(f"No cached page for {url} (offline replay mode)")
+
+    conditional = page_cache.validators(meta) if cached_html is not None else {}
+    if fetcher is not None:
+        webpage = fetcher.get(url, extra_headers=conditional) # Pooled, rate-limited and retried; raises on bad status codes
+    else:
+        webpage = requests.get(url, headers={**headers, **conditional}, timeout=10) # Increased timeout
+        webpage.raise_for_status() # Raise an exception for bad status codes
+
+    if webpage.status_code == 304 and cached_html is not None:
+        page_cache.touch(url, meta)
+        return cached_html
+    if page_cache is not None:
+        page_cache.store(url, webpage.text, webpage.headers)
+    return webpage.text
+
+
+# --- JSON-LD Extraction ---
+USE_FAST_JSONLD = True # Scan raw HTML for JSON-LD scripts before falling back to a full BeautifulSoup parse
+LD_JSON_SCRIPT_RE = re.compile(
+    r'<script\b[^>]*\btype\s*=\s*["\']?application/ld\+json["\']?[^>]*>(.*?)</script\s*>',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def extract_ld_json_fast(html):
+    """ Return the contents of all <script type="application/ld+json"> blocks using a regex scan """
+    return LD_JSON_SCRIPT_RE.findall(html)
+
+
+def extract_ld_json_soup(html):
+    """ Return the contents of all JSON-LD script blocks using a full lxml BeautifulSoup parse """
+    html_text = BeautifulSoup(html, 'lxml')
+    return [script.string for script in html_text.find_all('script', type='application/ld+json')]
+
+
+def find_restaurant_schema(scripts):
+    """ Return the first Restaurant / LocalBusiness schema dict among JSON-LD script texts """
+    info = None
+
+    for script in scripts:
+        try:
+            parsed = json.loads(script)
+            # Handle cases where the top level is an array of schemas
+            if isinstance(parsed, list):
+                for item in parsed:
+                    if isinstance(item, dict) and item.get('@type') in ['Restaurant', 'LocalBusiness']:
+                         info = item
+                         break
+            elif isinstance(parsed, dict) and parsed.get('@type') in ['Restaurant', 'LocalBusiness']:
+                info = parsed
+                break
+        except Exception:
+            continue
+
+    return info
+
+
+def extract_restaurant_schema(html, fast=USE_FAST_JSONLD):
+    """ Find the restaurant schema in a page, trying the regex scan first and the DOM parse as a fallback """
+    if fast:
+        info = find_restaurant_schema(extract_ld_json_fast(html))
+        if info:
+            return info
+    return find_restaurant_schema(extract_ld_json_soup(html))
+
+
+def get_info(url, fetcher=None, page_cache=None, offline=False):
     """ Get Information about the restaurant from URL """
-    global headers
     try:
-        webpage = requests.get(url, headers=headers, timeout=10) # Increased timeout
-        webpage.raise_for_status() # Raise an exception for bad status codes
-        html_text = BeautifulSoup(webpage.text, 'lxml')
-
-        scripts = html_text.find_all('script', type='application/ld+json')
-        info = None
-
-        for script in scripts:
-            try:
-                parsed = json.loads(script.string)
-                # Handle cases where the top level is an array of schemas
-                if isinstance(parsed, list):
-                    for item in parsed:
-                        if isinstance(item, dict) and item.get('@type') in ['Restaurant', 'LocalBusiness']:
-                             info = item
-                             break
-                elif isinstance(parsed, dict) and parsed.get('@type') in ['Restaurant', 'LocalBusiness']:
-                    info = parsed
-                    break
-            except Exception:
-                continue
+        info = extract_restaurant_schema(fetch_page(url, fetcher, page_cache, offline))
 
         if not info:
             print(f"[WARNING] Structured data not found for URL: {url}")
@@ -62,6 +289,9 @@ def get_info(url):
 
         )
         return data
+    except PageNotCachedError as e:
+        print(f"[WARNING] {e}")
+        return [None]*9
     except requests.exceptions.RequestException as e:
         print(f"[ERROR] Request failed for URL {url}: {e}")
         return [None]*9 # Return None for all expected columns on failure
@@ -76,13 +306,28 @@ def save_df(file_name, df):
     print(f"Dataframe saved to {file_name}")
 
 
-def get_restaurant_info(url_list, save=True, file_name="Restaurants.csv"):
-    """ Get Restaurant Information from all urls passed """
+def get_restaurant_info(url_list, save=True, file_name="Restaurants.csv", max_workers=1,
+                        page_cache=None, offline=False):
+    """ Get Restaurant Information from all urls passed
+
+    Pages are fetched through one shared PageFetcher (pooled connections, rate
+    limiting and retries), concurrently when max_workers > 1; rows still come out
+    in the same order as url_list.
+    With a page_cache, pages are cached on disk and revalidated; offline=True
+    replays purely from that cache without any network access.
+    """
 
     # Collecting the data
-    data = []
-    for url in url_list:
-        data.append(get_info(url))
+    fetcher = PageFetcher(pool_size=max(1, max_workers))
+    try:
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # executor.map yields results in input order, so the CSV row order is deterministic
+                data = list(executor.map(lambda url: get_info(url, fetcher, page_cache, offline), url_list))
+        else:
+            data = [get_info(url, fetcher, page_cache, offline) for url in url_list]
+    finally:
+        fetcher.close()
 
     # Creating the DataFrame
     # Ensure column count matches data returned by get_info
@@ -114,6 +359,7 @@ class RestaurantKnowledgeBase:
             'by_opening_status': defaultdict(list),
             'by_price_range': defaultdict(list) # This index is built during build_knowledge_base
         }
+        self._base_menu_cache = {} # Template menu per distinct cuisine list (the random beverages are added per row)
         self.menu_templates = {
             'Chinese': [
                 {"name": "Vegetable Spring Rolls", "price": 120, "category": "Starters"},
@@ -152,15 +398,14 @@ class RestaurantKnowledgeBase:
         }
 
 
-    def _generate_menu(self, cuisines):
-        """Generate a menu based on restaurant cuisines"""
+    def _base_menu(self, cuisines):
+        """Template menu items for a list of cuisines, cached per distinct cuisine list"""
+        key = tuple(cuisines)
+        if key in self._base_menu_cache:
+            return self._base_menu_cache[key]
+
         menu = []
         seen_items = set()
-
-        # Handle cases where cuisines might be None or not iterable
-        if not isinstance(cuisines, list):
-             cuisines = []
-
         for cuisine in cuisines:
             base_cuisine = next((c for c in self.menu_templates.keys() if isinstance(cuisine, str) and c.lower() in cuisine.lower()), None)
             if base_cuisine:
@@ -169,6 +414,17 @@ class RestaurantKnowledgeBase:
                         menu.append(item)
                         seen_items.add(item['name'])
 
+        self._base_menu_cache[key] = menu
+        return menu
+
+    def _generate_menu(self, cuisines):
+        """Generate a menu based on restaurant cuisines"""
+        # Handle cases where cuisines might be None or not iterable
+        if not isinstance(cuisines, list):
+             cuisines = []
+
+        menu = list(self._base_menu(cuisines)) # Copy, since beverages are appended per restaurant
+
         beverages = [
             {"name": "Mineral Water", "price": 30, "category": "Beverages"},
             {"name": "Fresh Lime Soda", "price": 60, "category": "Beverages"},
@@ -233,8 +489,63 @@ class RestaurantKnowledgeBase:
         return opening_str.strip()
 
 
-    def preprocess_data(self):
-        """Clean and normalize the raw data"""
+    # Compiled patterns for the vectorized preprocessing path
+    TODAY_RE = re.compile(r'\(Today\)', re.IGNORECASE)
+    TOMORROW_RE = re.compile(r'Opens tomorrow', re.IGNORECASE)
+    TOMORROW_TIME_RE = re.compile(r'^Opens tomorrow at (\d+:\d+|\d+)\s*(am|pm)', re.IGNORECASE)
+    AM_PM_SPACING_RE = re.compile(r'(\d)(am|pm)', re.IGNORECASE)
+
+    def _opening_columns_vectorized(self, opening):
+        """Vectorized equivalent of _parse_opening_status and _normalize_opening_hours over a column
+
+        Opening-hours strings repeat heavily across restaurants, so the string ops
+        run once per distinct value and are broadcast back with the factorized codes.
+        """
+        codes, uniques = pd.factorize(opening)
+        text = pd.Series(uniques, dtype=object).astype(str)
+
+        status = np.select(
+            [text.str.contains(self.TODAY_RE), text.str.contains(self.TOMORROW_RE)],
+            ['open_today', 'opens_tomorrow'],
+            default='unknown'
+        )
+
+        tomorrow = text.str.extract(self.TOMORROW_TIME_RE)
+        tomorrow_text = 'Opens tomorrow at ' + tomorrow[0] + tomorrow[1].str.lower()
+        today_text = (text.str.replace('(Today)', '', regex=False).str.strip()
+                      .str.replace('12midnight', '12:00am', regex=False)
+                      .str.replace('12noon', '12:00pm', regex=False)
+                      .str.replace('–', '-', regex=False)
+                      .str.replace(self.AM_PM_SPACING_RE, r'\1 \2', regex=True)
+                      .str.strip())
+        normalized = text.str.strip()
+        normalized = normalized.mask(text.str.contains('(Today)', regex=False), today_text)
+        normalized = normalized.mask(tomorrow[0].notna(), tomorrow_text)
+
+        # Code -1 marks missing opening hours: status 'unknown', normalized None
+        present = codes >= 0
+        status_col = np.where(present, np.append(status, 'unknown')[codes], 'unknown')
+        normalized_col = np.append(normalized.to_numpy(dtype=object), None)[codes]
+        return (pd.Series(status_col, index=opening.index, dtype=object),
+                pd.Series(normalized_col, index=opening.index, dtype=object))
+
+    def _full_address_vectorized(self, address_cols):
+        """Vectorized equivalent of joining the non-missing address parts with ', '"""
+        full_address = pd.Series(np.nan, index=self.df.index, dtype=object)
+        for col in address_cols:
+            part = self.df[col].astype(str).str.strip()
+            part = part.where(self.df[col].notna() & (part != 'None'))
+            joined = full_address + ', ' + part
+            full_address = joined.where(full_address.notna() & part.notna(), full_address.fillna(part))
+        return full_address.fillna('')
+
+    def preprocess_data(self, vectorized=False):
+        """Clean and normalize the raw data
+
+        vectorized=True replaces the row-wise apply calls with pandas string ops
+        and compiled regexes; both paths produce the same columns, with None (never
+        NaN, which json.dump writes as invalid JSON) for missing values.
+        """
         # Ensure columns exist before trying to process
         if 'Phone' in self.df.columns:
              self.df['Phone'] = self.df['Phone'].astype(str).str.replace('"', '').str.replace("'", "").str.strip() # Convert to str first
@@ -253,9 +564,12 @@ class RestaurantKnowledgeBase:
         else:
              self.df['Locality'] = None
 
-        if 'Opening_Hours' in self.df.columns:
+        if 'Opening_Hours' in self.df.columns and vectorized:
+             self.df['Opening_Status'], self.df['Opening_Hours_Normalized'] = self._opening_columns_vectorized(self.df['Opening_Hours'])
+        elif 'Opening_Hours' in self.df.columns:
              self.df['Opening_Status'] = self.df['Opening_Hours'].apply(self._parse_opening_status)
-             self.df['Opening_Hours_Normalized'] = self.df['Opening_Hours'].apply(self._normalize_opening_hours)
+             normalized = self.df['Opening_Hours'].apply(self._normalize_opening_hours)
+             self.df['Opening_Hours_Normalized'] = normalized.astype(object).where(normalized.notna(), None) # apply() turns None into NaN
         else:
              self.df['Opening_Status'] = 'unknown'
              self.df['Opening_Hours_Normalized'] = None
@@ -267,10 +581,14 @@ class RestaurantKnowledgeBase:
             if col not in self.df.columns:
                  self.df[col] = None # Add missing address columns
 
-        self.df['Full_Address'] = self.df.apply(
-            lambda row: ', '.join(str(row[col]).strip() for col in address_cols if pd.notna(row[col]) and str(row[col]).strip() != 'None'),
-            axis=1
-        ).replace('', None) # Replace empty strings with None if all parts were missing/None
+        if vectorized:
+            full_address = self._full_address_vectorized(address_cols)
+        else:
+            full_address = self.df.apply(
+                lambda row: ', '.join(str(row[col]).strip() for col in address_cols if pd.notna(row[col]) and str(row[col]).strip() != 'None'),
+                axis=1
+            )
+        self.df['Full_Address'] = full_address.astype(object).where(full_address != '', None) # None (not NaN) if all parts were missing/None
 
         # Clean up 'Name' column
         if 'Name' in self.df.columns:
@@ -279,8 +597,15 @@ class RestaurantKnowledgeBase:
             self.df['Name'] = None
 
 
-    def build_knowledge_base(self):
-        """Create structured knowledge base with indexing"""
+    def build_knowledge_base(self, vectorized=False):
+        """Create structured knowledge base with indexing
+
+        vectorized=True preprocesses with pandas string ops, assembles entries from
+        column arrays instead of iterrows, and builds the indexes with group-by.
+        """
+        if vectorized:
+            return self._build_knowledge_base_vectorized()
+
         # Ensure data is preprocessed before building KB
         self.preprocess_data()
 
@@ -335,6 +660,84 @@ class RestaurantKnowledgeBase:
             # Index by price range (using the generated one)
             self.indexes['by_price_range'][price_range].append(restaurant_id)
 
+    def _build_knowledge_base_vectorized(self):
+        """Column-wise equivalent of build_knowledge_base's iterrows loop"""
+        self.preprocess_data(vectorized=True)
+        df = self.df
+
+        valid = df['Name'].notna() & (df['Name'] != '')
+        for index in df.index[~valid]:
+            print(f"[WARNING] Skipping row {index} due to missing name.")
+        df = df[valid]
+        restaurant_ids = ('rest_' + df.index.astype(str)).tolist()
+
+        def values_or_none(col):
+            return df[col].astype(object).where(df[col].notna(), None).tolist()
+
+        # Menus are generated row by row (the beverage sample is random per restaurant),
+        # but the template part comes from _base_menu's per-cuisine-list cache
+        menus_and_prices = [self._generate_menu(cuisines) for cuisines in df['Cuisine']]
+        price_ranges = [price_range for _, price_range in menus_and_prices]
+
+        # Split phone strings in one pass; missing numbers become [None] as in the row-wise path
+        phones = df['Phone'].astype(str).str.split(',').tolist()
+        phone_present = df['Phone'].notna().tolist()
+        phone_lists = []
+        for parts, present in zip(phones, phone_present):
+            numbers = [p.strip() for p in parts if p.strip() != '' and p.strip() != 'nan'] if present else []
+            phone_lists.append(numbers or [None])
+
+        columns = zip(
+            restaurant_ids, df['Name'].tolist(), values_or_none('Street'), values_or_none('Locality'),
+            values_or_none('Region'), values_or_none('PostalCode'), values_or_none('Country'),
+            df['Full_Address'].tolist(), phone_lists, df['Cuisine'].tolist(), values_or_none('Opening_Hours'),
+            df['Opening_Hours_Normalized'].tolist(), df['Opening_Status'].tolist(), menus_and_prices
+        )
+        for (restaurant_id, name, street, locality, region, postal_code, country, full_address,
+             phone_numbers, cuisine, raw_hours, normalized_hours, status, (menu, price_range)) in columns:
+            self.knowledge_base[restaurant_id] = {
+                'name': name,
+                'address': {
+                    'street': street,
+                    'locality': locality,
+                    'region': region,
+                    'postal_code': postal_code,
+                    'country': country,
+                    'full_address': full_address
+                },
+                'contact': {
+                    'phone': phone_numbers
+                },
+                'cuisine': cuisine if isinstance(cuisine, list) else [], # Ensure cuisine is a list
+                'opening_info': {
+                    'raw': raw_hours,
+                    'normalized': normalized_hours,
+                    'status': status
+                },
+                'menu': menu,
+                'price_range': price_range
+            }
+
+        # Build the indexes with a factorize-based group-by: codes follow first appearance,
+        # and a stable sort keeps row order within each group, like the row-wise appends
+        ids = np.array(restaurant_ids, dtype=object)
+        cuisines = df['Cuisine'].explode()
+        cuisine_names = cuisines.astype(object).str.strip()
+        cuisines = cuisines[cuisine_names.fillna('') != ''] # Only valid, non-empty cuisine strings
+        row_positions = pd.Series(np.arange(len(df)), index=df.index)
+        locality_present = df['Locality'].notna().to_numpy()
+        index_sources = {
+            'by_cuisine': (cuisines.str.lower().str.strip(), ids[row_positions.loc[cuisines.index].to_numpy()]),
+            'by_location': (df['Locality'][locality_present].str.strip(), ids[locality_present]),
+            'by_opening_status': (df['Opening_Status'], ids),
+            'by_price_range': (pd.Series(price_ranges, dtype=object), ids),
+        }
+        for index_name, (keys, key_ids) in index_sources.items():
+            codes, uniques = pd.factorize(keys.to_numpy(dtype=object))
+            order = np.argsort(codes, kind='stable')
+            group_ends = np.cumsum(np.bincount(codes, minlength=len(uniques)))[:-1]
+            for key, group in zip(uniques, np.split(key_ids[order], group_ends)):
+                self.indexes[index_name][key].extend(group.tolist())
 
     def save_knowledge_base(self, file_name="restaurants.json"):
         """Save knowledge base to a JSON file"""
@@ -353,9 +756,28 @@ class RestaurantKnowledgeBase:
             print(f"Error saving knowledge base: {e}")
             return False
 
+    def save_knowledge_base_compact(self, file_name=RESTAURANT_RECORDS_FILE_NAME):
+        """Save knowledge base as gzip NDJSON (one restaurant per line) plus a separate index section"""
+        try:
+            records_path, indexes_path = save_restaurants_compact(dict(self.knowledge_base), dict(self.indexes), file_name)
+            print(f"Knowledge base saved to {os.path.abspath(records_path)} (indexes: {indexes_path})")
+            return True
+        except Exception as e:
+            print(f"Error saving compact knowledge base: {e}")
+            return False
+
 
 # --- Execution ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape Zomato restaurant pages and build restaurants.json.")
+    parser.add_argument("--replay", action="store_true",
+                        help=f"Rebuild from pages cached in {PAGE_CACHE_DIR}/ without any network access.")
+    parser.add_argument("--no-cache", action="store_true", help="Fetch every page without the on-disk page cache.")
+    parser.add_argument("--format", choices=["json", "compact", "both"], default="both",
+                        help=f"Output: pretty-printed restaurants.json, compact {RESTAURANT_RECORDS_FILE_NAME} "
+                             "(streamed by knowledge_base.py), or both.")
+    args = parser.parse_args()
+
     # Define the list of URLs to scrape
     urls = [
         'https://www.zomato.com/roorkee/tamarind-restaurant-roorkee-locality/order',
@@ -374,8 +796,10 @@ if __name__ == "__main__":
     csv_output_file = "Restaurants.csv"
 
     # --- Step 1: Scrape data and save to CSV ---
-    print(f"Scraping data from {len(urls)} URLs...")
-    restaurant_df = get_restaurant_info(urls, file_name=csv_output_file)
+    page_cache = None if args.no_cache else PageCache()
+    print(f"{'Replaying cached pages for' if args.replay else 'Scraping data from'} {len(urls)} URLs...")
+    restaurant_df = get_restaurant_info(urls, file_name=csv_output_file, max_workers=SCRAPE_MAX_WORKERS,
+                                        page_cache=page_cache, offline=args.replay)
 
     # Check if the CSV was created and has data
     if os.path.exists(csv_output_file) and not restaurant_df.empty:
@@ -391,14 +815,19 @@ if __name__ == "__main__":
             # Let's keep the call in __init__ for robustness if preprocess_data is refactored later.
             # kb.preprocess_data() # Preprocessing happens in __init__ or start of build_knowledge_base
 
-            kb.build_knowledge_base() # This now includes preprocessing steps
+            kb.build_knowledge_base(vectorized=True) # This now includes preprocessing steps
 
             # Define the name for the final JSON knowledge base file
             json_output_file = "restaurants.json"
 
-            # Save the knowledge base to the specified JSON file
-            if kb.save_knowledge_base(file_name=json_output_file):
-                 print(f"Knowledge base successfully created and saved to {json_output_file}.")
+            # Save the knowledge base to the specified JSON file and/or the compact records file
+            saved = True
+            if args.format in ("json", "both"):
+                saved = kb.save_knowledge_base(file_name=json_output_file) and saved
+            if args.format in ("compact", "both"):
+                saved = kb.save_knowledge_base_compact() and saved
+            if saved:
+                 print(f"Knowledge base successfully created and saved ({args.format} format).")
             else:
                  print("Failed to save the knowledge base.")
 
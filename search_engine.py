@@ -0,0 +1,407 @@
+# search_engine.py
+import os
+import re
+import math
+import contextvars
+import numpy as np
+from metrics import span
+
+faiss = None  # Optional, imported on first use: only needed for the FAISS search backends
+
+# --- Configuration ---
+FAISS_INDEX_TYPES = ('flat', 'ivf', 'hnsw')
+HNSW_M = 32  # Graph neighbours per node for HNSW indexes
+HNSW_EF_CONSTRUCTION = 200  # Build-time search depth for HNSW indexes
+
+
+# --- Helper Functions ---
+def normalize_rows(matrix):
+    """Returns an L2-normalized float32 copy of a 2-D embedding matrix."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0  # All-zero rows stay zero instead of dividing by zero
+    return matrix / norms
+
+
+def top_k_indices(scores, k):
+    """Returns the indices of the k highest scores, sorted best first.
+
+    Works on a 1-D score vector or row-wise on a 2-D (queries x chunks) score matrix.
+    """
+    num_scores = scores.shape[-1]
+    k = min(k, num_scores)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+
+    # Using partition is more efficient than a full argsort for finding top k
+    if k < num_scores:
+        partitioned = np.argpartition(scores, -k, axis=-1)[..., -k:]
+    else:
+        partitioned = np.broadcast_to(np.arange(num_scores), scores.shape).copy()
+    # Sort only the top k indices by score, highest first
+    partitioned_scores = np.take_along_axis(scores, partitioned, axis=-1)
+    order = np.argsort(-partitioned_scores, axis=-1, kind='stable')
+    return np.take_along_axis(partitioned, order, axis=-1)
+
+
+# --- Search Engines ---
+class DenseSearchEngine:
+    """Exact cosine-similarity search over the knowledge base embedding matrix.
+
+    The matrix is normalized once at construction, so scoring a query is a single
+    matrix-vector product instead of one cosine computation per chunk.
+
+    Matrices that are already unit-length (normalized=True) are used as-is, which
+    keeps memory-mapped and reduced-precision (float16/int8) storage shared and
+    compact; those are scored block by block, and int8 rows are rescaled by `scales`.
+    """
+
+    def __init__(self, embeddings, scales=None, normalized=False, block_size=65536):
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings)
+        self.scales = None if scales is None else np.asarray(scales, dtype=np.float32)
+        self.block_size = block_size
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    def score(self, query_embeddings, candidate_ids=None):
+        """Returns a (num_queries x num_chunks) matrix of cosine similarities.
+
+        With candidate_ids, only those rows are scored and the columns follow candidate_ids.
+        """
+        queries = normalize_rows(query_embeddings)
+        matrix = self.embeddings if candidate_ids is None else self.embeddings[candidate_ids]
+        scales = self.scales if candidate_ids is None or self.scales is None else self.scales[candidate_ids]
+        if matrix.dtype == np.float32:
+            scores = queries @ matrix.T
+        else:
+            # Upcast one block at a time so reduced-precision storage is never fully copied
+            scores = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+            for start in range(0, matrix.shape[0], self.block_size):
+                block = np.asarray(matrix[start:start + self.block_size], dtype=np.float32)
+                scores[:, start:start + block.shape[0]] = queries @ block.T
+        if scales is not None:
+            scores *= scales
+        return scores
+
+    def search(self, query_embedding, top_k, candidate_ids=None):
+        """Returns (indices, scores) of the top_k chunks for a single query."""
+        indices, scores = self.search_batch([query_embedding], top_k, candidate_ids)[0]
+        return indices, scores
+
+    def search_batch(self, query_embeddings, top_k, candidate_ids=None):
+        """Returns a list of (indices, scores) pairs, one per query, best match first.
+
+        candidate_ids (e.g. from a metadata FilterIndex) restricts scoring to those chunk rows.
+        """
+        if len(self) == 0 or (candidate_ids is not None and len(candidate_ids) == 0):
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in query_embeddings]
+
+        with span('similarity_scoring'):
+            similarities = self.score(query_embeddings, candidate_ids)
+        with span('top_k_selection'):
+            top_indices = top_k_indices(similarities, top_k)
+            top_scores = np.take_along_axis(similarities, top_indices, axis=-1)
+        if candidate_ids is not None:
+            top_indices = np.asarray(candidate_ids)[top_indices]  # Map subset positions back to chunk rows
+        return list(zip(top_indices, top_scores))
+
+
+# --- FAISS Indexes ---
+def faiss_index_path(kb_dir, index_type):
+    """Returns the file path of a FAISS index of the given type inside the KB directory."""
+    return os.path.join(kb_dir, f"faiss_{index_type}.index")
+
+
+def _require_faiss():
+    global faiss
+    if faiss is None:
+        try:
+            import faiss as faiss_module
+        except ImportError:
+            raise ImportError("faiss is not installed. Install it with: pip install faiss-cpu")
+        faiss = faiss_module
+
+
+def build_faiss_index(embeddings, index_type='flat', nlist=None):
+    """Builds an inner-product FAISS index over L2-normalized embeddings.
+
+    Inner product on normalized vectors equals cosine similarity, so all index
+    types return the same scores as DenseSearchEngine (exactly for 'flat',
+    approximately for 'ivf' and 'hnsw').
+    """
+    _require_faiss()
+    if index_type not in FAISS_INDEX_TYPES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}'. Expected one of {FAISS_INDEX_TYPES}.")
+
+    vectors = normalize_rows(embeddings)
+    num_vectors, dim = vectors.shape
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == 'ivf':
+        # Rule of thumb: about 4 * sqrt(N) inverted lists, with enough vectors
+        # per list (FAISS wants ~39) for k-means training to be meaningful
+        if nlist is None:
+            nlist = min(int(4 * math.sqrt(num_vectors)), num_vectors // 39)
+        nlist = max(1, min(nlist, num_vectors))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+
+    index.add(vectors)
+    return index
+
+
+def save_faiss_index(index, path):
+    """Writes a FAISS index to disk."""
+    _require_faiss()
+    faiss.write_index(index, path)
+
+
+def load_faiss_index(path):
+    """Reads a FAISS index from disk."""
+    _require_faiss()
+    return faiss.read_index(path)
+
+
+class FaissSearchEngine:
+    """Approximate (or exact, for flat indexes) search backed by a prebuilt FAISS index.
+
+    Exposes the same search/search_batch interface as DenseSearchEngine.
+    """
+
+    def __init__(self, index, nprobe=16, ef_search=128):
+        _require_faiss()
+        self.index = index
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        # Query-time accuracy/speed knobs; ignored by index types that do not use them
+        if hasattr(index, 'nprobe'):
+            index.nprobe = nprobe
+        if hasattr(index, 'hnsw'):
+            index.hnsw.efSearch = ef_search
+
+    def _search_params(self, candidate_ids):
+        """FAISS search parameters restricting results to candidate_ids."""
+        selector = faiss.IDSelectorBatch(np.asarray(candidate_ids, dtype=np.int64))
+        if hasattr(self.index, 'nprobe'):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        if hasattr(self.index, 'hnsw'):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+        return faiss.SearchParameters(sel=selector)
+
+    def __len__(self):
+        return self.index.ntotal
+
+    def search(self, query_embedding, top_k, candidate_ids=None):
+        """Returns (indices, scores) of the top_k chunks for a single query."""
+        return self.search_batch([query_embedding], top_k, candidate_ids)[0]
+
+    def search_batch(self, query_embeddings, top_k, candidate_ids=None):
+        """Returns a list of (indices, scores) pairs, one per query, best match first.
+
+        candidate_ids restricts results to those chunk rows via a FAISS ID selector.
+        """
+        queries = normalize_rows(query_embeddings)
+        top_k = min(top_k, len(self) if candidate_ids is None else len(candidate_ids))
+        if top_k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+
+        with span('ann_search'):  # FAISS scores and selects the top k in one call
+            if candidate_ids is None:
+                scores, indices = self.index.search(queries, top_k)
+            else:
+                scores, indices = self.index.search(queries, top_k, params=self._search_params(candidate_ids))
+        results = []
+        for row_indices, row_scores in zip(indices, scores):
+            found = row_indices >= 0  # FAISS pads with -1 when fewer than top_k hits are found
+            results.append((row_indices[found].astype(np.int64), row_scores[found]))
+        return results
+
+
+# --- Lexical (BM25) Index ---
+BM25_INDEX_FILE_NAME = "bm25_index.npz"
+BM25_K1 = 1.5  # Term-frequency saturation
+BM25_B = 0.75  # Document-length normalization
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercased alphanumeric tokens, shared by index build and query time."""
+    return TOKEN_RE.findall(str(text).lower())
+
+
+class BM25Index:
+    """BM25 inverted index over chunk contents.
+
+    Postings are stored CSR-style (term offsets into flat doc-id/weight arrays) with
+    the full BM25 term weight precomputed per posting, so scoring a query is one
+    bincount over the postings of its terms.
+    """
+
+    def __init__(self, vocab, term_offsets, doc_ids, weights, num_docs):
+        self.vocab = vocab  # term -> term id
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.num_docs = num_docs
+
+    def __len__(self):
+        return self.num_docs
+
+    @classmethod
+    def build(cls, texts, k1=BM25_K1, b=BM25_B):
+        """Builds the index from an iterable of chunk contents (row order = chunk ids)."""
+        postings = {}  # term -> {doc id: term frequency}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for token in tokens:
+                term_docs = postings.setdefault(token, {})
+                term_docs[doc_id] = term_docs.get(doc_id, 0) + 1
+
+        num_docs = len(doc_lengths)
+        doc_lengths = np.asarray(doc_lengths, dtype=np.float32)
+        avg_length = float(doc_lengths.mean()) if num_docs else 0.0
+
+        vocab = {}
+        term_offsets = [0]
+        doc_id_parts, weight_parts = [], []
+        for term, term_docs in postings.items():
+            vocab[term] = len(vocab)
+            docs = np.fromiter(term_docs.keys(), dtype=np.int64, count=len(term_docs))
+            tf = np.fromiter(term_docs.values(), dtype=np.float32, count=len(term_docs))
+            idf = math.log(1 + (num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = k1 * (1 - b + b * doc_lengths[docs] / (avg_length or 1.0))
+            doc_id_parts.append(docs)
+            weight_parts.append((idf * tf * (k1 + 1) / (tf + norm)).astype(np.float32))
+            term_offsets.append(term_offsets[-1] + len(docs))
+
+        doc_ids = np.concatenate(doc_id_parts) if doc_id_parts else np.empty(0, dtype=np.int64)
+        weights = np.concatenate(weight_parts) if weight_parts else np.empty(0, dtype=np.float32)
+        return cls(vocab, np.asarray(term_offsets, dtype=np.int64), doc_ids, weights, num_docs)
+
+    def slice(self, start, end):
+        """Index over chunks start..end (renumbered from 0) that keeps this index's IDF and length stats.
+
+        Used for KB shards, so shard scores match the unsharded index exactly.
+        """
+        keep = (self.doc_ids >= start) & (self.doc_ids < end)
+        term_offsets = np.concatenate([[0], np.cumsum(keep)]).astype(np.int64)[self.term_offsets]
+        return BM25Index(self.vocab, term_offsets, self.doc_ids[keep] - start, self.weights[keep], end - start)
+
+    def save(self, output_dir):
+        terms = np.array(sorted(self.vocab, key=self.vocab.get), dtype=str)
+        np.savez(os.path.join(output_dir, BM25_INDEX_FILE_NAME), terms=terms, term_offsets=self.term_offsets,
+                 doc_ids=self.doc_ids, weights=self.weights, num_docs=np.array(self.num_docs))
+
+    @classmethod
+    def load(cls, kb_dir):
+        with np.load(os.path.join(kb_dir, BM25_INDEX_FILE_NAME)) as saved:
+            vocab = {term: i for i, term in enumerate(saved['terms'].tolist())}
+            return cls(vocab, saved['term_offsets'], saved['doc_ids'], saved['weights'], int(saved['num_docs']))
+
+    def score(self, query):
+        """Returns a BM25 score for every chunk (zero for chunks sharing no term with the query)."""
+        term_ids = {self.vocab[token] for token in tokenize(query) if token in self.vocab}
+        if not term_ids:
+            return np.zeros(self.num_docs, dtype=np.float32)
+        spans = [slice(self.term_offsets[t], self.term_offsets[t + 1]) for t in term_ids]
+        docs = np.concatenate([self.doc_ids[span] for span in spans])
+        weights = np.concatenate([self.weights[span] for span in spans])
+        return np.bincount(docs, weights=weights, minlength=self.num_docs).astype(np.float32)
+
+    def search(self, query, top_k, candidate_ids=None):
+        """Returns (indices, scores) of the top_k lexical matches, best first; only chunks with score > 0."""
+        with span('lexical_scoring'):
+            scores = self.score(query)
+            if candidate_ids is not None:
+                scores = scores[candidate_ids]
+        with span('top_k_selection'):
+            top = top_k_indices(scores, top_k)
+            top = top[scores[top] > 0]
+        top_scores = scores[top]
+        if candidate_ids is not None:
+            top = np.asarray(candidate_ids)[top]
+        return top, top_scores
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses ranked id lists with Reciprocal Rank Fusion: score(d) = sum over lists of 1 / (k + rank).
+
+    Returns (indices, fused_scores) sorted best first.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(np.asarray(ranking).tolist()):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return (np.array([doc_id for doc_id, _ in ordered], dtype=np.int64),
+            np.array([score for _, score in ordered], dtype=np.float32))
+
+
+# --- Sharded Search ---
+class ShardedSearch:
+    """Scatter-gather search over per-shard engines, addressed by global row ids.
+
+    Works with any engine exposing search(query, top_k, candidate_ids) (dense or
+    BM25) and, for dense engines, search_batch. Shards are searched in parallel on
+    `executor` (NumPy and FAISS release the GIL while scoring); each shard's local
+    rows are shifted by its offset and the per-shard top-k lists are merged.
+    """
+
+    def __init__(self, engines, offsets, executor):
+        self.engines = engines
+        self.offsets = offsets  # Global row id of each shard's first row, plus the total
+        self.executor = executor
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _shard_candidates(self, candidate_ids):
+        """Splits global candidate ids into local ids per shard (None = no restriction)."""
+        if candidate_ids is None:
+            return [None] * len(self.engines)
+        ids = np.asarray(candidate_ids, dtype=np.int64)
+        return [ids[(ids >= start) & (ids < end)] - start for start, end in zip(self.offsets[:-1], self.offsets[1:])]
+
+    def _scatter(self, method, query, top_k, candidate_ids):
+        """Submits method(query, top_k, local candidates) to every shard that can match; returns (offset, future)s."""
+        jobs = []
+        for engine, offset, local_ids in zip(self.engines, self.offsets, self._shard_candidates(candidate_ids)):
+            if local_ids is not None and len(local_ids) == 0:
+                continue  # No candidates in this shard
+            # Each job runs in its own copy of this context, so its spans join the caller's metrics request
+            jobs.append((offset, self.executor.submit(contextvars.copy_context().run, getattr(engine, method),
+                                                      query, top_k, local_ids)))
+        return jobs
+
+    @staticmethod
+    def _merge(shard_results, top_k):
+        """Merges (offset, (indices, scores)) pairs into the global top_k, best first."""
+        if not shard_results:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate([np.asarray(indices, dtype=np.int64) + offset for offset, (indices, _) in shard_results])
+        scores = np.concatenate([np.asarray(scores) for _, (_, scores) in shard_results])
+        top = top_k_indices(scores, top_k)
+        return ids[top], scores[top]
+
+    def search(self, query, top_k, candidate_ids=None):
+        """Returns (global indices, scores) of the top_k chunks across all shards."""
+        jobs = self._scatter('search', query, top_k, candidate_ids)
+        results = [(offset, future.result()) for offset, future in jobs]
+        with span('shard_merge'):
+            return self._merge(results, top_k)
+
+    def search_batch(self, queries, top_k, candidate_ids=None):
+        """Returns a list of (global indices, scores) pairs, one per query."""
+        jobs = [(offset, future.result()) for offset, future in self._scatter('search_batch', queries, top_k, candidate_ids)]
+        with span('shard_merge'):
+            return [self._merge([(offset, results[q]) for offset, results in jobs], top_k) for q in range(len(queries))]
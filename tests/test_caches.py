@@ -0,0 +1,47 @@
+# tests/test_caches.py
+import numpy as np
+from caches import QueryEmbeddingCache, normalize_query
+
+
+class CountingEncoder:
+    """Stand-in for the embedding model: a fixed vector per text, recording every batch it encodes."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, queries):
+        self.batches.append(list(queries))
+        return np.array([[len(q), q.count(' '), 1.0] for q in queries], dtype=np.float32)
+
+
+def test_normalize_query():
+    assert normalize_query("  Which restaurants serve   Biryani?? ") == "which restaurants serve biryani"
+    assert normalize_query("Hangries.") == normalize_query("hangries")
+
+
+def test_equivalent_queries_are_encoded_once():
+    encoder = CountingEncoder()
+    cache = QueryEmbeddingCache('test-model', maxsize=16)
+
+    first = cache.encode(["Chicken Tikka?", "chicken   tikka", "Hangries"], encoder)
+    second = cache.encode(["CHICKEN TIKKA", "Hangries!"], encoder)
+
+    assert encoder.batches == [["Chicken Tikka?", "Hangries"]]
+    assert first.shape == (3, 3)
+    np.testing.assert_array_equal(first[0], first[1])
+    np.testing.assert_array_equal(second, first[[0, 2]])
+
+
+def test_cache_persists_to_npz_per_model(tmp_path):
+    path = str(tmp_path / "query_cache.npz")
+    cache = QueryEmbeddingCache('test-model', path=path)
+    expected = cache.encode(["Chicken Tikka", "Hangries"], CountingEncoder())
+    cache.save()
+
+    restored = QueryEmbeddingCache('test-model', path=path)
+    assert restored.load() == 2
+    encoder = CountingEncoder()
+    np.testing.assert_array_equal(restored.encode(["chicken tikka?", "hangries"], encoder), expected)
+    assert encoder.batches == []
+
+    assert QueryEmbeddingCache('other-model', path=path).load() == 0  # Vectors from another model are never served
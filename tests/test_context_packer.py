@@ -0,0 +1,53 @@
+# tests/test_context_packer.py
+from context_packer import TokenCounter, pack_context
+
+
+def word_counter():
+    return TokenCounter(lambda text: text.split())  # One token per word keeps the budget arithmetic readable
+
+
+def chunk(content, score):
+    return {'content': content, 'score': score}
+
+
+def test_packs_best_first_within_budget():
+    chunks = [
+        chunk("three word chunk", 0.5),
+        chunk("the best scoring chunk here", 0.9),   # 5 tokens
+        chunk("a long chunk that will not fit in what is left", 0.8),
+        chunk("small one", 0.1),
+    ]
+
+    packed = pack_context(chunks, max_tokens=11, counter=word_counter())
+
+    # 5 + (1 separator + 3) = 9; the 11-token chunk is skipped, then "small one" needs 1 + 2 = 3 > 2
+    assert [c['content'] for c in packed.chunks] == ["the best scoring chunk here", "three word chunk"]
+    assert packed.tokens == 9 and packed.tokens <= packed.max_tokens
+    assert [(c['content'], reason) for c, reason in packed.dropped] == [
+        ("a long chunk that will not fit in what is left", 'over budget'), ("small one", 'over budget')]
+    assert packed.text == "the best scoring chunk here\nthree word chunk"
+
+
+def test_smaller_chunk_fills_remaining_budget():
+    chunks = [chunk("one two three four", 0.9), chunk("five six seven eight nine", 0.8), chunk("ten", 0.1)]
+
+    packed = pack_context(chunks, max_tokens=6, counter=word_counter())
+
+    assert [c['content'] for c in packed.chunks] == ["one two three four", "ten"]
+    assert packed.tokens == 6
+
+
+def test_duplicates_are_dropped():
+    chunks = [
+        chunk("Menu Item: Chicken Tikka. Price: 250.", 0.9),
+        chunk("menu item:   chicken tikka. price: 250.", 0.8),      # Same text up to case/spacing
+        chunk("Chicken Tikka", 0.7),                                # Contained in the first chunk
+        chunk("Price: 250. Menu Item: Chicken Tikka.", 0.6),        # Same token set
+        chunk("Menu Item: Paneer Tikka. Price: 220.", 0.5),
+    ]
+
+    packed = pack_context(chunks, max_tokens=100, counter=word_counter())
+
+    assert [c['score'] for c in packed.chunks] == [0.9, 0.5]
+    assert [reason for _, reason in packed.dropped] == ['duplicate'] * 3
+    assert packed.summary() == "Packed 2/5 chunks (13/100 tokens); dropped 3 duplicate"
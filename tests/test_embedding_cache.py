@@ -0,0 +1,66 @@
+# tests/test_embedding_cache.py
+import hashlib
+import itertools
+import os
+import numpy as np
+from kb_store import KB_CURRENT_FILE_NAME, KB_VERSIONS_DIR_NAME, save_embeddings
+from knowledge_base import EMBEDDING_CACHE_FILE_NAME, chunk_cache_key, load_embedding_cache, save_embedding_cache
+from search_engine import normalize_rows
+
+MODEL_NAME = 'test-model'
+
+
+def _content_with_nul_terminated_digest():
+    """Chunk content whose raw SHA-256 cache digest ends in a NUL byte (about 1 in 256 contents)."""
+    for i in itertools.count():
+        content = f"Menu Item: Dish {i}"
+        if hashlib.sha256(f"{MODEL_NAME}\0{content}".encode('utf-8')).digest().endswith(b'\x00'):
+            return content
+
+
+def _publish(kb_root, version, embeddings, precision='float32'):
+    version_dir = os.path.join(kb_root, KB_VERSIONS_DIR_NAME, version)
+    os.makedirs(version_dir)
+    save_embeddings(embeddings, version_dir, precision)
+    with open(os.path.join(kb_root, KB_CURRENT_FILE_NAME), 'w', encoding='utf-8') as f:
+        f.write(version + "\n")
+
+
+def test_cache_round_trip_keeps_keys_with_nul_digest(tmp_path):
+    chunks = [{'content': _content_with_nul_terminated_digest()}, {'content': "Restaurant: Rustic House"}]
+    embeddings = np.arange(2 * 4, dtype=np.float32).reshape(2, 4)
+    save_embeddings(embeddings, str(tmp_path))  # Flat (unversioned) KB
+
+    save_embedding_cache(str(tmp_path), chunks, MODEL_NAME)
+    cache = load_embedding_cache(str(tmp_path))
+
+    for chunk, vector in zip(chunks, normalize_rows(embeddings)):
+        key = chunk_cache_key(chunk['content'], MODEL_NAME)
+        assert key in cache
+        np.testing.assert_allclose(cache[key], vector, rtol=1e-6)
+
+
+def test_cache_reads_vectors_from_its_published_version(tmp_path):
+    chunks = [{'content': f"Menu Item: Dish {i}"} for i in range(5)]
+    embeddings = np.random.default_rng(0).normal(size=(5, 8)).astype(np.float32)
+    _publish(str(tmp_path), '20250101-120000', embeddings)
+    save_embedding_cache(str(tmp_path), chunks, MODEL_NAME, '20250101-120000')
+    _publish(str(tmp_path), '20250102-120000', embeddings[::-1])  # A later build the cache wasn't saved for
+
+    with np.load(os.path.join(tmp_path, EMBEDDING_CACHE_FILE_NAME)) as saved:
+        assert sorted(saved.files) == ['keys', 'version']  # No second copy of the vectors
+    cache = load_embedding_cache(str(tmp_path))
+    for chunk, vector in zip(chunks, normalize_rows(embeddings)):
+        np.testing.assert_allclose(cache[chunk_cache_key(chunk['content'], MODEL_NAME)], vector, rtol=1e-6)
+
+
+def test_lossy_cache_is_ignored_for_another_precision(tmp_path):
+    chunks = [{'content': f"Menu Item: Dish {i}"} for i in range(3)]
+    embeddings = np.random.default_rng(1).normal(size=(3, 8)).astype(np.float32)
+    _publish(str(tmp_path), '20250101-120000', embeddings, 'int8')
+    save_embedding_cache(str(tmp_path), chunks, MODEL_NAME, '20250101-120000')
+
+    assert load_embedding_cache(str(tmp_path), 'float32') == {}
+    cache = load_embedding_cache(str(tmp_path), 'int8')
+    vector = cache[chunk_cache_key(chunks[0]['content'], MODEL_NAME)]
+    np.testing.assert_allclose(vector, normalize_rows(embeddings)[0], atol=0.01)
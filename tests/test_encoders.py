@@ -0,0 +1,32 @@
+# tests/test_encoders.py
+import os
+from encoders import sample_kb_sentences
+from kb_store import new_kb_version, publish_kb_version, save_chunk_store, write_shard_manifest
+
+
+def _chunks(start, count):
+    return [{'content': f"Menu Item: Dish {i}", 'type': 'menu_item'} for i in range(start, start + count)]
+
+
+def test_sample_reads_current_version_of_versioned_kb(tmp_path):
+    version, staging_dir = new_kb_version(str(tmp_path))
+    save_chunk_store(_chunks(0, 10), staging_dir)
+    publish_kb_version(str(tmp_path), version, staging_dir)
+
+    sentences = sample_kb_sentences(str(tmp_path), 4)
+
+    assert len(sentences) == 4
+    assert sentences[0] == "Menu Item: Dish 0" and sentences[-1] == "Menu Item: Dish 9"
+
+
+def test_sample_spans_all_shards(tmp_path):
+    for shard, start in enumerate((0, 5)):
+        os.makedirs(tmp_path / f"shard_{shard}")
+        save_chunk_store(_chunks(start, 5), str(tmp_path / f"shard_{shard}"))
+    write_shard_manifest(str(tmp_path), ["shard_0", "shard_1"], [5, 5])
+
+    assert sample_kb_sentences(str(tmp_path), 512) == [f"Menu Item: Dish {i}" for i in range(10)]
+
+
+def test_sample_returns_none_without_chunks(tmp_path):
+    assert sample_kb_sentences(str(tmp_path), 512) is None
@@ -0,0 +1,171 @@
+# tests/test_generation.py
+import threading
+import time
+import pytest
+from generation import (CancelToken, GenerationBlocked, GenerationCancelled, GenerationError, GenerationTimeout,
+                        Generator, StubGenerator, create_generator)
+
+PROMPT = "Context Information:\n---\nRestaurant: Rustic House.\nMenu Item: Paneer Tikka.\n---\nQuestion: paneer?"
+
+
+class FlakyGenerator(Generator):
+    """Fails the first `failures` attempts (or always raises `error`), recording when each attempt started."""
+
+    name = 'flaky'
+
+    def __init__(self, failures=0, error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.error = error
+        self.attempts = []
+
+    def _generate_once(self, prompt, timeout):
+        self.attempts.append(time.monotonic())
+        if self.error is not None:
+            raise self.error
+        if len(self.attempts) <= self.failures:
+            raise ConnectionError("transient")
+        return "ok"
+
+    def _stream_once(self, prompt, timeout):
+        yield self._generate_once(prompt, timeout)
+
+
+def test_stub_is_deterministic_and_sized():
+    generator = StubGenerator(output_chars=120, chunk_chars=25)
+
+    text = generator.generate(PROMPT)
+    parts = list(generator.stream(PROMPT))
+
+    assert text == generator.generate(PROMPT) == "".join(parts)
+    assert len(text) <= 120 and "Paneer Tikka" in text
+    assert max(map(len, parts)) == 25
+
+
+def test_stub_latency():
+    generator = StubGenerator(latency=0.3, first_token_latency=0.1, output_chars=200, chunk_chars=50)
+    start = time.monotonic()
+    parts = generator.stream(PROMPT)
+    next(parts)
+    first = time.monotonic() - start
+    list(parts)
+    total = time.monotonic() - start
+    assert 0.08 <= first < 0.25 and 0.25 <= total < 0.6
+
+
+def test_timeout_is_retried_then_raised():
+    generator = StubGenerator(latency=0.5, timeout=0.1, retries=1, retry_backoff=0.01)
+    start = time.monotonic()
+    with pytest.raises(GenerationTimeout):
+        generator.generate(PROMPT)
+    assert time.monotonic() - start < 0.4  # Two 0.1 s attempts, not the stub's 0.5 s each
+
+
+def test_stream_timeout_between_parts():
+    generator = StubGenerator(latency=0.1, first_token_latency=0.5, timeout=0.1, retries=0)
+    with pytest.raises(GenerationTimeout):
+        list(generator.stream(PROMPT))
+
+
+def test_retries_with_exponential_backoff():
+    generator = FlakyGenerator(failures=2, retries=2, retry_backoff=0.05)
+
+    assert generator.generate(PROMPT) == "ok"
+
+    gaps = [b - a for a, b in zip(generator.attempts, generator.attempts[1:])]
+    assert len(generator.attempts) == 3
+    assert 0.05 <= gaps[0] < 0.1 <= gaps[1] < 0.3  # 0.05 s, then 0.1 s
+
+
+def test_gives_up_after_retries():
+    generator = FlakyGenerator(failures=5, retries=2, retry_backoff=0.0)
+    with pytest.raises(GenerationError, match="transient"):
+        generator.generate(PROMPT)
+    assert len(generator.attempts) == 3
+
+
+def test_blocked_is_not_retried():
+    generator = FlakyGenerator(error=GenerationBlocked('SAFETY'), retries=3, retry_backoff=0.0)
+    with pytest.raises(GenerationBlocked):
+        list(generator.stream(PROMPT))
+    assert len(generator.attempts) == 1
+
+
+def test_stub_error_rate_is_retried():
+    generator = StubGenerator(error_rate=0.5, seed=3, retries=10, retry_backoff=0.0)
+    assert all(generator.generate(PROMPT) for _ in range(5))
+
+
+def test_cancel_token_stops_generation_and_stream():
+    cancel = CancelToken()
+    threading.Timer(0.1, cancel.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(GenerationCancelled):
+        StubGenerator(latency=2.0).generate(PROMPT, cancel=cancel)
+    assert time.monotonic() - start < 0.5
+
+    cancel = CancelToken()
+    parts = []
+    with pytest.raises(GenerationCancelled):
+        for part in StubGenerator(latency=2.0, output_chars=400, chunk_chars=40).stream(PROMPT, cancel=cancel):
+            parts.append(part)
+            cancel.cancel()
+    assert len(parts) == 1
+
+
+def test_cancel_during_backoff():
+    cancel = CancelToken()
+    threading.Timer(0.1, cancel.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(GenerationCancelled):
+        FlakyGenerator(failures=5, retries=3, retry_backoff=5.0).generate(PROMPT, cancel=cancel)
+    assert time.monotonic() - start < 1.0
+
+
+def test_create_generator():
+    assert isinstance(create_generator('stub', latency=0.0), StubGenerator)
+    with pytest.raises(ValueError, match="GOOGLE_API_KEY"):
+        create_generator('gemini', model_name='gemini-2.0-flash', api_key=None)
+    with pytest.raises(ValueError):
+        create_generator('llama')
+
+
+class HangingGenerator(Generator):
+    """The first call blocks until `release` is set; later calls answer at once."""
+
+    name = 'hanging'
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def _generate_once(self, prompt, timeout):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait()
+        return "ok"
+
+
+def test_hung_call_does_not_hold_a_concurrency_slot():
+    generator = HangingGenerator(timeout=0.1, retries=0, max_concurrency=1)
+    try:
+        with pytest.raises(GenerationTimeout):
+            generator.generate(PROMPT)
+        assert generator.generate(PROMPT) == "ok"  # The only slot was freed although call 1 still hangs
+    finally:
+        generator.release.set()
+
+
+def test_callers_wait_for_a_free_slot():
+    generator = HangingGenerator(timeout=0.2, retries=0, max_concurrency=1)
+    try:
+        worker = threading.Thread(target=lambda: pytest.raises(GenerationTimeout, generator.generate, PROMPT))
+        worker.start()
+        time.sleep(0.05)
+        generator.timeout = 0.05
+        with pytest.raises(GenerationTimeout, match="busy"):
+            generator.generate(PROMPT)
+        worker.join()
+    finally:
+        generator.release.set()
@@ -0,0 +1,119 @@
+# tests/test_kb_store.py
+import os
+import numpy as np
+import pytest
+from kb_store import (KB_CURRENT_FILE_NAME, KB_VERSIONS_DIR_NAME, ChunkStore, ChunkStoreWriter, EmbeddingWriter,
+                      FilterIndex, build_filter_postings, load_embeddings, prune_kb_versions, quantize_embeddings, save_chunk_store, save_embeddings,
+                      save_filter_index)
+from search_engine import DenseSearchEngine, normalize_rows
+
+
+def _embeddings(rows=50, dim=16, seed=0):
+    embeddings = np.random.default_rng(seed).normal(size=(rows, dim)).astype(np.float32)
+    embeddings[3] = 0.0  # All-zero row
+    embeddings[7] *= 1000.0  # Large-norm row
+    return embeddings
+
+
+def test_int8_round_trip_with_per_row_scales():
+    embeddings = _embeddings()
+
+    quantized, scales = quantize_embeddings(embeddings, 'int8')
+
+    assert quantized.dtype == np.int8 and scales.shape == (len(embeddings),)
+    assert np.abs(quantized).max(axis=1)[[0, 7]].tolist() == [127, 127]  # Each row uses the full int8 range
+    restored = quantized.astype(np.float32) * scales[:, None]
+    np.testing.assert_allclose(restored, normalize_rows(embeddings), atol=0.5 / 127)
+    assert not restored[3].any()
+
+
+def test_saved_precisions_score_like_float32(tmp_path):
+    embeddings = _embeddings()
+    query = np.random.default_rng(1).normal(size=16).astype(np.float32)
+    expected = DenseSearchEngine(embeddings).score(query)
+
+    for precision in ('float32', 'float16', 'int8'):
+        kb_dir = tmp_path / precision
+        os.makedirs(kb_dir)
+        save_embeddings(embeddings, str(kb_dir), precision)
+        matrix, scales, normalized = load_embeddings(str(kb_dir))
+
+        assert matrix.dtype == np.dtype(precision) and normalized
+        assert (scales is not None) == (precision == 'int8')
+        scores = DenseSearchEngine(matrix, scales=scales, normalized=True).score(query)
+        np.testing.assert_allclose(scores, expected, atol=0.02)
+
+
+def test_chunk_store_round_trip(tmp_path):
+    chunks = [
+        {'restaurant_id': 'rest_0', 'restaurant_name': "Rustic House", 'type': 'general',
+         'content': "Restaurant: Rustic House. Cuisine: North Indian."},
+        {'restaurant_id': 'rest_0', 'restaurant_name': "Rustic House", 'type': 'menu_item',
+         'item_name': "Paneer Tikka", 'content': "Menu Item: Paneer Tikka. Price: ₹220.00."},
+        {'restaurant_id': 'rest_1', 'restaurant_name': "Hangries", 'type': 'general', 'content': ""},
+        {'restaurant_id': 'rest_1', 'type': 'menu_item', 'item_name': None, 'content': "Menu Item: Café Latte"},
+    ]
+
+    assert save_chunk_store(chunks, str(tmp_path)) == len(chunks)
+    store = ChunkStore(str(tmp_path))
+
+    expected = [{key: value for key, value in chunk.items() if value is not None} for chunk in chunks]
+    assert len(store) == len(chunks)
+    assert [store[i] for i in range(len(store))] == expected
+    assert list(store) == expected
+    assert store[-1] == expected[-1]
+    assert [store.content(i) for i in range(len(store))] == [chunk['content'] for chunk in chunks]
+    assert store.offsets.tolist() == np.cumsum([0] + [len(c['content'].encode('utf-8')) for c in chunks]).tolist()
+    assert store.categories['restaurant_name'] == ["Rustic House", "Hangries"]
+    assert store.codes['item_name'].tolist() == [-1, 0, -1, -1]
+
+
+def test_writers_abort_releases_partial_files(tmp_path):
+    chunk_writer = ChunkStoreWriter(str(tmp_path))
+    embedding_writer = EmbeddingWriter(str(tmp_path), 'int8')
+    chunk_writer.add({'content': "Paneer tikka", 'type': 'menu_item'})
+    embedding_writer.add(_embeddings()[:1])
+    chunk_writer.abort()
+    embedding_writer.abort()
+    assert chunk_writer.text_file.closed and embedding_writer.part_file.closed
+    assert not os.path.exists(embedding_writer.part_path)
+
+
+def test_filter_index_ors_values_and_intersects_fields(tmp_path):
+    chunks = [
+        {'restaurant_id': 'rest_0', 'type': 'general'},    # 0
+        {'restaurant_id': 'rest_0', 'type': 'menu_item'},  # 1
+        {'restaurant_id': 'rest_1', 'type': 'general'},    # 2
+        {'restaurant_id': 'rest_1', 'type': 'menu_item'},  # 3
+        {'restaurant_id': 'rest_2', 'type': 'menu_item'},  # 4
+        {'type': 'index_summary'},                         # 5
+    ]
+    indexes = {
+        'by_cuisine': {'Biryani': ['rest_1'], 'North Indian': ['rest_0', 'rest_2']},
+        'by_location': {'Civil Lines, Roorkee': ['rest_0'], 'Adarsh Nagar, Roorkee': ['rest_1']},
+    }
+    save_filter_index(build_filter_postings(chunks, indexes), str(tmp_path))
+    index = FilterIndex(str(tmp_path))
+
+    assert index.candidate_ids(None) is None
+    assert index.candidate_ids({'cuisine': None}) is None
+    assert index.candidate_ids({'cuisine': 'north indian'}).tolist() == [0, 1, 4]
+    assert index.candidate_ids({'cuisine': ['Biryani', 'North Indian'], 'type': 'menu_item'}).tolist() == [1, 3, 4]
+    assert index.candidate_ids({'locality': 'roorkee', 'type': 'general'}).tolist() == [0, 2]  # Substring match
+    assert index.candidate_ids({'cuisine': 'biryani', 'locality': 'civil lines'}).tolist() == []
+    assert index.candidate_ids({'cuisine': 'thai'}).tolist() == []
+    with pytest.raises(ValueError):
+        index.candidate_ids({'rating': 5})
+
+
+def test_prune_keeps_newest_same_second_builds(tmp_path):
+    versions_dir = tmp_path / KB_VERSIONS_DIR_NAME
+    names = ["20250101-120000", "20250101-120000-2", "20250101-120000-10", "20250101-120000-11"]
+    for name in names:
+        os.makedirs(versions_dir / name)
+    (tmp_path / KB_CURRENT_FILE_NAME).write_text("20250101-120000-11\n")
+
+    removed = prune_kb_versions(str(tmp_path), keep=2)
+
+    assert sorted(removed) == ["20250101-120000", "20250101-120000-2"]
+    assert sorted(os.listdir(versions_dir)) == ["20250101-120000-10", "20250101-120000-11"]
@@ -0,0 +1,44 @@
+# tests/test_metrics.py
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from metrics import Metrics, PrometheusTextSink
+
+
+def test_request_collects_spans_from_pool_threads_run_in_copied_context():
+    metrics = Metrics()
+
+    def shard_work():
+        with metrics.span('similarity_scoring'):
+            metrics.incr('shards_searched')
+
+    with ThreadPoolExecutor(max_workers=2) as executor, metrics.request('chat') as record:
+        futures = [executor.submit(contextvars.copy_context().run, shard_work) for _ in range(3)]
+        for future in futures:
+            future.result()
+        executor.submit(shard_work).result()  # Not in the request's context: process totals only
+
+    assert 'similarity_scoring' in record['spans_ms']
+    assert record['counters'] == {'shards_searched': 3}
+    assert metrics.snapshot()['counters'] == {'shards_searched': 4}
+
+
+def test_prometheus_sink_writes_requests_skipped_by_rate_limit(tmp_path):
+    metrics = Metrics()
+    path = str(tmp_path / "metrics.prom")
+    sink = PrometheusTextSink(path, min_interval=0.2)
+    metrics.add_sink(sink)
+
+    for _ in range(3):  # A burst inside one interval: only the first request is written right away
+        with metrics.request('chat'):
+            metrics.incr('generations')
+    assert "rag_generations_total 1\n" in open(path).read()
+
+    time.sleep(0.5)  # The deferred write lands once the interval is over
+    assert "rag_generations_total 3\n" in open(path).read()
+
+    for _ in range(2):
+        with metrics.request('chat'):
+            metrics.incr('generations')
+    sink.flush()  # Run at exit: writes the deferred update without waiting
+    assert "rag_generations_total 5\n" in open(path).read()
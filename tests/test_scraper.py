@@ -0,0 +1,61 @@
+# tests/test_scraper.py
+import json
+import random
+import pandas as pd
+import pytest
+import scraper
+from scraper import RestaurantKnowledgeBase, get_restaurant_info
+
+ROWS = [
+    {'Name': "Rustic House", 'Cuisine': "['North Indian', 'Chinese']", 'Phone': '"+91 9876543210"',
+     'Street': "12 Civil Lines", 'Locality': "Civil Lines", 'Region': "Roorkee", 'PostalCode': 247667,
+     'Country': "India", 'Opening_Hours': "12noon – 12midnight (Today)"},
+    {'Name': "Hangries", 'Cuisine': "['Biryani']", 'Phone': None, 'Street': None, 'Locality': "Adarsh Nagar",
+     'Region': "Roorkee", 'PostalCode': None, 'Country': "India", 'Opening_Hours': "Opens tomorrow at 11am"},
+    {'Name': "Baba Dhaba", 'Cuisine': None, 'Phone': '"+91 9000000000, +91 9111111111"', 'Street': None,
+     'Locality': None, 'Region': None, 'PostalCode': None, 'Country': None, 'Opening_Hours': None},
+]
+
+
+def build(csv_path, vectorized):
+    random.seed(0)  # Same beverage samples for both paths
+    kb = RestaurantKnowledgeBase(str(csv_path))
+    kb.build_knowledge_base(vectorized=vectorized)
+    # allow_nan=False: a NaN would be written as invalid JSON by scraper.py's json.dump
+    return json.dumps({'restaurants': kb.knowledge_base, 'indexes': kb.indexes}, allow_nan=False, default=str)
+
+
+def test_rowwise_and_vectorized_builds_match(tmp_path):
+    csv_path = tmp_path / "restaurants.csv"
+    pd.DataFrame(ROWS).to_csv(csv_path, index=False)
+
+    rowwise = build(csv_path, vectorized=False)
+    vectorized = build(csv_path, vectorized=True)
+
+    assert rowwise == vectorized
+    assert json.loads(rowwise)['restaurants']['rest_2']['opening_info']['normalized'] is None
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+
+    def __init__(self, url):
+        schema = {'@type': 'Restaurant', 'name': url.rsplit('/', 1)[-1], 'address': {'addressLocality': "Roorkee"}}
+        self.text = f'<script type="application/ld+json">{json.dumps(schema)}</script>'
+
+
+@pytest.mark.parametrize('max_workers', [1, 3])
+def test_every_worker_count_fetches_through_page_fetcher(monkeypatch, max_workers):
+    fetched = []
+
+    def fake_get(self, url, extra_headers=None):
+        fetched.append(url)
+        return FakeResponse(url)
+
+    monkeypatch.setattr(scraper.PageFetcher, 'get', fake_get)
+    monkeypatch.setattr(scraper.requests, 'get', lambda *args, **kwargs: pytest.fail("bypassed the PageFetcher"))
+    urls = [f"https://example.com/restaurant-{i}" for i in range(5)]
+    info_df = get_restaurant_info(urls, save=False, max_workers=max_workers)
+    assert sorted(fetched) == urls
+    assert list(info_df['Name']) == [url.rsplit('/', 1)[-1] for url in urls]
@@ -0,0 +1,109 @@
+# tests/test_search_engine.py
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from kb_store import shard_offsets, shard_ranges
+from search_engine import BM25_B, BM25_K1, BM25Index, DenseSearchEngine, ShardedSearch, reciprocal_rank_fusion, tokenize
+
+DOCS = [
+    "Menu Item: Chicken Tikka. Restaurant: Rustic House.",
+    "Menu Item: Paneer Tikka. Restaurant: Rustic House.",
+    "Menu Item: Chicken Biryani. Restaurant: Hangries.",
+    "Restaurant: Hangries. Cuisine: Biryani, North Indian. Biryani is their specialty.",
+    "Restaurant: Baba Dhaba. Open today.",
+]
+
+
+def reference_bm25(query, docs, k1=BM25_K1, b=BM25_B):
+    """Textbook BM25 (with the non-negative IDF variant) for comparison."""
+    tokenized = [tokenize(doc) for doc in docs]
+    avg_length = sum(map(len, tokenized)) / len(tokenized)
+    scores = []
+    for tokens in tokenized:
+        score = 0.0
+        for term in set(tokenize(query)):
+            tf = tokens.count(term)
+            df = sum(term in doc for doc in tokenized)
+            if tf:
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / avg_length))
+        scores.append(score)
+    return np.array(scores, dtype=np.float32)
+
+
+def test_bm25_scores_match_reference():
+    index = BM25Index.build(DOCS)
+    for query in ["chicken tikka", "Biryani at Hangries?", "biryani biryani", "sushi"]:
+        np.testing.assert_allclose(index.score(query), reference_bm25(query, DOCS), rtol=1e-5)
+
+
+def test_bm25_search_ranks_and_filters(tmp_path):
+    index = BM25Index.build(DOCS)
+    index.save(str(tmp_path))
+    index = BM25Index.load(str(tmp_path))
+
+    ids, scores = index.search("chicken tikka", top_k=10)
+    assert ids.tolist()[:1] == [0]  # Both terms
+    assert set(ids.tolist()) == {0, 1, 2}  # Only chunks sharing a term
+    assert np.all(np.diff(scores) <= 0)
+
+    ids, _ = index.search("chicken tikka", top_k=10, candidate_ids=np.array([1, 2, 4]))
+    assert set(ids.tolist()) == {1, 2}  # 4 is a candidate but matches neither term
+    assert index.search("sushi", top_k=10)[0].size == 0
+
+
+def test_bm25_slice_keeps_global_scores():
+    index = BM25Index.build(DOCS)
+    full = index.score("biryani hangries")
+    np.testing.assert_allclose(index.slice(2, 5).score("biryani hangries"), full[2:5])
+
+
+def test_reciprocal_rank_fusion_ordering():
+    dense = [3, 1, 2]
+    lexical = [1, 4, 3]
+
+    ids, scores = reciprocal_rank_fusion([dense, lexical], k=60)
+
+    # 1: 1/62 + 1/61, 3: 1/61 + 1/63, then 4 (rank 2) ahead of 2 (rank 3)
+    assert ids.tolist() == [1, 3, 4, 2]
+    np.testing.assert_allclose(scores, [1 / 62 + 1 / 61, 1 / 61 + 1 / 63, 1 / 62, 1 / 63], rtol=1e-6)
+    assert reciprocal_rank_fusion([[], []])[0].size == 0
+
+
+def test_sharded_search_merges_global_top_k():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(103, 8)).astype(np.float32)
+    queries = rng.normal(size=(4, 8)).astype(np.float32)
+    ranges = shard_ranges(len(embeddings), 4)
+    full = DenseSearchEngine(embeddings)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sharded = ShardedSearch([DenseSearchEngine(embeddings[start:end]) for start, end in ranges],
+                                shard_offsets([end - start for start, end in ranges]), executor)
+        assert len(sharded) == len(embeddings)
+
+        for query in queries:
+            ids, scores = sharded.search(query, top_k=10)
+            expected_ids, expected_scores = full.search(query, top_k=10)
+            assert ids.tolist() == expected_ids.tolist()
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+        candidates = np.array([2, 5, 60, 61, 99, 102])  # None in the second shard
+        ids, _ = sharded.search(queries[0], top_k=3, candidate_ids=candidates)
+        assert ids.tolist() == full.search(queries[0], top_k=3, candidate_ids=candidates)[0].tolist()
+
+        batch = sharded.search_batch(queries, top_k=5)
+        for (ids, _), (expected_ids, _) in zip(batch, full.search_batch(queries, top_k=5)):
+            assert ids.tolist() == expected_ids.tolist()
+
+
+def test_sharded_bm25_matches_unsharded():
+    index = BM25Index.build(DOCS)
+    ranges = [(0, 2), (2, 5)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        sharded = ShardedSearch([index.slice(start, end) for start, end in ranges],
+                                shard_offsets([end - start for start, end in ranges]), executor)
+        ids, scores = sharded.search("chicken biryani hangries", top_k=3)
+    expected_ids, expected_scores = index.search("chicken biryani hangries", top_k=3)
+    assert ids.tolist() == expected_ids.tolist()
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-6)